@@ -10,10 +10,19 @@ from .reports import (
     export_msgpack,
     export_json,
     export_groups_by_stations,
+    export_report,
     export_hourly_sql,
+    export_stations_sql,
+    export_station_index,
+    export_columnar_report,
+    read_columnar_report,
+    export_flow_index,
+    read_flow_index,
+    export_sketches,
+    read_sketches,
 )
 from .summarize import Summarizer
-from .utils import get_months, touchdir, WorkingPaths
+from .utils import get_months, days_in_months, months_in_range, touchdir, WorkingPaths
 
 __all__ = [
     "Main",
@@ -0,0 +1,135 @@
+from pathlib import Path
+import hashlib
+import logging
+import os
+import pickle
+import time
+
+import pandas as pd
+from geopandas.array import GeometryDtype
+
+from .utils import touchdir
+
+# Bump when a stage's output format changes, to drop every old entry
+CACHE_VERSION = 1
+MAX_BYTES = 2 << 30  # 2 Gibibytes
+MISSING = object()
+
+
+def fingerprint(value) -> str:
+    """Summarize a stage input for its cache key.
+    Files are identified by path, size and mtime; DataFrames by a hash of their contents.
+
+    Args:
+        value: Path, DataFrame, Index, list of those, or anything with a stable repr
+
+    Returns:
+        str: Fingerprint
+    """
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(fingerprint(v) for v in value) + "]"
+    if isinstance(value, Path) and value.is_file():
+        stat = value.stat()
+        return f"file:{value}:{stat.st_size}:{stat.st_mtime_ns}"
+    if isinstance(value, pd.DataFrame):
+        frame = value.copy(deep=False)
+        for column in frame.columns:
+            if isinstance(frame[column].dtype, GeometryDtype):
+                frame[column] = frame[column].to_wkb(hex=True)
+        hashes = pd.util.hash_pandas_object(frame, index=True).to_numpy()
+        digest = hashlib.sha256(hashes.tobytes())
+        digest.update(repr(list(zip(frame.columns, frame.dtypes))).encode())
+        return f"frame:{digest.hexdigest()}"
+    if isinstance(value, (pd.Index, pd.Series)):
+        hashes = pd.util.hash_pandas_object(value).to_numpy()
+        return f"{type(value).__name__}:{hashlib.sha256(hashes.tobytes()).hexdigest()}"
+    return repr(value)
+
+
+class StageCache:
+    """Pickled outputs of pipeline stages, keyed by a hash of the stage name,
+    its parameters and its inputs, so a stage reruns only when one of those
+    changes. The least recently used entries are evicted past max_bytes."""
+
+    def __init__(self, path: Path, max_bytes=MAX_BYTES):
+        """
+        Args:
+            path (Path): Cache directory
+            max_bytes (int, optional): Total size to evict down to. Defaults to MAX_BYTES.
+        """
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        touchdir(self.path)
+
+    def key(self, stage, inputs=(), params=None) -> str:
+        """Hash a stage name, its inputs (see fingerprint) and its parameters"""
+        parts = [stage, str(CACHE_VERSION), fingerprint(list(inputs))]
+        parts.append(repr(sorted((params or {}).items())))
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    def path_for(self, stage, key) -> Path:
+        return self.path / f"{stage}-{key[:24]}.pickle"
+
+    def get(self, stage, key, ttl=None):
+        """Load an entry, or return MISSING.
+
+        Args:
+            stage (str): Stage name
+            key (str): From key
+            ttl (float, optional): Seconds an entry stays valid; for remote inputs. Defaults to None.
+        """
+        path = self.path_for(stage, key)
+        if not path.exists():
+            return MISSING
+        with open(path, "rb") as f:
+            created, value = pickle.load(f)
+        if ttl is not None and time.time() - created > ttl:
+            logging.info(f"Cache entry expired: {path}")
+            return MISSING
+        # Mark as recently used for eviction
+        os.utime(path)
+        return value
+
+    def put(self, stage, key, value) -> Path:
+        path = self.path_for(stage, key)
+        part = path.with_suffix(".part")
+        with open(part, "wb") as f:
+            pickle.dump((time.time(), value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(part, path)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = sorted(self.path.glob("*.pickle"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in entries)
+        for path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            total -= path.stat().st_size
+            logging.info(f"Evicting cache entry: {path}")
+            path.unlink()
+
+    def cached(self, stage, fn, inputs=(), params=None, ttl=None):
+        """Return the cached output of a stage, or run fn and cache it.
+
+        Args:
+            stage (str): Stage name, e.g. "load_ntas"
+            fn (callable): Runs the stage with no arguments
+            inputs (list, optional): Inputs that fn depends on. Defaults to ().
+            params (dict, optional): Parameters that fn depends on. Defaults to None.
+            ttl (float, optional): Seconds an entry stays valid. Defaults to None.
+
+        Returns:
+            The stage output
+        """
+        key = self.key(stage, inputs, params)
+        value = self.get(stage, key, ttl=ttl)
+        if value is not MISSING:
+            logging.info(f"Skipping {stage}: cached")
+            return value
+        value = fn()
+        self.put(stage, key, value)
+        return value
@@ -0,0 +1,48 @@
+# from .main import Main
+from main import Main
+from trips import TRIP_BOUNDS
+from dotenv import load_dotenv
+from pathlib import Path
+import click
+import logging
+import os
+
+load_dotenv()
+
+
+@click.command()
+def run():
+    app = Main(
+        start_dir=Path("temp"),
+        engine=os.getenv("CSV_ENGINE", "pandas"),
+        download_workers=int(os.getenv("DOWNLOAD_WORKERS", 4)),
+        backend=os.getenv("SUMMARY_BACKEND", "pandas"),
+        workers=int(os.getenv("WORKERS", 1)),
+        cache_bytes=int(os.getenv("CACHE_BYTES", 2 << 30)),
+        report_compression=tuple(
+            filter(None, os.getenv("REPORT_COMPRESSION", "gzip").split(","))
+        ),
+        trip_bounds={
+            **TRIP_BOUNDS,
+            **{
+                name: tuple(float(bound) for bound in os.getenv(variable).split(","))
+                for name, variable in [
+                    ("duration", "TRIP_DURATION_BOUNDS"),
+                    ("distance", "TRIP_DISTANCE_BOUNDS"),
+                ]
+                if os.getenv(variable)
+            },
+        },
+    )
+    chunksize = os.getenv("CHUNKSIZE")
+    app.run(
+        os.getenv("START_DATE"),
+        os.getenv("END_DATE"),
+        chunksize=int(chunksize) if chunksize else None,
+        incremental=os.getenv("INCREMENTAL", "").lower() in ("1", "true"),
+    )
+
+
+if __name__ == "__main__":
+    logging.info("Running CBAnalysis CLI!")
+    run()
@@ -0,0 +1,306 @@
+import numpy as np
+import pandas as pd
+
+from .stations import StationTable
+
+ORIENTS = ["start", "stop"]
+# Weekday numbers as in pd.Timestamp.weekday, for the weekdays filter of roll-ups
+WEEKDAYS = [0, 1, 2, 3, 4]
+WEEKEND = [5, 6]
+
+
+class CountCube:
+    """Ride counts by orient (start/stop) x station x month x weekday x hour,
+    filled in one scan over the rides. Summaries such as hourly profiles,
+    weekday/weekend splits, arrivals or seasonal windows are sums over parts
+    of the cube, so none of them needs another pass over the rides.
+
+    Stations are numbered like StationTable, months run from the first ride's
+    month to the last's, and cubes built from chunks of rides are combined with merge.
+    """
+
+    def __init__(self, names, months: pd.PeriodIndex, counts: np.ndarray, days=None):
+        """
+        Args:
+            names (pd.Index): Short name of each station code
+            months (pd.PeriodIndex): Consecutive months of the month axis
+            counts (np.ndarray): uint32 [orient][station][month][weekday][hour]
+            days (pd.DatetimeIndex, optional): Days the rides cover, for means. Defaults to None.
+        """
+        self.names = pd.Index(names)
+        self.months = months
+        self.counts = counts
+        self.days = days if days is not None else pd.DatetimeIndex([])
+        # Roll-ups list stations by name
+        self.order = np.argsort(np.asarray(self.names, dtype=object))
+
+    @classmethod
+    def from_rides(cls, df: pd.DataFrame, stations: StationTable, days=None):
+        """Count rides by start and by stop in one pass.
+
+        Args:
+            df (pd.DataFrame): Prepared rides, with station codes from Main.join_short_names
+            stations (StationTable): Station codes to short names
+            days (pd.DatetimeIndex, optional): Days the rides cover.
+                Defaults to the days from the first ride's start to the last's.
+
+        Returns:
+            CountCube: The counts
+        """
+        parts = {}
+        for orient in ORIENTS:
+            times = df[f"{orient}_time"]
+            codes = df.get(f"{orient}_station_code")
+            if codes is None:
+                codes = stations.encode(df[f"{orient}_station_id"])
+            known = (np.asarray(codes) >= 0) & times.notna().to_numpy()
+            times = times[known].dt
+            parts[orient] = (
+                np.asarray(codes)[known].astype(np.int64),
+                (times.year * 12 + times.month - 1).to_numpy(np.int64),
+                _date_part(df, orient, "weekday", known, times.weekday),
+                _date_part(df, orient, "hour", known, times.hour),
+            )
+
+        if days is None:
+            start_times = df["start_time"].dropna()
+            days = pd.DatetimeIndex([])
+            if len(start_times):
+                days = pd.date_range(
+                    start_times.min().normalize(), start_times.max().normalize()
+                )
+        return cls.from_counts(stations.short_names, parts, days)
+
+    @classmethod
+    def from_counts(cls, names, parts: dict, days=None):
+        """Fill a cube from rides already binned, e.g. by a GROUP BY.
+
+        Args:
+            names (pd.Index): Short name of each station code
+            parts (dict): Orient to arrays of (station codes, month numbers
+                (year * 12 + month - 1), weekdays, hours), and optionally the
+                rides in each bin; without them every row is one ride
+            days (pd.DatetimeIndex, optional): See __init__. Defaults to None.
+
+        Returns:
+            CountCube: The counts
+        """
+        month_numbers = np.concatenate([parts[orient][1] for orient in ORIENTS])
+        first = month_numbers.min() if len(month_numbers) else 0
+        n_months = month_numbers.max() - first + 1 if len(month_numbers) else 0
+        months = pd.period_range(
+            pd.Period(year=first // 12, month=first % 12 + 1, freq="M"),
+            periods=n_months,
+            freq="M",
+        )
+
+        shape = (len(names), n_months, 7, 24)
+        counts = np.zeros((len(ORIENTS),) + shape, dtype=np.uint32)
+        for i, orient in enumerate(ORIENTS):
+            codes, months_, weekdays, hours, *weights = parts[orient]
+            bins = ((codes * n_months + months_ - first) * 7 + weekdays) * 24 + hours
+            binned = np.bincount(
+                bins, weights=weights[0] if weights else None, minlength=np.prod(shape)
+            )
+            counts[i] = binned.astype(np.uint32).reshape(shape)
+        return cls(names, months, counts, days)
+
+    @classmethod
+    def empty(cls, names, months, days=None):
+        """A cube of zeros over known months, for add to fill in place.
+
+        Args:
+            names (pd.Index): Short name of each station code
+            months (list): Months the rides are expected in, e.g. dates or periods
+            days (pd.DatetimeIndex, optional): See __init__. Defaults to None.
+        """
+        periods = pd.PeriodIndex(months, freq="M")
+        if len(periods):
+            periods = pd.period_range(periods.min(), periods.max(), freq="M")
+        counts = np.zeros(
+            (len(ORIENTS), len(names), len(periods), 7, 24), dtype=np.uint32
+        )
+        return cls(names, periods, counts, days)
+
+    def add(self, other: "CountCube") -> "CountCube":
+        """Add another cube's counts into this one in place, e.g. one chunk's.
+        The month axis is only copied when other has months outside it, so
+        adding the chunks of months known up front (see empty) copies nothing.
+
+        Returns:
+            CountCube: This cube
+        """
+        if not self.names.equals(other.names):
+            raise Exception("Can only merge cubes built from the same stations")
+        fits = len(self.months) and (
+            len(other.months) == 0
+            or (
+                other.months[0] >= self.months[0]
+                and other.months[-1] <= self.months[-1]
+            )
+        )
+        if not fits:
+            grown = self.merge(other)
+            # merge hands back other itself when this cube is empty
+            counts = grown.counts.copy() if grown is other else grown.counts
+            self.months, self.counts = grown.months, counts
+        elif len(other.months):
+            offset = self.months.get_loc(other.months[0])
+            self.counts[:, :, offset : offset + len(other.months)] += other.counts
+        self.days = self.days.union(other.days)
+        return self
+
+    def merge(self, other: "CountCube") -> "CountCube":
+        """Add two cubes over the same stations, e.g. of consecutive chunks or months"""
+        if not self.names.equals(other.names):
+            raise Exception("Can only merge cubes built from the same stations")
+        if len(self.months) == 0 or len(other.months) == 0:
+            return other if len(self.months) == 0 else self
+        months = pd.period_range(
+            min(self.months[0], other.months[0]),
+            max(self.months[-1], other.months[-1]),
+            freq="M",
+        )
+        counts = np.zeros(
+            self.counts.shape[:2] + (len(months),) + self.counts.shape[3:],
+            dtype=np.uint32,
+        )
+        for cube in (self, other):
+            offset = months.get_loc(cube.months[0])
+            counts[:, :, offset : offset + len(cube.months)] += cube.counts
+        return CountCube(self.names, months, counts, self.days.union(other.days))
+
+    def reindex(self, stations: StationTable) -> "CountCube":
+        """The same counts numbered by another StationTable, e.g. a newer
+        feed's; stations it lacks are dropped and new stations count 0"""
+        names = stations.short_names
+        if self.names.equals(names):
+            return self
+        positions = names.get_indexer(self.names)
+        kept = positions >= 0
+        counts = np.zeros(
+            self.counts.shape[:1] + (len(names),) + self.counts.shape[2:],
+            dtype=np.uint32,
+        )
+        counts[:, positions[kept]] = self.counts[:, kept]
+        return CountCube(names, self.months, counts, self.days)
+
+    def month_mask(self, months=None) -> np.ndarray:
+        """Select months by period, e.g. ["2022-06", "2022-07"], or by month
+        of the year across years, e.g. [6, 7, 8] for every summer"""
+        if months is None:
+            return np.ones(len(self.months), dtype=bool)
+        return _in_months(self.months, months)
+
+    def select(self, orient="start", months=None, weekdays=None) -> np.ndarray:
+        """Counts summed over the selected months.
+
+        Args:
+            orient (str, optional): `start` for departures or `stop` for arrivals. Defaults to "start".
+            months (list, optional): See month_mask. Defaults to every month.
+            weekdays (list, optional): e.g. WEEKEND; other weekdays count 0. Defaults to every weekday.
+
+        Returns:
+            np.ndarray: int64 [station][weekday][hour], by station code
+        """
+        cube = self.counts[ORIENTS.index(orient)][:, self.month_mask(months)]
+        counts = cube.sum(axis=1, dtype=np.int64)
+        if weekdays is not None:
+            counts[:, ~np.isin(np.arange(7), weekdays)] = 0
+        return counts
+
+    def days_in(self, months=None, weekdays=None) -> pd.DatetimeIndex:
+        """The covered days that fall in a window, to divide counts by"""
+        days = self.days
+        if months is not None:
+            days = days[_in_months(days.to_period("M"), months)]
+        if weekdays is not None:
+            days = days[days.weekday.isin(list(weekdays))]
+        return days
+
+    def station_totals(self, orient="start", months=None) -> np.ndarray:
+        """Rides per station code in a window"""
+        cube = self.counts[ORIENTS.index(orient)][:, self.month_mask(months)]
+        return cube.sum(axis=(1, 2, 3), dtype=np.int64)
+
+    def _present(self, counts: np.ndarray) -> np.ndarray:
+        """Codes of stations with any rides, in name order"""
+        totals = counts.reshape(len(counts), -1).sum(axis=1)
+        return self.order[totals[self.order] > 0]
+
+    def by_hour(self, orient="start", months=None, weekdays=None) -> pd.DataFrame:
+        """Hourly profile of every station with rides in the window.
+
+        Returns:
+            pd.DataFrame: short_name, {orient}_hour, counts, and mean_rides per day
+        """
+        counts = self.select(orient, months, weekdays).sum(axis=1)
+        present = self._present(counts)
+        days = self.days_in(months, weekdays)
+        by_hr = pd.DataFrame(
+            {
+                "short_name": np.repeat(
+                    np.asarray(self.names, dtype=object)[present], 24
+                ),
+                f"{orient}_hour": np.tile(np.arange(24), len(present)),
+                "counts": counts[present].ravel(),
+            }
+        )
+        by_hr["mean_rides"] = by_hr["counts"] / max(len(days), 1)
+        return by_hr
+
+    def by_weekday_hour(self, orient="start", months=None) -> pd.DataFrame:
+        """Profile of every station with rides in the window, by weekday and
+        hour. Means divide by how many of each weekday the window covers.
+
+        Returns:
+            pd.DataFrame: short_name, {orient}_weekday, {orient}_hour, counts, mean_rides
+        """
+        counts = self.select(orient, months)
+        present = self._present(counts)
+        per_weekday = np.bincount(self.days_in(months).weekday, minlength=7)
+        means = counts[present] / np.maximum(per_weekday, 1)[None, :, None]
+        return pd.DataFrame(
+            {
+                "short_name": np.repeat(
+                    np.asarray(self.names, dtype=object)[present], 7 * 24
+                ),
+                f"{orient}_weekday": np.tile(np.repeat(np.arange(7), 24), len(present)),
+                f"{orient}_hour": np.tile(np.arange(24), 7 * len(present)),
+                "counts": counts[present].ravel(),
+                "mean_rides": means.ravel(),
+            }
+        )
+
+    def by_month(self, orient="start") -> pd.DataFrame:
+        """Monthly totals of every station with rides.
+
+        Returns:
+            pd.DataFrame: short_name, month, counts
+        """
+        counts = self.counts[ORIENTS.index(orient)].sum(axis=(2, 3), dtype=np.int64)
+        present = self._present(counts)
+        return pd.DataFrame(
+            {
+                "short_name": np.repeat(
+                    np.asarray(self.names, dtype=object)[present], len(self.months)
+                ),
+                "month": np.tile(self.months.astype(str), len(present)),
+                "counts": counts[present].ravel(),
+            }
+        )
+
+
+def _date_part(df, orient, part, known, computed) -> np.ndarray:
+    """Use the prepared int8 date part column if there is one"""
+    column = f"{orient}_{part}"
+    if column in df.columns:
+        return df[column].to_numpy()[known].astype(np.int64)
+    return computed.to_numpy(np.int64)
+
+
+def _in_months(periods: pd.PeriodIndex, months) -> np.ndarray:
+    months = list(months)
+    if all(isinstance(m, (int, np.integer)) for m in months):
+        return np.asarray(periods.month.isin(months))
+    return np.asarray(periods.isin(pd.PeriodIndex(months, freq="M")))
@@ -0,0 +1,342 @@
+from tqdm import tqdm
+from datetime import date
+from tempfile import TemporaryDirectory
+from pathlib import Path
+import logging
+import pandas as pd
+import geopandas as gpd
+
+# modifies pandas
+import janitor
+
+# import matplotlib.pyplot as plt
+import requests
+import zipfile
+import glob
+import os
+import time
+from .download import Downloader
+from .ntas import NtaAssigner
+from .schema import (
+    GENDERS,
+    concat_trips,
+    detect_schema,
+    normalize_trips,
+    read_header,
+    read_trip_csv,
+)
+from .storage import RideStore
+from .utils import prefetch, touchdir
+
+logging.basicConfig(level=logging.INFO)
+
+
+class Prepper:
+    """CBAnalysis can download and analyze
+    data for Citi Bike planner. It is modular for use with Airflow or simple scripts"""
+
+    URL_STATION_FEED = "https://gbfs.citibikenyc.com/gbfs/en/station_information.json"
+    URL_TRIPDATA = "https://s3.amazonaws.com/tripdata/"
+    URL_NYCNTAS_JSON = "https://data.cityofnewyork.us/api/geospatial/d3qk-pfyz?method=export&format=GeoJSON"
+    # Chunks parsed ahead of the one being summarized
+    PREFETCH_CHUNKS = 1
+
+    def __init__(self, paths, engine="pandas", download_workers=4):
+        """Initialize a CBAnalysis instance with the cwd
+
+        Args:
+            start_cwd ([type], optional): [description]. Defaults to Path("./..").
+            engine (str, optional): CSV parser, `pandas` or `pyarrow`. Defaults to "pandas".
+            download_workers (int, optional): Concurrent ZIP downloads. Defaults to 4.
+
+        Returns:
+            [type]: [description]
+        """
+        self.paths = paths
+        self.engine = engine
+        self.download_workers = download_workers
+
+    def ride_zip_name(self, year, month, use_jc=False) -> str:
+        return f"{'JC-' if use_jc else ''}{year}{month:0>2}-citibike-tripdata.csv.zip"
+
+    def download_ride_zip(self, year=2020, month=8, use_jc=False):
+        """Downloads a month's ZIP file into the zip directory; its CSVs are
+        read straight out of the archive
+
+        Args:
+            year (int, optional): [description]. Defaults to 2020.
+            month (int, optional): [description]. Defaults to 8.
+            use_jc (bool, optional): Download Jersey City files. Defaults to False.
+
+        Returns:
+            [type]: Path of the ZIP file
+        """
+        (path_zipfile,) = self.download_ride_zips([date(year, month, 1)], use_jc)
+        return path_zipfile
+
+    def download_ride_zips(self, months, use_jc=False) -> list:
+        """Downloads several months of ZIP files concurrently into the zip directory.
+        Interrupted downloads are resumed and every file is size/checksum validated.
+
+        Args:
+            months (list): datetime.date for each month
+            use_jc (bool, optional): Download Jersey City files. Defaults to False.
+
+        Returns:
+            list: Paths of the ZIP files
+        """
+        touchdir(self.paths.zip)
+        downloader = Downloader(
+            self.URL_TRIPDATA, self.paths.zip, workers=self.download_workers
+        )
+        names = [self.ride_zip_name(m.year, m.month, use_jc) for m in months]
+        return downloader.download_all(names)
+
+    def month_glob(self, year, month, use_jc=False) -> str:
+        """Glob for one month's ZIP file"""
+        return str(self.paths.zip / self.ride_zip_name(year, month, use_jc))
+
+    def ride_sources(self, glob_string) -> list:
+        """Expand a glob of CSVs and/or ZIP files into readable CSVs.
+        CSVs inside ZIP files are returned as zipfile.Path members, so they are
+        read straight out of the archive instead of being extracted to disk.
+
+        Args:
+            glob_string (str): e.g. "zip/*.zip"
+
+        Returns:
+            list: CSV paths and zipfile.Path members
+        """
+        sources = []
+        for f in sorted(glob.glob(glob_string)):
+            if not zipfile.is_zipfile(f):
+                sources.append(f)
+                continue
+            with zipfile.ZipFile(f) as zf:
+                members = [
+                    name
+                    for name in zf.namelist()
+                    if name.endswith(".csv") and not name.startswith("__MACOSX")
+                ]
+            sources.extend(zipfile.Path(f, at=name) for name in sorted(members))
+        return sources
+
+    def read_trips(self, path, chunksize=None):
+        """Read one tripdata CSV of either era into the canonical layout.
+
+        Args:
+            path ([type]): CSV to read, or a zipfile.Path member of a ZIP file
+            chunksize (int, optional): Rows per chunk; None reads the whole file. Defaults to None.
+
+        Yields:
+            pd.DataFrame: Rides with the columns of schema.CANONICAL_DTYPES
+        """
+        schema = detect_schema(read_header(path))
+        logging.info(f"Reading {path} with the {schema.name} schema")
+        for chunk in read_trip_csv(
+            path, schema, chunksize=chunksize, engine=self.engine
+        ):
+            yield normalize_trips(chunk, schema)
+
+    def concat_csvs(self, glob_string="zip/*.zip", output="merged", save_temp=False):
+        """glob csvs (or the ZIP files holding them) and merge them; files from
+        before and after the 2021 schema change are normalized to the same columns
+        """
+        logging.info(f"Concatenating CSVs in {glob_string}...")
+        sources = self.ride_sources(glob_string)
+        if len(sources) < 1:
+            raise Exception("No CSVs to concatenate.")
+        dfs = (df for f in sources for df in self.read_trips(f, chunksize=None))
+        all_months = concat_trips(dfs)
+        if save_temp:
+            logging.info(f"Saving to {output}")
+            all_months.to_parquet(f"{output}.parquet")
+        return all_months
+
+    def iter_csv_chunks(self, glob_string="zip/*.zip", chunksize=500_000):
+        """Stream CSVs in bounded chunks instead of concatenating them.
+        Memory use is set by chunksize, not by the number of months globbed.
+        The next chunk is decompressed and parsed in a background thread
+        while the caller works on the current one.
+
+        Args:
+            glob_string (str, optional): Glob of CSVs or ZIP files to read. Defaults to "zip/*.zip".
+            chunksize (int, optional): Max rows per chunk. Defaults to 500_000.
+
+        Yields:
+            pd.DataFrame: Rides with the same columns as concat_csvs
+        """
+        sources = self.ride_sources(glob_string)
+        logging.info(f"Streaming {len(sources)} CSVs in {glob_string}...")
+        if len(sources) < 1:
+            raise Exception("No CSVs to stream.")
+
+        def chunks():
+            for f in sources:
+                logging.info(f"Reading {f} in chunks of {chunksize} rows")
+                yield from self.read_trips(f, chunksize=chunksize)
+
+        yield from prefetch(chunks(), size=self.PREFETCH_CHUNKS)
+
+    def iter_prepped_rides(self, glob_string="zip/*.zip", chunksize=500_000):
+        """Stream prepared rides chunk by chunk; see iter_csv_chunks.
+
+        Yields:
+            pd.DataFrame: Rides as returned by load_rename_rides
+        """
+        for chunk in self.iter_csv_chunks(glob_string, chunksize=chunksize):
+            yield self.load_rename_rides(input_merged_rides=chunk)
+
+    def load_rename_rides(
+        self,
+        input_merged_rides: pd.DataFrame = None,
+        input_merged_rides_path="./merged.parquet",
+        prepped_rides="./rides",
+        save_temp=False,
+    ):
+        """Loads concatted rides ride files
+
+        Args:
+            input_merged_rides ([type], optional): [description]. Defaults to Path("merged.parquet").
+            prepped_rides ([type], optional): RideStore directory, partitioned by year/month. Defaults to Path("./rides").
+            save_temp (bool, optional): [description]. Defaults to True.
+        """
+
+        def create_date_columns(df, orientation="start"):
+            # Added in place as int8; no copy of the ride frame
+            times = df[f"{orientation}_time"].dt
+            df[f"{orientation}_hour"] = times.hour.astype("int8")
+            df[f"{orientation}_day"] = times.day.astype("int8")
+            df[f"{orientation}_weekday"] = times.dayofweek.astype("int8")
+
+        # Guard: load from disk if we are debugging
+        if input_merged_rides is None:
+            store = Path(prepped_rides)
+            if store.exists() and RideStore(store).months():
+                logging.info(f"Prepared rides already exist; loading {store}...")
+                return RideStore(store).read()
+            logging.info(f"Loading {input_merged_rides_path}...")
+            df = pd.read_parquet(input_merged_rides_path)
+        else:
+            logging.info(f"Using in-memory input_merged_rides")
+            df = input_merged_rides
+        df.rename(
+            # FROM : TO
+            {
+                "started_at": "start_time",
+                "ended_at": "stop_time",
+                "end_station_id": "stop_station_id",
+                "end_station_name": "stop_station_name",
+                "end_station_latitude": "stop_station_latitude",
+                "end_station_longitude": "stop_station_longitude",
+            },
+            axis=1,
+            inplace=True,
+        )
+
+        create_date_columns(df, orientation="start")
+        create_date_columns(df, orientation="stop")
+        # Gender codes only ever live in the gender column
+        if "gender" in df.columns and not isinstance(
+            df["gender"].dtype, pd.CategoricalDtype
+        ):
+            df["gender"] = df["gender"].map(GENDERS).astype("category")
+        # Clean the header only, instead of rebuilding the frame
+        df.columns = pd.DataFrame(columns=df.columns).clean_names().columns
+        if save_temp:
+            store = RideStore(prepped_rides)
+            for (year, month), rides in df.groupby(
+                [df["start_time"].dt.year, df["start_time"].dt.month]
+            ):
+                store.write_month(date(year, month, 1), [rides.copy()])
+        return df
+
+    def fetch_station_info(self, save_temp=False):
+        """Get data on all Citi Bike stations from the Citi Bike feed API
+
+        Returns:
+            stations_geo: a DataFrame with the station geographies
+        """
+        url_station_info = self.URL_STATION_FEED
+        resp = requests.get(url_station_info)
+        resp_data = resp.json()
+        stations = pd.DataFrame(resp_data["data"]["stations"])
+        stations_geo = gpd.GeoDataFrame(
+            stations, geometry=gpd.points_from_xy(stations.lon, stations.lat)
+        )
+        stations_geo.set_crs(epsg=4326, inplace=True)
+        # stations_geo = stations_geo.to_crs(epsg=2263)
+        cols_to_keep = [
+            "name",
+            "legacy_id",
+            "geometry",
+            "station_id",
+            "short_name",
+        ]
+        stations_geo: pd.DataFrame = stations_geo[cols_to_keep]
+
+        if save_temp:
+            stations_geo.to_pickle("stations_original.pickle")
+        return stations_geo
+
+    def load_ntas(self, remote_url=URL_NYCNTAS_JSON, save_temp=False):
+        """Loads and converts NTA data from NYC remote URL.
+
+        Args:
+            remote_url ([type], optional): Set the URL to fetch GeoJSON from. Defaults to self.URL_NYCNTAS_JSON.
+            save_temp (bool, optional): Saves intermediate files. Defaults to True.
+
+        Returns:
+            [type]: [description]
+        """
+        ntas = gpd.read_file(
+            remote_url,
+            driver="GeoJSON",
+        ).clean_names()
+
+        if save_temp:
+            ntas.to_pickle(Path("ntas_orig.pickle"))
+            ntas.to_file(Path("ntas_orig.geojson"), driver="GeoJSON")
+        return ntas
+
+    def load_nta_assigner(self, path: Path, max_age=None) -> NtaAssigner:
+        """Load NTA polygons from a local GeoParquet file, downloading
+        them again if the file is missing or older than max_age.
+
+        Args:
+            path (Path): GeoParquet file
+            max_age (float, optional): Seconds before the polygons are downloaded again. Defaults to None.
+
+        Returns:
+            NtaAssigner: Polygons and their spatial index
+        """
+        path = Path(path)
+        if path.exists() and (
+            max_age is None or time.time() - path.stat().st_mtime < max_age
+        ):
+            logging.info(f"Loading NTA polygons from {path}")
+            return NtaAssigner.from_parquet(path)
+        assigner = NtaAssigner(self.load_ntas())
+        assigner.to_parquet(path)
+        return assigner
+
+    def sjoin_ntas_stations(self, ntas, stations, save_temp=False):
+        """Joins NTA context data to CB station locations.
+
+        Args:
+            ntas ([type]): GeoDataFrame containing NYC NTAs
+            stations ([type]): GeoDataFrame containing citibike stations
+            save_temp (bool, optional): Outputs to the temp directory. Defaults to True.
+
+        Returns:
+            [type]: [description]
+        """
+        gdf = NtaAssigner(ntas).assign_stations(stations)
+        # projected = gdf.to_crs(epsg=4326)
+        projected = gdf.copy()
+        if save_temp:
+            output = Path(self.paths.out) / "stations-with-nta.geojson"
+            logging.info(f"Saving stations with NTAs: {output}")
+            projected.to_file(output, driver="GeoJSON")
+            projected.to_pickle("./stations-with-nta.pickle")
+        return projected
@@ -0,0 +1,179 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import re
+import zipfile
+
+import requests
+from tqdm import tqdm
+
+# Large writes keep Python call overhead out of multi-hundred-MB downloads
+BLOCK_SIZE = 1 << 20  # 1 Mebibyte
+
+
+class Downloader:
+    """Downloads ZIP files from a bucket into a directory, several at a time.
+    Partial downloads are kept as `<name>.part` and resumed with HTTP Range
+    requests; a file only gets its final name once its size (and MD5, when the
+    ETag is one) checks out. The size and ETag of each finished file are kept
+    in `<name>.meta`, and rechecked against the bucket before a file on disk
+    is reused."""
+
+    def __init__(self, base_url, output: Path, workers=4, block_size=BLOCK_SIZE):
+        """
+        Args:
+            base_url (str): URL prefix of the files, e.g. "https://s3.amazonaws.com/tripdata/"
+            output (Path): Directory to save to
+            workers (int, optional): Concurrent downloads. Defaults to 4.
+            block_size (int, optional): Bytes per read/write. Defaults to BLOCK_SIZE.
+        """
+        self.base_url = base_url
+        self.output = Path(output)
+        self.workers = workers
+        self.block_size = block_size
+
+    def download_all(self, filenames) -> list:
+        """Download files concurrently with a bounded thread pool.
+
+        Args:
+            filenames (list): Names relative to base_url
+
+        Returns:
+            list: Paths, in the same order as filenames
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(self.download, filenames))
+
+    def download(self, filename) -> Path:
+        """Download one file, resuming a partial download if there is one.
+
+        Args:
+            filename (str): Name relative to base_url
+
+        Returns:
+            Path: Path of the complete file
+        """
+        path = self.output / filename
+        part = self.output / f"{filename}.part"
+        url = self.base_url + filename
+        if path.exists():
+            state = self._check_existing(path, url)
+            if state == "current":
+                logging.info(f"Already downloaded: {path}")
+                return path
+            if state == "truncated":
+                logging.warning(f"Truncated download, resuming: {path}")
+                os.replace(path, part)
+            else:
+                logging.warning(f"Changed in the bucket, downloading again: {path}")
+                path.unlink()
+                part.unlink(missing_ok=True)
+
+        offset = part.stat().st_size if part.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        logging.info(f"Downloading {url} from byte {offset}")
+        with requests.get(url, headers=headers, stream=True) as resp:
+            etag = resp.headers.get("ETag")
+            if resp.status_code == 416:
+                # Range starts at or past the end; check the part file
+                # against the size of the whole file
+                total, etag = self._head(url)
+            else:
+                resp.raise_for_status()
+                if resp.status_code != 206:
+                    # Server ignored the Range header; start over
+                    offset = 0
+                total = self._total_size(resp, offset)
+                self._write(resp, part, offset, total)
+
+        self._validate(part, total, etag)
+        os.replace(part, path)
+        self._save_meta(path, etag)
+        return path
+
+    def _check_existing(self, path, url) -> str:
+        """Whether a file already on disk can be reused.
+
+        Returns:
+            str: "current" to reuse it, "truncated" to resume it, or "stale"
+                to download it again
+        """
+        size = path.stat().st_size
+        meta_path = Path(f"{path}.meta")
+        meta = json.loads(meta_path.read_text()) if meta_path.exists() else None
+        try:
+            total, etag = self._head(url)
+        except requests.RequestException as e:
+            # Offline: trust what was recorded, or at least a readable ZIP
+            logging.warning(f"Could not check {url}: {e}")
+            if meta is not None:
+                return "current" if size == meta["size"] else "truncated"
+            return "current" if zipfile.is_zipfile(path) else "truncated"
+
+        if meta is not None and meta["etag"] and etag and meta["etag"] != etag:
+            return "stale"
+        expected = total if total is not None else (meta or {}).get("size")
+        if expected is None:
+            # Nothing to compare the size to
+            current = zipfile.is_zipfile(path)
+        elif size < expected:
+            return "truncated"
+        else:
+            current = size == expected
+        if not current:
+            return "stale"
+        if meta is None:
+            # Downloaded before sizes and ETags were recorded
+            self._save_meta(path, etag)
+        return "current"
+
+    def _head(self, url) -> tuple:
+        """Size and ETag of the whole remote file; size is None if not sent"""
+        resp = requests.head(url, allow_redirects=True)
+        resp.raise_for_status()
+        length = resp.headers.get("Content-Length")
+        return int(length) if length is not None else None, resp.headers.get("ETag")
+
+    def _save_meta(self, path, etag):
+        meta = {"size": path.stat().st_size, "etag": etag}
+        Path(f"{path}.meta").write_text(json.dumps(meta))
+
+    def _total_size(self, resp, offset) -> int:
+        content_range = resp.headers.get("Content-Range", "")
+        match = re.match(r"bytes \d+-\d+/(\d+)", content_range)
+        if match:
+            return int(match.group(1))
+        length = resp.headers.get("Content-Length")
+        return offset + int(length) if length is not None else None
+
+    def _write(self, resp, part, offset, total):
+        progress_bar = tqdm(
+            total=total, initial=offset, unit="iB", unit_scale=True, leave=False
+        )
+        with open(part, "ab" if offset else "wb") as fd:
+            for chunk in resp.iter_content(chunk_size=self.block_size):
+                fd.write(chunk)
+                progress_bar.update(len(chunk))
+        progress_bar.close()
+
+    def _validate(self, part, total, etag):
+        size = part.stat().st_size
+        if total is not None and size != total:
+            if size > total:
+                # Longer than the file itself; resuming can't fix it
+                part.unlink()
+                raise Exception(f"{part} is {size} bytes, expected {total}; removed it")
+            raise Exception(f"{part} is {size} bytes, expected {total}")
+        # S3 ETags are the MD5 of the body, except for multipart uploads
+        etag = (etag or "").strip('"')
+        if re.fullmatch(r"[0-9a-f]{32}", etag):
+            md5 = hashlib.md5()
+            with open(part, "rb") as fd:
+                for block in iter(lambda: fd.read(self.block_size), b""):
+                    md5.update(block)
+            if md5.hexdigest() != etag:
+                part.unlink()
+                raise Exception(f"{part} failed its checksum; removed it")
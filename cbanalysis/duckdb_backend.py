@@ -0,0 +1,471 @@
+import logging
+import os
+from pathlib import Path
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from .cube import ORIENTS, CountCube
+from .flows import FlowMatrix
+from .sketches import (
+    DURATION_ACCURACY,
+    DurationSketch,
+    HyperLogLog,
+    StationSketches,
+    TripStats,
+)
+from .stations import StationTable
+from .trips import EARTH_RADIUS, TRIP_BOUNDS
+
+
+class DuckDBSummarizer:
+    """Runs the same summaries as Main.summarize, but as DuckDB queries straight
+    over the cached Parquet rides (see storage.RideStore). DuckDB scans the
+    files with every core and spills to disk when a query outgrows
+    memory_limit, so the rides never have to fit in a DataFrame.
+
+    The mergeable summaries (CountCube, FlowMatrix, StationSketches and
+    TripStats) are GROUP BY queries down to their bins, which are only
+    as large as the summaries themselves."""
+
+    def __init__(self, paths, threads=None, memory_limit=None, temp_directory=None):
+        """
+        Args:
+            paths (WorkingPaths): Working paths
+            threads (int, optional): Worker threads. Defaults to every core.
+            memory_limit (str, optional): e.g. "4GB". Defaults to DuckDB's own limit.
+            temp_directory (Path, optional): Where to spill. Defaults to ./duckdb_tmp.
+        """
+        self.paths = paths
+        self.threads = threads or os.cpu_count()
+        self.memory_limit = memory_limit
+        self.temp_directory = Path(temp_directory or "duckdb_tmp")
+
+    def connect(self, files, df_station_geo) -> duckdb.DuckDBPyConnection:
+        """Open an in-memory database with a `rides` view over the Parquet files,
+        with short names and station codes joined like Main.join_short_names does,
+        and a `trips` view of each ride's duration and distance.
+
+        Args:
+            files (list): Parquet files of prepared rides
+            df_station_geo (pd.DataFrame): Stations with NTA's joined
+
+        Returns:
+            duckdb.DuckDBPyConnection: Connection
+        """
+        # Settings go in the config rather than into SQL, so paths need no quoting
+        config = {
+            "threads": int(self.threads),
+            "temp_directory": str(self.temp_directory.resolve()),
+            "preserve_insertion_order": False,
+        }
+        if self.memory_limit:
+            config["memory_limit"] = str(self.memory_limit)
+        con = duckdb.connect(config=config)
+
+        # One row per short_name, the first of any duplicates, numbered like StationTable
+        table = StationTable(df_station_geo)
+        stations = pd.DataFrame(
+            {
+                "code": np.arange(len(table), dtype=np.int32),
+                "short_name": np.asarray(table.short_names, dtype=object),
+                "ntacode": table.ntacodes,
+            }
+        )
+        # Every station of the feed, for count_stations_per_nta
+        station_ntas = pd.DataFrame(
+            {
+                "station_id": df_station_geo["station_id"],
+                "ntacode": df_station_geo["ntacode"],
+            }
+        )
+        # Same lookup as join_short_names: the last station wins a shared legacy id
+        legacy = {}
+        if "legacy_id" in df_station_geo.columns:
+            legacy = dict(
+                zip(
+                    df_station_geo["legacy_id"].astype(str),
+                    df_station_geo["short_name"].astype(str),
+                )
+            )
+        legacy_ids = pd.DataFrame(
+            {"legacy_id": list(legacy), "short_name": list(legacy.values())},
+            dtype=str,
+        )
+        con.register("stations", stations)
+        con.register("station_ntas", station_ntas)
+        con.register("legacy_ids", legacy_ids)
+        con.read_parquet([str(f) for f in files]).create_view("ride_files")
+        con.execute(
+            """
+            CREATE VIEW rides AS
+            SELECT
+                r.start_time,
+                r.stop_time,
+                s.short_name AS start_short_name,
+                e.short_name AS stop_short_name,
+                s.code AS start_code,
+                e.code AS stop_code,
+                r.start_lat,
+                r.start_lng,
+                r.end_lat,
+                r.end_lng,
+                CAST(r.bike_id AS VARCHAR) AS bike_id
+            FROM ride_files r
+            LEFT JOIN legacy_ids ls ON CAST(r.start_station_id AS VARCHAR) = ls.legacy_id
+            LEFT JOIN legacy_ids le ON CAST(r.stop_station_id AS VARCHAR) = le.legacy_id
+            LEFT JOIN stations s
+                ON coalesce(ls.short_name, CAST(r.start_station_id AS VARCHAR)) = s.short_name
+            LEFT JOIN stations e
+                ON coalesce(le.short_name, CAST(r.stop_station_id AS VARCHAR)) = e.short_name
+            """
+        )
+        # Durations and distances as trip_durations and trip_distances compute
+        # them; the haversine runs in double here, so distances agree to float32 rounding
+        con.execute(
+            f"""
+            CREATE VIEW trips AS
+            SELECT
+                start_code AS code,
+                year(start_time) * 12 + month(start_time) - 1 AS month,
+                hour(start_time) AS hour,
+                CAST((epoch_ns(stop_time) - epoch_ns(start_time)) / 1e9 AS FLOAT)
+                    AS duration,
+                CAST(
+                    2 * {EARTH_RADIUS} * asin(sqrt(least(
+                        sin(radians(end_lat - start_lat) / 2) ** 2
+                        + cos(radians(start_lat)) * cos(radians(end_lat))
+                        * sin(radians(end_lng - start_lng) / 2) ** 2,
+                        1
+                    ))) AS FLOAT
+                ) AS distance,
+                bike_id
+            FROM rides
+            """
+        )
+        return con
+
+    def agg_by_hour(self, con, orient="start", days=None) -> pd.DataFrame:
+        """Same output as CountCube.by_hour.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): From connect
+            orient (str, optional): Consider `start` station or `stop` station. Defaults to 'start'.
+            days (pd.DatetimeIndex, optional): Days the rides cover, for the mean.
+                Defaults to the days from the first ride to the last.
+
+        Returns:
+            pd.DataFrame: short_name, {orient}_hour, counts, mean_rides
+        """
+        if days is None:
+            first, last = con.execute(
+                f"SELECT min({orient}_time), max({orient}_time) FROM rides"
+            ).fetchone()
+            n_days = 0 if first is None else (last.date() - first.date()).days + 1
+        else:
+            n_days = len(days)
+
+        by_hr = con.execute(
+            f"""
+            WITH counts AS (
+                SELECT {orient}_short_name AS short_name,
+                    hour({orient}_time) AS hour,
+                    count(*) AS counts
+                FROM rides
+                WHERE {orient}_short_name IS NOT NULL
+                GROUP BY ALL
+            ),
+            names AS (SELECT DISTINCT short_name FROM counts)
+            SELECT n.short_name,
+                h.range AS {orient}_hour,
+                coalesce(c.counts, 0) AS counts
+            FROM names n
+            CROSS JOIN range(24) h
+            LEFT JOIN counts c ON c.short_name = n.short_name AND c.hour = h.range
+            ORDER BY n.short_name, h.range
+            """
+        ).df()
+        by_hr = by_hr.astype({f"{orient}_hour": "int64", "counts": "int64"})
+        by_hr["mean_rides"] = by_hr["counts"] / max(n_days, 1)
+        return by_hr
+
+    def count_stations_per_nta(self, con) -> pd.DataFrame:
+        """Same output as Summarizer.count_stations_per_nta"""
+        return (
+            con.execute(
+                """
+                SELECT ntacode, count(DISTINCT station_id) AS stations_count
+                FROM station_ntas
+                WHERE ntacode IS NOT NULL
+                GROUP BY ntacode
+                ORDER BY ntacode
+                """
+            )
+            .df()
+            .astype({"stations_count": "int64"})
+            .set_index("ntacode")
+        )
+
+    def rank_stations_by_nta(self, con, df_stations_per_nta) -> pd.DataFrame:
+        """Same output as Summarizer.rank_station_totals, down to the order:
+        NTA's descending, most rides first, ties by short name.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): From connect
+            df_stations_per_nta (pd.DataFrame): DataFrame of NTA's with station counts
+
+        Returns:
+            pd.DataFrame: ntacode, station_rank and stations_count by start_short_name
+        """
+        ranked = con.execute(
+            """
+            WITH counts AS (
+                SELECT s.ntacode, r.start_short_name, count(*) AS counts
+                FROM rides r
+                JOIN stations s ON r.start_short_name = s.short_name
+                WHERE s.ntacode IS NOT NULL
+                GROUP BY ALL
+            )
+            SELECT ntacode,
+                start_short_name,
+                dense_rank() OVER (PARTITION BY ntacode ORDER BY counts DESC)
+                    AS station_rank
+            FROM counts
+            ORDER BY ntacode DESC, counts DESC, start_short_name
+            """
+        ).df()
+        return (
+            ranked.merge(df_stations_per_nta, on="ntacode", how="left")
+            .astype({"station_rank": "int32"})
+            .set_index("start_short_name")
+        )
+
+    def count_cube(self, con, stations: StationTable, days=None) -> CountCube:
+        """Same output as CountCube.from_rides, counted by DuckDB.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): From connect
+            stations (StationTable): Station codes to short names
+            days (pd.DatetimeIndex, optional): Days the rides cover.
+                Defaults to the days from the first ride's start to the last's.
+
+        Returns:
+            CountCube: The counts
+        """
+        parts = {}
+        for orient in ORIENTS:
+            binned = con.execute(
+                f"""
+                SELECT {orient}_code AS code,
+                    year({orient}_time) * 12 + month({orient}_time) - 1 AS month,
+                    isodow({orient}_time) - 1 AS weekday,
+                    hour({orient}_time) AS hour,
+                    count(*) AS counts
+                FROM rides
+                WHERE {orient}_code IS NOT NULL AND {orient}_time IS NOT NULL
+                GROUP BY ALL
+                """
+            ).fetchnumpy()
+            parts[orient] = tuple(
+                np.asarray(binned[column], dtype=np.int64)
+                for column in ["code", "month", "weekday", "hour", "counts"]
+            )
+        if days is None:
+            first, last = con.execute(
+                "SELECT min(start_time), max(start_time) FROM rides"
+            ).fetchone()
+            days = pd.DatetimeIndex([])
+            if first is not None:
+                days = pd.date_range(
+                    pd.Timestamp(first).normalize(), pd.Timestamp(last).normalize()
+                )
+        return CountCube.from_counts(stations.short_names, parts, days)
+
+    def count_flows(self, con, stations: StationTable) -> FlowMatrix:
+        """Same output as FlowMatrix.from_rides(by_hour=True), counted by DuckDB"""
+        binned = con.execute(
+            """
+            SELECT start_code, stop_code, hour(start_time) AS hour, count(*) AS trips
+            FROM rides
+            WHERE start_code IS NOT NULL AND stop_code IS NOT NULL
+            GROUP BY ALL
+            """
+        ).fetchnumpy()
+        return FlowMatrix.from_counts(
+            stations,
+            *(
+                np.asarray(binned[column], dtype=np.int64)
+                for column in ["start_code", "stop_code", "hour", "trips"]
+            ),
+        )
+
+    def sketch_buckets(
+        self, con, measure, where="TRUE", params=None, sketch=DurationSketch
+    ) -> dict:
+        """Counts of a measure's values by month, station code * 24 + hour and
+        sketch bucket, for rides with a station and a value of at least 0.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): From connect
+            measure (str): Column of the trips view, e.g. "duration"
+            where (str, optional): Further SQL condition on the trips. Defaults to "TRUE".
+            params (list, optional): Parameters of where. Defaults to None.
+            sketch (type, optional): Sketch class of the measure. Defaults to DurationSketch.
+
+        Returns:
+            dict: month, key, bucket and counts arrays
+        """
+        gamma = (1 + DURATION_ACCURACY) / (1 - DURATION_ACCURACY)
+        minimum = float(sketch.MINIMUM)
+        binned = con.execute(
+            f"""
+            SELECT month,
+                code * 24 + hour AS key,
+                -- The buckets of DurationSketch.from_values
+                CAST(ceil(
+                    ln(greatest(CAST({measure} AS DOUBLE), {minimum}) / {minimum})
+                    / ln({gamma})
+                ) AS BIGINT) AS bucket,
+                count(*) AS counts
+            FROM trips
+            WHERE code IS NOT NULL AND {measure} >= 0 AND ({where})
+            GROUP BY ALL
+            """,
+            params or [],
+        ).fetchnumpy()
+        return {
+            column: np.asarray(binned[column], dtype=np.int64)
+            for column in ["month", "key", "bucket", "counts"]
+        }
+
+    def sketch_stations(self, con, stations: StationTable) -> StationSketches:
+        """Same output as StationSketches.from_rides, counted by DuckDB. Only
+        the distinct bikes of each station and month leave the database."""
+        n = len(stations)
+        sketches = StationSketches(stations.short_names)
+        months = con.execute(
+            """
+            SELECT month, bool_or(bike_id IS NOT NULL) AS has_bikes
+            FROM trips
+            WHERE month IS NOT NULL
+            GROUP BY month
+            """
+        ).fetchall()
+        durations = self.sketch_buckets(con, "duration")
+        bikes = con.execute(
+            """
+            SELECT DISTINCT month, code, bike_id
+            FROM trips
+            WHERE code IS NOT NULL AND bike_id IS NOT NULL
+            """
+        ).df()
+        for month, has_bikes in months:
+            rows = durations["month"] == month
+            in_month = bikes[bikes["month"] == month]
+            sketches.months[
+                pd.Period(year=month // 12, month=month % 12 + 1, freq="M")
+            ] = (
+                HyperLogLog.from_values(
+                    in_month["code"].to_numpy(np.int64), in_month["bike_id"], n
+                )
+                if has_bikes
+                else None,
+                DurationSketch.from_counts(
+                    durations["key"][rows],
+                    durations["bucket"][rows],
+                    durations["counts"][rows],
+                    n * 24,
+                ),
+            )
+        return sketches
+
+    def trip_stats(self, con, stations: StationTable, bounds=TRIP_BOUNDS) -> TripStats:
+        """Same output as TripStats.from_rides, counted by DuckDB.
+
+        Args:
+            con (duckdb.DuckDBPyConnection): From connect
+            stations (StationTable): Station codes to short names
+            bounds (dict, optional): See within_bounds. Defaults to TRIP_BOUNDS.
+
+        Returns:
+            TripStats: The statistics
+        """
+        n_keys = len(stations) * 24
+        # Rides with every measure known and within its bounds, see within_bounds
+        where = " AND ".join(f"{name} BETWEEN ? AND ?" for name in TripStats.MEASURES)
+        params = [
+            float(limit)
+            for name in TripStats.MEASURES
+            for limit in bounds.get(name, (-np.inf, np.inf))
+        ]
+        sums = con.execute(
+            f"""
+            SELECT code * 24 + hour AS key,
+                count(*) AS trips,
+                {", ".join(f"sum({name}) AS {name}" for name in TripStats.MEASURES)}
+            FROM trips
+            WHERE code IS NOT NULL AND {where}
+            GROUP BY ALL
+            """,
+            params,
+        ).fetchnumpy()
+        keys = np.asarray(sums["key"], dtype=np.int64)
+        sketches = {}
+        for name in TripStats.MEASURES:
+            sketch = TripStats.SKETCHES[name]
+            binned = self.sketch_buckets(con, name, where, params, sketch)
+            sketches[name] = sketch.from_counts(
+                binned["key"], binned["bucket"], binned["counts"], n_keys
+            )
+        return TripStats(
+            stations.short_names,
+            np.bincount(
+                keys, weights=np.asarray(sums["trips"]), minlength=n_keys
+            ).astype(np.int64),
+            {
+                name: np.bincount(
+                    keys, weights=np.asarray(sums[name]), minlength=n_keys
+                )
+                for name in TripStats.MEASURES
+            },
+            sketches,
+        )
+
+    def summarize(
+        self, files, df_station_geo, days=None, trip_bounds=TRIP_BOUNDS
+    ) -> dict:
+        """Hourly summaries, NTA rankings and the mergeable summaries for the
+        rides in some Parquet files.
+
+        Args:
+            files (list): Parquet files of prepared rides, e.g. RideStore.files(months)
+            df_station_geo (pd.DataFrame): Stations with NTA's joined
+            days (pd.DatetimeIndex, optional): Days the rides cover. Defaults to None.
+            trip_bounds (dict, optional): See TripStats.from_rides. Defaults to TRIP_BOUNDS.
+
+        Returns:
+            dict: Same keys as Main.summarize
+        """
+        logging.info(f"Aggregating {len(files)} Parquet files with DuckDB...")
+        stations = StationTable(df_station_geo)
+        con = self.connect(files, df_station_geo)
+        try:
+            df_hourly = self.agg_by_hour(con, days=days)
+            logging.info("Computing rankings...")
+            df_stations_per_nta = self.count_stations_per_nta(con)
+            df_rankings = self.rank_stations_by_nta(con, df_stations_per_nta)
+            cube = self.count_cube(con, stations, days=days)
+            flows = self.count_flows(con, stations)
+            sketches = self.sketch_stations(con, stations)
+            trips = self.trip_stats(con, stations, bounds=trip_bounds)
+        finally:
+            con.close()
+        return {
+            "hourly": df_hourly,
+            "ranking": df_rankings,
+            "cube": cube,
+            "flows": flows,
+            "sketches": sketches,
+            "trips": trips,
+        }
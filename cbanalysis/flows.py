@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .stations import StationTable
+
+
+class FlowMatrix:
+    """Origin-destination trip counts as a scipy CSR matrix. Row
+    hour * n + origin holds the trips leaving origin in that hour, one column
+    per destination, so only pairs with trips take any memory. With hours=1
+    there is one row per origin for the whole day.
+
+    Built per chunk of rides and combined with merge, like CountCube.
+    """
+
+    def __init__(self, names, matrix: sparse.csr_matrix, hours=1, ntacodes=None):
+        """
+        Args:
+            names (pd.Index): Name of each origin and destination, e.g. short names
+            matrix (sparse.csr_matrix): int32 [hours * len(names)][len(names)]
+            hours (int, optional): 24 when split by hour of day. Defaults to 1.
+            ntacodes (np.ndarray, optional): NTA of each station, for to_ntas. Defaults to None.
+        """
+        self.names = pd.Index(names)
+        self.matrix = matrix
+        self.hours = hours
+        self.ntacodes = ntacodes
+
+    @classmethod
+    def from_rides(cls, df: pd.DataFrame, stations: StationTable, by_hour=False):
+        """Count trips between stations.
+
+        Args:
+            df (pd.DataFrame): Prepared rides with station codes from Main.join_short_names
+            stations (StationTable): Station codes to short names and NTA's
+            by_hour (bool, optional): Split by hour the trips started. Defaults to False.
+
+        Returns:
+            FlowMatrix: The counts
+        """
+        origins = df["start_station_code"].to_numpy()
+        destinations = df["stop_station_code"].to_numpy()
+        known = (origins >= 0) & (destinations >= 0)
+        hours = df["start_hour"].to_numpy()[known] if by_hour else None
+        return cls.from_counts(stations, origins[known], destinations[known], hours)
+
+    @classmethod
+    def from_counts(
+        cls, stations: StationTable, origins, destinations, hours=None, trips=None
+    ):
+        """Build from trips already grouped by origin, destination and hour,
+        e.g. by a GROUP BY.
+
+        Args:
+            stations (StationTable): Station codes to short names and NTA's
+            origins (np.ndarray): Origin station code of each row
+            destinations (np.ndarray): Destination station code of each row
+            hours (np.ndarray, optional): Start hour of each row, for flows by hour. Defaults to None.
+            trips (np.ndarray, optional): Trips of each row. Defaults to one per row.
+
+        Returns:
+            FlowMatrix: The counts
+        """
+        n = len(stations)
+        rows = np.asarray(origins, dtype=np.int64)
+        if hours is not None:
+            rows = rows + np.asarray(hours, dtype=np.int64) * n
+        data = np.ones(len(rows), dtype=np.int32) if trips is None else trips
+        matrix = sparse.csr_matrix(
+            (
+                np.asarray(data, dtype=np.int32),
+                (rows, np.asarray(destinations, dtype=np.int64)),
+            ),
+            shape=((1 if hours is None else 24) * n, n),
+        )
+        # Repeated pairs are summed when converting to CSR
+        matrix.sum_duplicates()
+        return cls(
+            stations.short_names, matrix, 1 if hours is None else 24, stations.ntacodes
+        )
+
+    def merge(self, other: "FlowMatrix") -> "FlowMatrix":
+        """Add the trips of two matrices over the same stations and hours"""
+        if not self.names.equals(other.names) or self.hours != other.hours:
+            raise Exception("Can only merge flows over the same stations and hours")
+        return FlowMatrix(
+            self.names, self.matrix + other.matrix, self.hours, self.ntacodes
+        )
+
+    def reindex(self, stations: StationTable) -> "FlowMatrix":
+        """The same trips between stations numbered by another StationTable,
+        e.g. a newer feed's, with its NTA's; trips to or from stations it
+        lacks are dropped"""
+        names = stations.short_names
+        if self.names.equals(names):
+            return FlowMatrix(self.names, self.matrix, self.hours, stations.ntacodes)
+        n = len(self.names)
+        positions = names.get_indexer(self.names)
+        coo = self.matrix.tocoo()
+        origins = positions[coo.row % n]
+        destinations = positions[coo.col]
+        kept = (origins >= 0) & (destinations >= 0)
+        matrix = sparse.csr_matrix(
+            (
+                coo.data[kept],
+                ((coo.row // n)[kept] * len(names) + origins[kept], destinations[kept]),
+            ),
+            shape=(self.hours * len(names), len(names)),
+        )
+        return FlowMatrix(names, matrix, self.hours, stations.ntacodes)
+
+    def row(self, origin: int, hour=None) -> sparse.csr_matrix:
+        """Trips from an origin to every destination, in one hour or the whole day"""
+        n = len(self.names)
+        if hour is not None:
+            return self.matrix[hour * n + origin]
+        rows = np.arange(self.hours) * n + origin
+        return sparse.csr_matrix(self.matrix[rows].sum(axis=0))
+
+    def top_destinations(self, name, k=10, hour=None) -> list:
+        """The k destinations with the most trips from name, ties by name order.
+
+        Args:
+            name (str): Origin, e.g. a short name
+            k (int, optional): Destinations to return. Defaults to 10.
+            hour (int, optional): Hour of day, for hourly flows. Defaults to the whole day.
+
+        Returns:
+            list: (destination, trips) pairs, most trips first
+        """
+        row = self.row(self.names.get_loc(name), hour)
+        row.sum_duplicates()
+        order = np.lexsort((row.indices, -row.data))[:k]
+        return [
+            (self.names[j], int(c)) for j, c in zip(row.indices[order], row.data[order])
+        ]
+
+    def to_ntas(self) -> "FlowMatrix":
+        """Trips between NTA's, summed over the stations in each; stations
+        without an NTA are left out"""
+        ntacodes = pd.Series(self.ntacodes, dtype=object)
+        nta_of, ntas = pd.factorize(ntacodes, sort=True)
+        n, k = len(self.names), len(ntas)
+        coo = self.matrix.tocoo()
+        origins = nta_of[coo.row % n]
+        destinations = nta_of[coo.col]
+        known = (origins >= 0) & (destinations >= 0)
+        rows = (coo.row // n)[known] * k + origins[known]
+        matrix = sparse.csr_matrix(
+            (coo.data[known], (rows, destinations[known])), shape=(self.hours * k, k)
+        )
+        matrix.sum_duplicates()
+        return FlowMatrix(pd.Index(ntas), matrix, self.hours, np.asarray(ntas))
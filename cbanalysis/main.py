@@ -0,0 +1,622 @@
+__version__ = "0.1.0"
+import logging
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from functools import partial
+from pathlib import Path
+from time import strptime
+
+import pandas as pd
+
+from .cache import MAX_BYTES, StageCache
+from .cube import CountCube
+from .flows import FlowMatrix
+from .sketches import StationSketches, TripStats
+from .data_prep import Prepper
+from .duckdb_backend import DuckDBSummarizer
+from .reports import (
+    export_columnar_report,
+    export_flow_index,
+    export_sketches,
+    export_hourly_sql,
+    export_report,
+    export_stations_sql,
+    export_station_index,
+    iter_records,
+    station_groups,
+)
+from .schema import LAYOUT_VERSION
+from .stations import StationTable
+from .storage import PartialStore, RideStore
+from .summarize import Summarizer
+from .trips import TRIP_BOUNDS
+from .utils import WorkingPaths, days_in_months, months_in_range
+
+logging.info(f"Version: {__version__}")
+
+
+class Main:
+    # Seconds before remote inputs are fetched again
+    NTAS_TTL = 30 * 24 * 3600
+    STATIONS_TTL = 24 * 3600
+
+    def __init__(
+        self,
+        start_dir: Path = None,
+        engine="pandas",
+        download_workers=4,
+        backend="pandas",
+        workers=1,
+        cache_bytes=MAX_BYTES,
+        report_compression=("gzip",),
+        trip_bounds=TRIP_BOUNDS,
+    ):
+        self.paths = WorkingPaths(start_dir, touch=True)
+        self.engine = engine
+        self.dp = Prepper(self.paths, engine=engine, download_workers=download_workers)
+        # Processes that each fetch and count whole months; 1 runs in this process
+        self.workers = workers
+        self.summarizer = Summarizer(self.paths)
+        # `pandas` summarizes DataFrames; `duckdb` queries the Parquet ride cache
+        self.backend = backend
+        self.duckdb = DuckDBSummarizer(self.paths)
+        self.partials = PartialStore(self.paths.partials)
+        self.rides = RideStore(self.paths.rides)
+        self.cache = StageCache(self.paths.cache, max_bytes=cache_bytes)
+        # Compressed copies of the columnar report, see export_columnar_report
+        self.report_compression = report_compression
+        # Durations and distances kept in the trip statistics, see TripStats
+        self.trip_bounds = trip_bounds
+
+    def run(
+        self,
+        start_date="2022-01-01",
+        end_date="2022-02-01",
+        chunksize=None,
+        incremental=False,
+    ):
+        """Run the whole job.
+
+        Args:
+            start_date (str, optional): First month to fetch. Defaults to "2022-01-01".
+            end_date (str, optional): Last month to fetch. Defaults to "2022-02-01".
+            chunksize (int, optional): If set, stream rides in chunks of this many rows
+                instead of loading every month at once. Defaults to None.
+            incremental (bool, optional): Reuse stored per-month partial counts and only
+                process months that haven't been seen. Defaults to False.
+                Not used by the duckdb backend, which always reads the ride cache.
+        """
+        # Downlaod data
+        logging.info(f"{os.getenv('START_DATE')}-{os.getenv('END_DATE')}")
+        if self.backend != "duckdb" and self.workers > 1:
+            fetched = self.fetch_stations()
+            summarized = self.summarize_parallel(
+                fetched["stations"],
+                start_date,
+                end_date,
+                chunksize=chunksize,
+                incremental=incremental,
+            )
+        elif self.backend != "duckdb" and incremental:
+            fetched = self.fetch_stations()
+            summarized = self.summarize_incremental(
+                fetched["stations"],
+                start_date,
+                end_date,
+                chunksize=chunksize or 500_000,
+            )
+        else:
+            fetched = self.fetch_stations()
+            months = self.fetch_months(start_date, end_date, chunksize=chunksize)
+            # Summaries only depend on the stations, the cached rides, and
+            # the settings below
+            summarized = self.cache.cached(
+                "summarize",
+                lambda: self.summarize_months(fetched["stations"], months, chunksize),
+                inputs=[fetched["stations"], self.rides.files(months)],
+                params={
+                    "months": months,
+                    "backend": self.backend,
+                    "engine": self.engine,
+                    "chunksize": chunksize,
+                    "trip_bounds": self.trip_bounds,
+                },
+            )
+        # Export
+        self.export(
+            summarized["hourly"],
+            fetched["stations"],
+            summarized["ranking"],
+            cube=summarized.get("cube"),
+            flows=summarized.get("flows"),
+            sketches=summarized.get("sketches"),
+            trips=summarized.get("trips"),
+        )
+
+    def summarize_months(self, df_station_geo, months, chunksize=None):
+        """Summarize months that are in the ride cache with the configured backend.
+
+        Args:
+            df_station_geo (gpd.GeoDataFrame): Stations with NTA's joined
+            months (list): Months to summarize, see fetch_months
+            chunksize (int, optional): If set, the pandas backend streams rides
+                in chunks of this many rows. Defaults to None.
+
+        Returns:
+            dict: Same keys as summarize
+        """
+        days = days_in_months(months)
+        if self.backend == "duckdb":
+            # Every summary is a query over the ride cache; chunksize isn't needed
+            return self.duckdb.summarize(
+                self.rides.files(months),
+                df_station_geo,
+                days=days,
+                trip_bounds=self.trip_bounds,
+            )
+        if chunksize is None:
+            logging.info("Reading prepared rides from the Parquet cache...")
+            return self.summarize(df_station_geo, self.rides.read(months), days=days)
+        logging.info(f"Streaming cached rides in chunks of {chunksize} rows...")
+        chunks = self.rides.iter_batches(months, batch_size=chunksize)
+        return self.summarize_chunks(df_station_geo, chunks, days=days)
+
+    def fetch_months(self, start_date, end_date, chunksize=None) -> list:
+        logging.info(f"Downloading ZIPs from Citi Bike from {start_date} to {end_date}")
+
+        # download for range
+        months = months_in_range(start_date, end_date)
+        # Download every missing month at once, then parse them one by one
+        self.dp.download_ride_zips([m for m in months if not self.rides.has(m)])
+        for target in months:
+            self.fetch_month(target, chunksize=chunksize)
+        return months
+
+    def fetch_month(self, target, chunksize=None):
+        """Download, parse and prepare one month into the ride cache,
+        unless the cache already has it.
+
+        Args:
+            target (date): Month to fetch
+            chunksize (int, optional): If set, parse the CSVs in chunks of this many rows. Defaults to None.
+        """
+        # Cached rides are redone if the ZIP they came from has changed
+        glob_string = self.dp.month_glob(target.year, target.month)
+        path_zip = Path(glob_string)
+        key = self.prep_key(path_zip) if path_zip.exists() else None
+        if self.rides.has(target, key=key):
+            logging.info(f"Using cached rides: {target.year}, {target.month}")
+            return
+        logging.info(f"Fetching: {target.year}, {target.month}")
+        self.dp.download_ride_zips([target])
+        if chunksize is None:
+            all_months = self.dp.concat_csvs(glob_string=glob_string)
+            chunks = [self.dp.load_rename_rides(input_merged_rides=all_months)]
+        else:
+            chunks = self.dp.iter_prepped_rides(glob_string, chunksize=chunksize)
+        self.rides.write_month(target, chunks, key=self.prep_key(path_zip))
+
+    def prep_key(self, path_zip) -> str:
+        """Cache key of a month's prepared rides: its ZIP and the canonical layout"""
+        return self.cache.key("prep", [path_zip], params={"layout": LAYOUT_VERSION})
+
+    def fetch_stations(self):
+        logging.info("Loading NTAs...")
+        path_ntas = self.paths.cache / "ntas.parquet"
+        path_assigned = self.paths.cache / "station_ntas.parquet"
+        assigner = self.dp.load_nta_assigner(path_ntas, max_age=self.NTAS_TTL)
+        if (
+            path_assigned.exists()
+            and path_assigned.stat().st_mtime < path_ntas.stat().st_mtime
+        ):
+            # New polygons; assign every station again
+            path_assigned.unlink()
+
+        logging.info("Fetching station info...")
+        stations = self.cache.cached(
+            "fetch_station_info",
+            self.dp.fetch_station_info,
+            params={"url": self.dp.URL_STATION_FEED},
+            ttl=self.STATIONS_TTL,
+        )
+
+        df_station_geo = assigner.assign_stations(stations, path=path_assigned)
+        return {"ntas": assigner.ntas, "stations": df_station_geo}
+
+    def join_short_names(self, stations: StationTable, df_rides):
+        """Encode the rides' station ids to station codes and add short names.
+        Works on df_rides in place; no ride columns are copied.
+
+        Args:
+            stations (StationTable): Built from the stations with NTA's joined
+            df_rides (pd.DataFrame): Prepared rides
+
+        Returns:
+            pd.DataFrame: df_rides with {start,stop}_station_code and {start,stop}_short_name
+        """
+        for orient in ["start", "stop"]:
+            codes = stations.encode(df_rides[f"{orient}_station_id"])
+            df_rides[f"{orient}_station_code"] = codes
+            df_rides[f"{orient}_short_name"] = stations.short_name(codes)
+        return df_rides
+
+    def summarize(self, df_station_geo, df_rides, days=None):
+
+        logging.info("Aggregating ride data...")
+        stations = StationTable(df_station_geo)
+        df_rides = self.join_short_names(stations, df_rides)
+
+        # Start and stop counts by station, month, weekday and hour in one pass
+        summaries = self.summarize_rides(df_rides, stations)
+        return self.roll_up(df_station_geo, summaries, days=days)
+
+    def roll_up(self, df_station_geo, summaries, days=None) -> dict:
+        """Hourly profiles and NTA rankings from the merged summaries' cube,
+        so every mode reports from the one count of the rides.
+
+        Args:
+            df_station_geo (gpd.GeoDataFrame): Stations with NTA's joined
+            summaries (dict): Merged summaries with a "cube", see summarize_rides
+            days (pd.DatetimeIndex, optional): Days the rides cover, for mean_rides.
+                Defaults to the days the cube was counted over.
+
+        Returns:
+            dict: "hourly" and "ranking", and the summaries
+        """
+        cube = summaries["cube"]
+        if days is not None:
+            cube.days = days
+        df_hourly = cube.by_hour("start")
+
+        # compute rankings
+        df_stations_per_nta: pd.DataFrame = self.summarizer.count_stations_per_nta(
+            df_station_geo
+        )
+        logging.info("Computing rankings...")
+        df_rankings = self.summarizer.rank_station_totals(
+            cube.station_totals("start"),
+            StationTable(df_station_geo),
+            df_stations_per_nta,
+        )
+        # Also: trips between each pair of stations by hour ("flows"),
+        # per-month distinct counts and duration quantiles ("sketches"), and
+        # duration and distance statistics by station and hour ("trips")
+        return {"hourly": df_hourly, "ranking": df_rankings, **summaries}
+
+    def summarize_rides(self, df_rides, stations: StationTable) -> dict:
+        """Summaries of rides that merge across chunks and months (see
+        merge_summaries), so every mode builds them the same way: the
+        CountCube ("cube"), the hourly FlowMatrix ("flows"), the per-month
+        StationSketches ("sketches") and the TripStats ("trips").
+
+        Args:
+            df_rides (pd.DataFrame): Rides with station codes, see join_short_names
+            stations (StationTable): Station codes to short names and NTA's
+
+        Returns:
+            dict: Summaries by name
+        """
+        return {
+            "cube": CountCube.from_rides(df_rides, stations),
+            "flows": FlowMatrix.from_rides(df_rides, stations, by_hour=True),
+            "sketches": StationSketches.from_rides(df_rides, stations),
+            "trips": TripStats.from_rides(df_rides, stations, bounds=self.trip_bounds),
+        }
+
+    def empty_summaries(self, df_station_geo, months) -> dict:
+        """Summaries to merge chunks or months into, preallocated over the
+        months the rides are known to be in"""
+        names = StationTable(df_station_geo).short_names
+        return {"cube": CountCube.empty(names, months)}
+
+    def summarize_chunks(self, df_station_geo, rides_chunks, days=None):
+        """Summarize a stream of ride chunks, keeping only the small merged summaries.
+
+        Args:
+            df_station_geo (gpd.GeoDataFrame): Stations with NTA's joined
+            rides_chunks (iterable): Prepared ride DataFrames, e.g. from RideStore.iter_batches
+            days (pd.DatetimeIndex, optional): Days the rides cover, for mean_rides. Defaults to None.
+
+        Returns:
+            dict: Same keys as summarize
+        """
+        logging.info("Aggregating ride data in chunks...")
+        months = [] if days is None else days.to_period("M").unique()
+        merged = self.empty_summaries(df_station_geo, months)
+        self.count_chunks(df_station_geo, rides_chunks, merged=merged)
+        return self.roll_up(df_station_geo, merged, days=days)
+
+    def summarize_incremental(
+        self, df_station_geo, start_date, end_date, chunksize=500_000
+    ):
+        """Summarize a date range from per-month partial summaries, only
+        downloading and counting the months that are not in the partials store yet.
+
+        Args:
+            df_station_geo (gpd.GeoDataFrame): Stations with NTA's joined
+            start_date (str): First month to summarize
+            end_date (str): Last month to summarize
+            chunksize (int, optional): Rows per chunk when counting a new month. Defaults to 500_000.
+
+        Returns:
+            dict: Same keys as summarize
+        """
+        months = months_in_range(start_date, end_date)
+        stations = StationTable(df_station_geo)
+        stored = self.stored_months(months, stations)
+        self.dp.download_ride_zips(
+            [m for m in months if m not in stored and not self.rides.has(m)]
+        )
+        merged = self.empty_summaries(df_station_geo, months)
+        for target in months:
+            if target in stored:
+                summaries = self.partials.load(target)
+            else:
+                logging.info(f"Counting new month: {target.year}, {target.month}")
+                self.fetch_month(target, chunksize=chunksize)
+                chunks = self.rides.iter_batches([target], batch_size=chunksize)
+                summaries = self.count_chunks(df_station_geo, chunks)
+                self.save_partials(target, summaries, stations)
+            merge_summaries(merged, reindex_summaries(summaries, stations))
+
+        logging.info(f"Merged {len(months)} months of partial summaries")
+        return self.roll_up(df_station_geo, merged, days=days_in_months(months))
+
+    def summarize_parallel(
+        self, df_station_geo, start_date, end_date, chunksize=None, incremental=False
+    ):
+        """Fetch and count each month in its own process, then merge the
+        partial summaries here. Gives the same summaries as the serial paths.
+
+        Args:
+            df_station_geo (gpd.GeoDataFrame): Stations with NTA's joined
+            start_date (str): First month to summarize
+            end_date (str): Last month to summarize
+            chunksize (int, optional): Rows per chunk within a worker. Defaults to None.
+            incremental (bool, optional): Reuse and store per-month partial summaries. Defaults to False.
+
+        Returns:
+            dict: Same keys as summarize
+        """
+        months = months_in_range(start_date, end_date)
+        stations = StationTable(df_station_geo)
+        stored = self.stored_months(months, stations) if incremental else []
+        todo = [m for m in months if m not in stored]
+        logging.info(f"Counting {len(todo)} months in {self.workers} processes...")
+        worker = partial(
+            count_month,
+            Path.cwd(),
+            df_station_geo=df_station_geo,
+            engine=self.engine,
+            chunksize=chunksize,
+            trip_bounds=self.trip_bounds,
+        )
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            counted = dict(zip(todo, pool.map(worker, todo)))
+
+        merged = self.empty_summaries(df_station_geo, months)
+        for target in months:
+            if target in counted:
+                summaries = counted[target]
+                if incremental:
+                    self.save_partials(target, summaries, stations)
+            else:
+                summaries = self.partials.load(target)
+            merge_summaries(merged, reindex_summaries(summaries, stations))
+
+        logging.info(f"Merged {len(months)} months of partial summaries")
+        return self.roll_up(df_station_geo, merged, days=days_in_months(months))
+
+    def partials_key(self) -> str:
+        """Key of the settings partial summaries are counted with: the trip
+        bounds their TripStats keep, and the layout of the summaries.
+        Stations are checked month by month instead, see stored_months"""
+        return self.cache.key(
+            "partials",
+            [],
+            params={"version": PartialStore.VERSION, "trip_bounds": self.trip_bounds},
+        )
+
+    def stored_months(self, months, stations: StationTable) -> list:
+        """Months with stored partial summaries the current stations can
+        reuse: saved with the current partials_key, and counted with ride ids
+        that still name the same stations (see StationTable.agrees_with).
+        Stations the feed gained or lost only renumber the others, which
+        reindex_summaries undoes.
+
+        Args:
+            months (list): Months wanted
+            stations (StationTable): Current stations
+
+        Returns:
+            list: The months that don't need counting
+        """
+        key = self.partials_key()
+        return [
+            month
+            for month in months
+            if self.partials.has(month, key=key)
+            and stations.agrees_with(self.partials.ride_ids(month))
+        ]
+
+    def save_partials(self, month, summaries, stations: StationTable):
+        self.partials.save(
+            month, summaries, key=self.partials_key(), ride_ids=stations.ride_ids()
+        )
+
+    def count_chunks(self, df_station_geo, rides_chunks, merged=None) -> dict:
+        """Summarize each chunk of rides and merge the summaries.
+
+        Args:
+            df_station_geo (gpd.GeoDataFrame): Stations with NTA's joined
+            rides_chunks (iterable): Prepared ride DataFrames
+            merged (dict, optional): Summaries to merge every chunk's (see
+                summarize_rides) into, e.g. from empty_summaries. Defaults to a new dict.
+
+        Returns:
+            dict: merged
+        """
+        stations = StationTable(df_station_geo)
+        merged = {} if merged is None else merged
+        for chunk in rides_chunks:
+            chunk = self.join_short_names(stations, chunk)
+            merge_summaries(merged, self.summarize_rides(chunk, stations))
+        return merged
+
+    def export(
+        self,
+        df_hourly,
+        df_station_geo,
+        df_rankings,
+        cube=None,
+        flows=None,
+        sketches=None,
+        trips=None,
+    ):
+        logging.info("Compiling report...")
+
+        # Trip statistics go into the hourly report, empty where no ride was kept
+        if trips is not None:
+            df_hourly = df_hourly.merge(
+                trips.to_frame(), on=["short_name", "start_hour"], how="left"
+            )
+            df_hourly["trips"] = df_hourly["trips"].fillna(0).astype("int64")
+
+        report = {
+            "df_hourly": df_hourly,
+            "df_station_geo": df_station_geo,
+            "df_rankings": df_rankings,
+        }
+
+        # # Save a pickle
+        # with open("report.pickle", "wb") as handle:
+        #     pickle.dump(report, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Join the rankings onto the station_geo for mapbox
+        df_station_geo_ranked = self.summarizer.join_rankings(
+            df_rankings=df_rankings, df_station_geo=df_station_geo
+        )
+
+        # Save individual report files
+        # Save the geojson with special option
+        with open(self.paths.out / "station_geo_ranked.geojson", "wb") as file:
+            df_station_geo_ranked.to_file(file, driver="GeoJSON")
+
+        # Stream each report straight to JSON and MsgPack, don't build dicts
+        # Hours without trip statistics are written as null; NaN isn't valid JSON
+        df_hourly_report = df_hourly.astype(object).where(df_hourly.notna(), None)
+        reports = {
+            "df_summary_hourly": (*station_groups(df_hourly_report), True),
+            "df_station_ranking": (iter_records(df_rankings), len(df_rankings), False),
+        }
+        for key, (items, length, mapping) in reports.items():
+            export_report(
+                items,
+                length,
+                self.paths.out / f"{key}.json",
+                self.paths.out / f"{key}.msgpack",
+                mapping=mapping,
+            )
+
+        # Dense typed arrays for the planner client
+        export_columnar_report(
+            df_hourly,
+            self.paths.out / "df_summary_hourly.cbr",
+            df_weekday_hourly=cube.by_weekday_hour("start") if cube else None,
+            compression=self.report_compression,
+        )
+
+        # For cbserver's /api/destinations
+        if flows is not None:
+            export_flow_index(flows, self.paths.out / "flows_stations.idx")
+            export_flow_index(flows.to_ntas(), self.paths.out / "flows_ntas.idx")
+
+        # Mergeable per-month sketches, see read_sketches
+        if sketches is not None:
+            export_sketches(sketches, self.paths.out / "sketches.msgpack")
+
+        # For cbserver's file-backed mode
+        export_station_index(
+            df_hourly, df_station_geo, df_rankings, self.paths.out / "stations.idx"
+        )
+
+        # Save a packed report file
+        # path_report = self.paths.out / "full-report.json"
+        # logging.info(f"Saving report to: {path_report}")
+        # export_json(json_report, path_report)
+        # export_msgpack(json_report, path_report)
+        if os.getenv("SQLALCHEMY_CONN") is not None:
+            export_hourly_sql(df_hourly)
+            export_stations_sql(df_station_geo, df_rankings)
+
+
+def count_month(
+    cwd,
+    target,
+    df_station_geo,
+    engine="pandas",
+    chunksize=None,
+    trip_bounds=TRIP_BOUNDS,
+):
+    """Process pool worker for Main.summarize_parallel: download, parse and
+    prepare one month into the ride cache, then count it.
+
+    Args:
+        cwd (Path): Working directory of the parent job
+        target (date): Month to count
+        df_station_geo (gpd.GeoDataFrame): Stations with NTA's joined
+        engine (str, optional): CSV parser. Defaults to "pandas".
+        chunksize (int, optional): Rows per chunk. Defaults to None.
+        trip_bounds (dict, optional): See Main. Defaults to TRIP_BOUNDS.
+
+    Returns:
+        dict: The month's summaries, see Main.count_chunks
+    """
+    job = Main(
+        start_dir=cwd, engine=engine, download_workers=1, trip_bounds=trip_bounds
+    )
+    job.fetch_month(target, chunksize=chunksize)
+    batches = job.rides.iter_batches([target], batch_size=chunksize or 500_000)
+    return job.count_chunks(df_station_geo, batches)
+
+
+def merge_summaries(merged: dict, summaries: dict) -> dict:
+    """Fold the summaries of one chunk or month into merged, in place.
+    Cubes are added into the merged cube rather than copied, see CountCube.add.
+
+    Args:
+        merged (dict): Summaries so far, e.g. from Main.empty_summaries
+        summaries (dict): Summaries by name, e.g. from Main.summarize_rides
+
+    Returns:
+        dict: merged
+    """
+    for key, summary in summaries.items():
+        if key not in merged:
+            merged[key] = summary
+        elif isinstance(merged[key], CountCube):
+            merged[key].add(summary)
+        else:
+            merged[key] = merged[key].merge(summary)
+    return merged
+
+
+def reindex_summaries(summaries: dict, stations: StationTable) -> dict:
+    """Summaries counted against an older station feed, numbered by
+    stations instead, e.g. to merge stored months into this run's.
+
+    Args:
+        summaries (dict): Summaries by name, e.g. from PartialStore.load
+        stations (StationTable): Current stations
+
+    Returns:
+        dict: Summaries by name
+    """
+    return {key: summary.reindex(stations) for key, summary in summaries.items()}
+
+
+if __name__ == "__main__":
+    logging.info("See cli.py for a runnable mode")
+    pass
@@ -0,0 +1,86 @@
+from pathlib import Path
+import logging
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+# NTA fields joined onto stations and rides
+NTA_COLUMNS = ["boroname", "ntaname", "ntacode"]
+STATION_COLUMNS = ["station_id", "short_name", "legacy_id", "name"]
+
+
+class NtaAssigner:
+    """Point-in-polygon lookups of NTA's against a prebuilt STRtree.
+    Points are looked up in bulk, with one tree query per call."""
+
+    def __init__(self, ntas: gpd.GeoDataFrame):
+        """
+        Args:
+            ntas (gpd.GeoDataFrame): NTA polygons, e.g. from Prepper.load_ntas
+        """
+        self.ntas = ntas.loc[:, NTA_COLUMNS + ["geometry"]].reset_index(drop=True)
+        self.tree = shapely.STRtree(np.asarray(self.ntas.geometry))
+
+    @classmethod
+    def from_parquet(cls, path: Path):
+        return cls(gpd.read_parquet(path))
+
+    def to_parquet(self, path: Path) -> Path:
+        """Save the polygons as GeoParquet, which loads far faster than the GeoJSON"""
+        logging.info(f"Saving NTA polygons to {path}")
+        self.ntas.to_parquet(path)
+        return path
+
+    def lookup(self, lng, lat) -> np.ndarray:
+        """Find the NTA of each point.
+
+        Args:
+            lng (array-like): Longitudes
+            lat (array-like): Latitudes
+
+        Returns:
+            np.ndarray: Row of self.ntas for each point, -1 outside every NTA
+        """
+        points = shapely.points(
+            np.asarray(lng, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+        )
+        point_idx, nta_idx = self.tree.query(points, predicate="intersects")
+        rows = np.full(len(points), -1, dtype=np.int32)
+        # Points on a shared border match twice; keep the first NTA, like sjoin's first row
+        rows[point_idx[::-1]] = nta_idx[::-1]
+        return rows
+
+    def assign_stations(
+        self, stations: gpd.GeoDataFrame, path=None
+    ) -> gpd.GeoDataFrame:
+        """Join NTA fields onto stations. With a path, assignments are kept
+        there between runs, and only stations not seen before are looked up.
+
+        Args:
+            stations (gpd.GeoDataFrame): Stations from Prepper.fetch_station_info
+            path (Path, optional): Parquet file of earlier assignments. Defaults to None.
+
+        Returns:
+            gpd.GeoDataFrame: Same layout as Prepper.sjoin_ntas_stations
+        """
+        known = pd.DataFrame(columns=["station_id"] + NTA_COLUMNS)
+        if path is not None and Path(path).exists():
+            known = pd.read_parquet(path)
+        new = stations[~stations["station_id"].isin(known["station_id"])]
+        logging.info(f"Assigning NTA's to {len(new)} new stations")
+
+        rows = self.lookup(new.geometry.x, new.geometry.y)
+        assigned = self.take(rows)
+        assigned.insert(0, "station_id", new["station_id"].to_numpy())
+        known = pd.concat([known, assigned], ignore_index=True)
+        if path is not None and len(new):
+            known.to_parquet(path, index=False)
+
+        joined = stations.merge(known, on="station_id", how="left")
+        return joined.loc[:, STATION_COLUMNS + NTA_COLUMNS + ["geometry"]]
+
+    def take(self, rows: np.ndarray) -> pd.DataFrame:
+        """NTA fields for rows from lookup, NaN for -1"""
+        return self.ntas.loc[:, NTA_COLUMNS].reindex(rows).reset_index(drop=True)
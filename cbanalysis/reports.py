@@ -0,0 +1,746 @@
+# # Generate JSON report data
+import gzip
+import io
+import json
+import logging
+import os
+import msgpack
+import pickle
+import struct
+import uuid
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sqlalchemy import create_engine, text
+
+from dotenv import load_dotenv
+
+from .flows import FlowMatrix
+from .sketches import DurationSketch, HyperLogLog, StationSketches
+
+load_dotenv()
+
+# Tables read by cbserver
+HOURLY_TABLE = "summary_hourly"
+EXPORTS_TABLE = "summary_exports"
+STATIONS_TABLE = "summary_stations"
+STATION_COLUMNS = [
+    "short_name",
+    "station_id",
+    "name",
+    "ntacode",
+    "ntaname",
+    "boroname",
+    "lng",
+    "lat",
+    "station_rank",
+    "stations_count",
+]
+# Rows per COPY or INSERT batch
+COPY_CHUNKSIZE = 100_000
+
+# Binary station index read by cbserver/station_index.py; keep the two in step
+INDEX_MAGIC = b"CBIX"
+INDEX_VERSION = 2
+# magic, version, hours, stations, NTA's, then offsets of the short names,
+# station names, NTA codes, NTA names, boroughs, hourly counts, stations and
+# coordinates sections
+INDEX_HEADER = struct.Struct("<4sHHIIIIIIIIII")
+
+# Origin-destination flows read by cbserver/station_index.py; keep the two in step
+FLOW_MAGIC = b"CBFL"
+FLOW_VERSION = 1
+# magic, version, hours, names, nonzero cells, then offsets of the names,
+# row pointer, column index and count sections
+FLOW_HEADER = struct.Struct("<4sHHIIIIII")
+
+# Columnar report for the planner client: a header, then a MsgPack map of typed arrays
+REPORT_MAGIC = b"CBRP"
+REPORT_VERSION = 1
+# magic, version, reserved
+REPORT_HEADER = struct.Struct("<4sHH")
+# Sketches saved next to the reports, see export_sketches
+SKETCHES_VERSION = 2
+# File suffix of each compressed copy
+REPORT_COMPRESSION = {"gzip": ".gz", "brotli": ".br", "zstd": ".zst"}
+
+
+def load_pickle():
+    with open("./temp/report.pickle", "rb") as f:
+        data = pickle.load(f)
+        print("Loaded:")
+
+
+def export_msgpack(input_dict, path_report) -> Path:
+    """Export a MsgPack file for the client
+
+    Args:
+        input_dict (_type_): _description_
+
+    Returns:
+        Path: _description_ Output path
+    """
+    with open(path_report, "wb") as f:
+        logging.info(f"Saving MsgPack to {path_report}")
+        msgpack.dump(input_dict, f)
+
+    pass
+
+
+def export_json(json_data, path_report):
+    """Save JSON to file.
+
+    Args:
+        json_data ([type]): [description]
+        path_report ([type]): [description]
+    """
+    with open(path_report, "w") as f:
+        logging.info(f"Saving to {path_report}")
+        json_string = json.dumps(json_data)
+        f.write(json_string)
+
+
+def record_lists(df: pd.DataFrame) -> dict:
+    """Each column as a list of Python values, converted from numpy once per column"""
+    return {column: df[column].tolist() for column in df.columns}
+
+
+def iter_records(df: pd.DataFrame):
+    """Rows as dicts, like to_dict(orient="records") without building the list"""
+    columns = record_lists(df)
+    names = list(columns)
+    for row in zip(*columns.values()):
+        yield dict(zip(names, row))
+
+
+def station_groups(df: pd.DataFrame, by="short_name", columns=None):
+    """Split a df into each station's records in one pass over sorted arrays,
+    instead of a groupby and to_dict per station.
+
+    Args:
+        df (pd.DataFrame): Aggregated data, e.g. the hourly summary
+        by (str, optional): Station column. Defaults to "short_name".
+        columns (list, optional): Columns in each record. Defaults to all.
+
+    Returns:
+        tuple: Iterator of (station, records) in station order, and the number of stations
+    """
+    df = df.sort_values(by, kind="stable")
+    keys, starts = np.unique(df[by].astype(str).to_numpy(), return_index=True)
+    stops = np.append(starts[1:], len(df))
+    columns = record_lists(df.loc[:, columns] if columns is not None else df)
+    names = list(columns)
+
+    def groups():
+        for key, start, stop in zip(keys.tolist(), starts.tolist(), stops.tolist()):
+            rows = zip(*(values[start:stop] for values in columns.values()))
+            yield key, [dict(zip(names, row)) for row in rows]
+
+    return groups(), len(keys)
+
+
+def export_groups_by_stations(df) -> dict:
+    """Given a df of aggregated data, group by station id and
+    export a dictionary of all
+
+    Args:
+        df (pd.DataFrame): Aggregated data with short_name
+
+    Returns:
+        dict: Records of each station by short_name
+    """
+    return dict(station_groups(df)[0])
+
+
+def export_report(items, length, path_json, path_msgpack, mapping=True):
+    """Write the same report as JSON and MsgPack in one pass, encoding one
+    item at a time, so neither the whole object nor the whole JSON string
+    is held in memory. Output matches export_json and export_msgpack.
+
+    Args:
+        items (iterable): (key, value) pairs when mapping, else values
+        length (int): Number of items, for the MsgPack header
+        path_json (Path): JSON output path
+        path_msgpack (Path): MsgPack output path
+        mapping (bool, optional): Write an object rather than an array. Defaults to True.
+    """
+    logging.info(f"Saving to {path_json} and {path_msgpack}")
+    packer = msgpack.Packer()
+    with open(path_json, "w") as f_json, open(path_msgpack, "wb") as f_msgpack:
+        if mapping:
+            f_json.write("{")
+            f_msgpack.write(packer.pack_map_header(length))
+        else:
+            f_json.write("[")
+            f_msgpack.write(packer.pack_array_header(length))
+        for i, item in enumerate(items):
+            if i:
+                f_json.write(", ")
+            if mapping:
+                key, item = item
+                f_json.write(json.dumps(key) + ": ")
+                f_msgpack.write(packer.pack(key))
+            f_json.write(json.dumps(item))
+            f_msgpack.write(packer.pack(item))
+        f_json.write("}" if mapping else "]")
+
+
+def bulk_load(connection, df: pd.DataFrame, table, indexes=(), unique=()) -> str:
+    """Load rows into a fresh staging table and index it, leaving the live
+    table untouched until swap_tables. PostgreSQL through psycopg2 streams the
+    rows through COPY; other drivers and databases (SQLite, for local runs)
+    use executemany.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Open connection
+        df (pd.DataFrame): Rows; the index is not written
+        table (str): Live table name
+        indexes (tuple, optional): Columns to index. Defaults to ().
+        unique (tuple, optional): Columns to give unique indexes. Defaults to ().
+
+    Returns:
+        str: Name of the first index, e.g. to CLUSTER on
+    """
+    staging = f"{table}_staging"
+    connection.execute(text(f"DROP TABLE IF EXISTS {staging}"))
+    df.head(0).to_sql(name=staging, con=connection, index=False)
+    # copy_expert is psycopg2's own; psycopg 3, pg8000 etc. don't have it
+    if (
+        connection.dialect.name == "postgresql"
+        and connection.dialect.driver == "psycopg2"
+    ):
+        _copy_rows(connection, df, staging)
+    else:
+        df.to_sql(
+            name=staging,
+            con=connection,
+            if_exists="append",
+            index=False,
+            chunksize=COPY_CHUNKSIZE,
+        )
+
+    # Index names are per schema, so give each load its own
+    token = uuid.uuid4().hex[:8]
+    names = []
+    for column, kind in [(c, "INDEX") for c in indexes] + [
+        (c, "UNIQUE INDEX") for c in unique
+    ]:
+        name = f"ix_{table}_{column}_{token}"
+        connection.execute(text(f"CREATE {kind} {name} ON {staging} ({column})"))
+        names.append(name)
+    return names[0] if names else None
+
+
+def _copy_rows(connection, df: pd.DataFrame, table):
+    """COPY rows in as CSV, a chunk at a time to bound memory"""
+    cursor = connection.connection.cursor()
+    columns = ", ".join(f'"{column}"' for column in df.columns)
+    for start in range(0, len(df), COPY_CHUNKSIZE):
+        buffer = io.StringIO()
+        df.iloc[start : start + COPY_CHUNKSIZE].to_csv(
+            buffer, index=False, header=False
+        )
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+    cursor.close()
+
+
+def swap_tables(connection, tables):
+    """Replace live tables with their loaded staging tables. Run inside one
+    transaction; on PostgreSQL readers see either the old or the new tables."""
+    for table in tables:
+        connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        connection.execute(text(f"ALTER TABLE {table}_staging RENAME TO {table}"))
+
+
+def drop_staging(engine, tables):
+    """Remove staging tables left by a failed export. The export's transaction
+    already rolled them back on PostgreSQL, but SQLite runs DDL outside it."""
+    with engine.begin() as connection:
+        for table in tables:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table}_staging"))
+
+
+def export_hourly_sql(df: pd.DataFrame, conn=None) -> None or int:
+    """Replace the hourly summary table that cbserver reads.
+    Rows are written sorted by station with an index on short_name, so a
+    station's rows are one index range. They are bulk loaded into a staging
+    table and swapped in within one transaction, so the live table never goes
+    missing mid-export and a failed export leaves it as it was.
+    A row in summary_exports tells servers to drop the responses they have cached.
+
+    Args:
+        df (pd.DataFrame): Hourly summary
+        conn (str, optional): SQLAlchemy URL. Defaults to $SQLALCHEMY_CONN.
+
+    Returns:
+        int: Rows written to summary_hourly
+    """
+    conn = conn or os.getenv("SQLALCHEMY_CONN")
+    engine = create_engine(conn)
+    logging.info(
+        f"Exporting to SQL database using connection string: SQLALCHEMY_CONN..."
+    )
+    # Keep each station's rows together, in the order the server returns them.
+    # The `index` column is cbserver's primary key.
+    df = df.sort_values(["short_name", "start_hour"]).reset_index(drop=True)
+    tables = [HOURLY_TABLE]
+    try:
+        with engine.begin() as connection:
+            index_name = bulk_load(
+                connection, df.reset_index(), HOURLY_TABLE, indexes=["short_name"]
+            )
+            if connection.dialect.name == "postgresql":
+                connection.execute(
+                    text(f"CLUSTER {HOURLY_TABLE}_staging USING {index_name}")
+                )
+            swap_tables(connection, tables)
+            record_export(connection)
+    except Exception:
+        drop_staging(engine, tables)
+        raise
+    logging.info(f"{len(df)} rows affected")
+    return len(df)
+
+
+def record_export(connection):
+    """Add a row to summary_exports, so servers drop the responses they have cached"""
+    pd.DataFrame(
+        {"export_id": [uuid.uuid4().hex], "exported_at": [pd.Timestamp.utcnow()]}
+    ).to_sql(name=EXPORTS_TABLE, con=connection, if_exists="append", index=False)
+
+
+def station_rows(df_station_geo: gpd.GeoDataFrame, df_rankings) -> pd.DataFrame:
+    """One row per station for summary_stations: its NTA, its rank within
+    the NTA and its coordinates.
+
+    Args:
+        df_station_geo (gpd.GeoDataFrame): Stations with NTA's joined
+        df_rankings (pd.DataFrame): station_rank and stations_count by short name
+
+    Returns:
+        pd.DataFrame: STATION_COLUMNS, with null ranks for unranked stations
+    """
+    stations = df_station_geo[df_station_geo["short_name"].notna()]
+    stations = stations.drop_duplicates("short_name")
+    short_names = stations["short_name"].astype(str)
+    ranks = df_rankings.set_axis(df_rankings.index.astype(str)).reindex(short_names)
+    df = pd.DataFrame(
+        {
+            "short_name": short_names.to_numpy(),
+            "station_id": stations["station_id"].astype(str).to_numpy(),
+            "name": stations["name"].to_numpy(),
+            "ntacode": stations["ntacode"].to_numpy(),
+            "ntaname": stations["ntaname"].to_numpy(),
+            "boroname": stations["boroname"].to_numpy(),
+            "lng": stations.geometry.x.to_numpy(),
+            "lat": stations.geometry.y.to_numpy(),
+            "station_rank": ranks["station_rank"].astype("Int32").array,
+            "stations_count": ranks["stations_count"].astype("Int32").array,
+        }
+    )
+    return df.sort_values(["ntacode", "station_rank", "short_name"]).loc[
+        :, STATION_COLUMNS
+    ]
+
+
+def export_stations_sql(df_station_geo, df_rankings, conn=None) -> int:
+    """Replace summary_stations, the rankings and station locations that
+    cbserver looks up one station or one NTA at a time. Indexed by short_name
+    and by ntacode, and swapped in like the hourly tables.
+
+    Args:
+        df_station_geo (gpd.GeoDataFrame): Stations with NTA's joined
+        df_rankings (pd.DataFrame): From Summarizer.rank_station_totals
+        conn (str, optional): SQLAlchemy URL. Defaults to $SQLALCHEMY_CONN.
+
+    Returns:
+        int: Rows written
+    """
+    engine = create_engine(conn or os.getenv("SQLALCHEMY_CONN"))
+    df = station_rows(df_station_geo, df_rankings)
+    logging.info(f"Exporting {len(df)} stations to {STATIONS_TABLE}")
+    try:
+        with engine.begin() as connection:
+            bulk_load(
+                connection,
+                df,
+                STATIONS_TABLE,
+                indexes=["ntacode"],
+                unique=["short_name"],
+            )
+            swap_tables(connection, [STATIONS_TABLE])
+            record_export(connection)
+    except Exception:
+        drop_staging(engine, [STATIONS_TABLE])
+        raise
+    return len(df)
+
+
+def _string_table(values) -> bytes:
+    """u32 offsets (one more than there are values) followed by UTF-8 bytes"""
+    encoded = [str(v).encode() for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return offsets.tobytes() + b"".join(encoded)
+
+
+def _pad(blob: bytes, alignment=4) -> bytes:
+    return blob + b"\0" * (-len(blob) % alignment)
+
+
+def dense_counts(df, names, column="counts", dtype="<u4", by_weekday=False):
+    """Scatter long-format summary rows into a dense array by station.
+
+    Args:
+        df (pd.DataFrame): short_name, start_hour (and start_weekday), and column
+        names (list): Station short names, in row order of the result
+        column (str, optional): Values to scatter. Defaults to "counts".
+        dtype (str, optional): Result dtype. Defaults to "<u4".
+        by_weekday (bool, optional): Also split by start_weekday. Defaults to False.
+
+    Returns:
+        np.ndarray: [stations][24], or [stations][7][24] by weekday
+    """
+    rows = pd.Index(names).get_indexer(df["short_name"].astype(str))
+    keys = [rows, df["start_hour"].to_numpy()]
+    if by_weekday:
+        keys.insert(1, df["start_weekday"].to_numpy())
+    dense = np.zeros((len(names), 7, 24) if by_weekday else (len(names), 24), dtype)
+    np.add.at(dense, tuple(keys), df[column].to_numpy())
+    return dense
+
+
+def _typed_array(values: np.ndarray) -> dict:
+    return {
+        "dtype": values.dtype.str,
+        "shape": list(values.shape),
+        "data": values.tobytes(),
+    }
+
+
+def compress(blob: bytes, compression) -> bytes:
+    """Compress with gzip, or brotli/zstd if those packages are installed"""
+    if compression == "gzip":
+        # No timestamp, so unchanged reports compress to unchanged files
+        return gzip.compress(blob, mtime=0)
+    if compression == "brotli":
+        import brotli
+
+        return brotli.compress(blob)
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=19).compress(blob)
+    raise Exception(f"Unknown compression: {compression}")
+
+
+def export_columnar_report(
+    df_hourly, path_report, df_weekday_hourly=None, compression=()
+) -> list:
+    """Save the hourly summary for the planner client as one dictionary of
+    short names and dense typed arrays, instead of a list of records per
+    station. Station i's counts are counts[i * 24:(i + 1) * 24], so the client
+    turns each array into one Uint32Array or Float32Array instead of decoding
+    records. MsgPack puts the data bytes at any offset in the file, so the
+    client copies them into an aligned buffer first (e.g. data.slice()) rather
+    than viewing them in place.
+
+    Layout: REPORT_HEADER, then a MsgPack map of
+        version, stations (sorted short names), and typed arrays counts
+        (u32 [stations][24]), mean_rides (f32 [stations][24]) and optionally
+        weekday_counts and weekday_mean_rides ([stations][7][24]).
+        A typed array is a map of dtype, shape and little-endian data bytes.
+
+    Args:
+        df_hourly (pd.DataFrame): short_name, start_hour, counts, mean_rides
+        path_report (Path): Output path
+        df_weekday_hourly (pd.DataFrame, optional): See CountCube.by_weekday_hour. Defaults to None.
+        compression (tuple, optional): Also write compressed copies, e.g. ("gzip", "brotli"). Defaults to ().
+
+    Returns:
+        list: Paths written
+    """
+    names = sorted(set(df_hourly["short_name"].astype(str)))
+    report = {
+        "version": REPORT_VERSION,
+        "stations": names,
+        "counts": _typed_array(dense_counts(df_hourly, names)),
+    }
+    if "mean_rides" in df_hourly.columns:
+        report["mean_rides"] = _typed_array(
+            dense_counts(df_hourly, names, "mean_rides", "<f4")
+        )
+    if df_weekday_hourly is not None:
+        report["weekday_counts"] = _typed_array(
+            dense_counts(df_weekday_hourly, names, by_weekday=True)
+        )
+        report["weekday_mean_rides"] = _typed_array(
+            dense_counts(df_weekday_hourly, names, "mean_rides", "<f4", by_weekday=True)
+        )
+    blob = REPORT_HEADER.pack(REPORT_MAGIC, REPORT_VERSION, 0) + msgpack.packb(report)
+
+    written = []
+    path_report = Path(path_report)
+    for encoding in (None, *compression):
+        path = path_report
+        data = blob
+        if encoding is not None:
+            path = Path(f"{path_report}{REPORT_COMPRESSION[encoding]}")
+            data = compress(blob, encoding)
+        logging.info(f"Saving columnar report to {path} ({len(data)} bytes)")
+        part = Path(f"{path}.part")
+        part.write_bytes(data)
+        os.replace(part, path)
+        written.append(path)
+    return written
+
+
+def read_columnar_report(path_report) -> dict:
+    """Load a report from export_columnar_report, with numpy arrays"""
+    path_report = Path(path_report)
+    blob = path_report.read_bytes()
+    if path_report.suffix == ".gz":
+        blob = gzip.decompress(blob)
+    elif path_report.suffix == ".br":
+        import brotli
+
+        blob = brotli.decompress(blob)
+    elif path_report.suffix == ".zst":
+        import zstandard
+
+        blob = zstandard.ZstdDecompressor().decompress(blob)
+    magic, version, _ = REPORT_HEADER.unpack_from(blob)
+    if magic != REPORT_MAGIC or version != REPORT_VERSION:
+        raise Exception(f"{path_report} is not a version {REPORT_VERSION} report")
+    report = msgpack.unpackb(blob[REPORT_HEADER.size :])
+    for key, value in report.items():
+        if isinstance(value, dict) and "dtype" in value:
+            report[key] = _from_typed_array(value)
+    return report
+
+
+def export_station_index(df_hourly, df_station_geo, df_rankings, path_index) -> Path:
+    """Pack hourly counts and the summary_stations rows (see station_rows)
+    into one binary file that cbserver memory-maps, so it answers like the
+    database does. Every station has a fixed-size slot, so a lookup is an
+    offset computation instead of a query.
+
+    Layout, little-endian, every section 8-byte aligned:
+        header: INDEX_HEADER
+        names: string table of short_names, sorted
+        labels: string table of station names
+        ntas: string table of NTA codes, sorted
+        nta_names, boros: string tables of each NTA's name and borough
+        hourly: u32 counts[stations with counts][24]
+        stations: i32 [stations][4]: NTA (-1 for none), station_rank and
+            stations_count (0 for none), and row of hourly (-1 for none)
+        coordinates: f64 [stations][2]: lng and lat, NaN for none
+
+    Args:
+        df_hourly (pd.DataFrame): short_name, start_hour, counts
+        df_station_geo (gpd.GeoDataFrame): Stations with NTA's joined
+        df_rankings (pd.DataFrame): ntacode, station_rank and stations_count by short name
+        path_index (Path): Output path
+
+    Returns:
+        Path: Output path
+    """
+    rows = station_rows(df_station_geo, df_rankings).set_index("short_name")
+    hourly_names = sorted(set(df_hourly["short_name"].astype(str)))
+    names = sorted(set(rows.index) | set(hourly_names))
+    rows = rows.reindex(names)
+
+    # Each NTA's name and borough, from its first station
+    by_nta = rows.dropna(subset=["ntacode"]).groupby("ntacode").first()
+    ntas = list(by_nta.index)
+    stations = np.zeros((len(names), 4), dtype="<i4")
+    stations[:, 0] = pd.Index(ntas).get_indexer(rows["ntacode"])
+    stations[:, 1] = rows["station_rank"].fillna(0).to_numpy()
+    stations[:, 2] = rows["stations_count"].fillna(0).to_numpy()
+    stations[:, 3] = pd.Index(hourly_names).get_indexer(names)
+    coordinates = rows[["lng", "lat"]].to_numpy(dtype="<f8", na_value=np.nan)
+
+    sections = [
+        _pad(_string_table(names), 8),
+        _pad(_string_table(rows["name"].fillna("")), 8),
+        _pad(_string_table(ntas), 8),
+        _pad(_string_table(by_nta["ntaname"].fillna("")), 8),
+        _pad(_string_table(by_nta["boroname"].fillna("")), 8),
+        _pad(dense_counts(df_hourly, hourly_names).tobytes(), 8),
+        stations.tobytes(),
+        coordinates.tobytes(),
+    ]
+    offsets = np.cumsum([INDEX_HEADER.size] + [len(b) for b in sections[:-1]])
+    # The header is 48 bytes, so every section starts 8-byte aligned
+    header = INDEX_HEADER.pack(
+        INDEX_MAGIC, INDEX_VERSION, 24, len(names), len(ntas), *offsets.tolist()
+    )
+
+    # Write next to the old file and swap, so servers never map a half-written file
+    path_index = Path(path_index)
+    part = path_index.with_suffix(".part")
+    logging.info(f"Saving station index to {path_index}")
+    with open(part, "wb") as f:
+        f.write(header)
+        for blob in sections:
+            f.write(blob)
+    os.replace(part, path_index)
+    return path_index
+
+
+def export_flow_index(flows: FlowMatrix, path_index) -> Path:
+    """Write a FlowMatrix as its CSR arrays, for cbserver to memory-map and
+    read one origin's row at a time.
+
+    Layout, little-endian, every section 4-byte aligned:
+        header: FLOW_HEADER
+        names: string table of origin/destination names, in code order
+        indptr: u32 [hours * names + 1], row r is indices/counts[indptr[r]:indptr[r + 1]]
+        indices: u32 destination of each nonzero cell
+        counts: u32 trips of each nonzero cell
+    Row hour * names + origin holds the trips from origin in that hour.
+
+    Args:
+        flows (FlowMatrix): Station or NTA flows
+        path_index (Path): Output path
+
+    Returns:
+        Path: Output path
+    """
+    matrix = flows.matrix.tocsr()
+    matrix.sum_duplicates()
+    matrix.sort_indices()
+    sections = [
+        _pad(_string_table(flows.names)),
+        matrix.indptr.astype("<u4").tobytes(),
+        matrix.indices.astype("<u4").tobytes(),
+        matrix.data.astype("<u4").tobytes(),
+    ]
+    offsets = np.cumsum([FLOW_HEADER.size] + [len(b) for b in sections[:-1]])
+    header = FLOW_HEADER.pack(
+        FLOW_MAGIC,
+        FLOW_VERSION,
+        flows.hours,
+        len(flows.names),
+        matrix.nnz,
+        *offsets.tolist(),
+    )
+
+    path_index = Path(path_index)
+    part = path_index.with_suffix(".part")
+    logging.info(f"Saving {matrix.nnz} flows to {path_index}")
+    with open(part, "wb") as f:
+        f.write(header)
+        for blob in sections:
+            f.write(blob)
+    os.replace(part, path_index)
+    return path_index
+
+
+def read_flow_index(path_index) -> FlowMatrix:
+    """Load flows written by export_flow_index"""
+    blob = Path(path_index).read_bytes()
+    magic, version, hours, n, nnz, *offsets = FLOW_HEADER.unpack_from(blob)
+    if magic != FLOW_MAGIC or version != FLOW_VERSION:
+        raise Exception(f"{path_index} is not a version {FLOW_VERSION} flow index")
+    names_offset, indptr_offset, indices_offset, data_offset = offsets
+    ends = np.frombuffer(blob, "<u4", n + 1, names_offset)
+    start = names_offset + 4 * (n + 1)
+    names = [blob[start + ends[i] : start + ends[i + 1]].decode() for i in range(n)]
+    matrix = sparse.csr_matrix(
+        (
+            np.frombuffer(blob, "<u4", nnz, data_offset).astype(np.int32),
+            np.frombuffer(blob, "<u4", nnz, indices_offset).astype(np.int32),
+            np.frombuffer(blob, "<u4", hours * n + 1, indptr_offset).astype(np.int32),
+        ),
+        shape=(hours * n, n),
+    )
+    return FlowMatrix(pd.Index(names), matrix, hours)
+
+
+def _from_typed_array(value: dict) -> np.ndarray:
+    return np.frombuffer(value["data"], value["dtype"]).reshape(value["shape"])
+
+
+def export_sketches(sketches: StationSketches, path_report) -> Path:
+    """Save per-month station sketches as MsgPack, so distinct bikes and
+    duration quantiles of any range of months can be answered later without
+    the rides; see read_sketches.
+
+    Args:
+        sketches (StationSketches): From Main.summarize or summarize_chunks
+        path_report (Path): Output path
+
+    Returns:
+        Path: Output path
+    """
+    months = {}
+    precision = None
+    for period, (bikes, durations) in sketches.months.items():
+        buckets = durations.buckets.tocsr()
+        if bikes is not None:
+            precision = bikes.precision
+        months[str(period)] = {
+            # nil for eras of tripdata without bike ids
+            "bikes": _typed_array(bikes.registers) if bikes is not None else None,
+            "durations": {
+                "shape": list(buckets.shape),
+                "indptr": _typed_array(buckets.indptr.astype("<i4")),
+                "indices": _typed_array(buckets.indices.astype("<i4")),
+                "data": _typed_array(buckets.data.astype("<i4")),
+            },
+        }
+    first = next(iter(sketches.months.values()), None)
+    report = {
+        "version": SKETCHES_VERSION,
+        "stations": [str(name) for name in sketches.names],
+        "precision": precision,
+        "accuracy": first[1].accuracy if first else None,
+        "months": months,
+    }
+    path_report = Path(path_report)
+    part = Path(f"{path_report}.part")
+    logging.info(f"Saving sketches of {len(months)} months to {path_report}")
+    with open(part, "wb") as f:
+        msgpack.pack(report, f)
+    os.replace(part, path_report)
+    return path_report
+
+
+def read_sketches(path_report) -> StationSketches:
+    """Load sketches saved by export_sketches"""
+    with open(path_report, "rb") as f:
+        report = msgpack.unpack(f)
+    if report["version"] != SKETCHES_VERSION:
+        raise Exception(
+            f"{path_report} is not a version {SKETCHES_VERSION} sketch file"
+        )
+    months = {}
+    for period, saved in report["months"].items():
+        durations = saved["durations"]
+        buckets = sparse.csr_matrix(
+            (
+                _from_typed_array(durations["data"]),
+                _from_typed_array(durations["indices"]),
+                _from_typed_array(durations["indptr"]),
+            ),
+            shape=tuple(durations["shape"]),
+        )
+        bikes = saved["bikes"]
+        months[pd.Period(period, freq="M")] = (
+            HyperLogLog(_from_typed_array(bikes), report["precision"])
+            if bikes is not None
+            else None,
+            DurationSketch(buckets, report["accuracy"]),
+        )
+    return StationSketches(pd.Index(report["stations"]), months)
+
+
+# if __name__ == "__main__":
+#     # load_pickle()
@@ -0,0 +1,327 @@
+import logging
+import zipfile
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+# Rough size of one CSV row, used to turn a row chunksize into a pyarrow block size
+BYTES_PER_ROW = 256
+# Older files write missing birth years as \N
+NA_VALUES = ["", "NULL", "NaN", "\\N"]
+
+# One layout for every era, named like the 2021 files so later stages don't care.
+# Columns an era lacks are missing (NaN/<NA>) rather than a made-up value:
+# since Feb 2021 bike_id, birth_year and gender are all missing, and gender
+# is "unknown" only where a file itself says 0.
+CANONICAL_DTYPES = {
+    "ride_id": "string",
+    "rideable_type": "category",
+    "started_at": "datetime64[ns]",
+    "ended_at": "datetime64[ns]",
+    "start_station_name": "category",
+    "start_station_id": "category",
+    "end_station_name": "category",
+    "end_station_id": "category",
+    "start_lat": "float32",
+    "start_lng": "float32",
+    "end_lat": "float32",
+    "end_lng": "float32",
+    "member_casual": "category",
+    "bike_id": "Int32",
+    "birth_year": "float32",
+    "gender": "category",
+}
+# Part of the cache key of prepared rides; bump when the canonical layout
+# changes, to prepare every cached month again
+LAYOUT_VERSION = 2
+GENDERS = {0: "unknown", 1: "male", 2: "female"}
+USER_TYPES = {"Subscriber": "member", "Customer": "casual"}
+
+
+def header_key(column: str) -> str:
+    """Compare headers loosely: "Start Station ID" and "start station id" are the same"""
+    return column.lower().replace(" ", "").replace("_", "")
+
+
+class TripSchema:
+    """Declared columns, compact dtypes and datetime formats for one era of tripdata CSVs"""
+
+    def __init__(
+        self,
+        name,
+        dtypes,
+        dates,
+        date_formats,
+        renames=None,
+        values=None,
+        defaults=None,
+    ):
+        """
+        Args:
+            name (str): Label for logging
+            dtypes (dict): Column name to pandas dtype, for every non-date column
+            dates (list): Datetime columns
+            date_formats (list): strptime formats to try, in order
+            renames (dict, optional): Column name to canonical name. Defaults to None.
+            values (dict, optional): Canonical column to a mapping of its values. Defaults to None.
+            defaults (dict, optional): Values for canonical columns the era lacks. Defaults to None.
+        """
+        self.name = name
+        self.dtypes = dtypes
+        self.dates = dates
+        self.date_formats = date_formats
+        self.renames = renames or {}
+        self.values = values or {}
+        self.defaults = defaults or {}
+
+    @property
+    def columns(self) -> list:
+        return list(self.dtypes) + self.dates
+
+    def bind(self, header) -> dict:
+        """Map a file's actual header names to the declared names,
+        or return None if the header is from another era"""
+        actual = {header_key(column): column for column in header}
+        keys = [header_key(column) for column in self.columns]
+        if not all(key in actual for key in keys):
+            return None
+        return {actual[key]: column for key, column in zip(keys, self.columns)}
+
+    def arrow_types(self) -> dict:
+        """The same dtypes as pyarrow types, for the pyarrow CSV reader"""
+        to_arrow = {
+            "category": pa.dictionary(pa.int32(), pa.string()),
+            "string": pa.string(),
+            "float32": pa.float32(),
+            "float64": pa.float64(),
+            "int8": pa.int8(),
+            "int32": pa.int32(),
+        }
+        types = {column: to_arrow[dtype] for column, dtype in self.dtypes.items()}
+        types.update({column: pa.timestamp("ns") for column in self.dates})
+        return types
+
+
+# Feb 2021 onwards
+SCHEMA_2021 = TripSchema(
+    name="2021",
+    dtypes={
+        "ride_id": "string",
+        "rideable_type": "category",
+        "start_station_name": "category",
+        "start_station_id": "category",
+        "end_station_name": "category",
+        "end_station_id": "category",
+        "start_lat": "float32",
+        "start_lng": "float32",
+        "end_lat": "float32",
+        "end_lng": "float32",
+        "member_casual": "category",
+    },
+    dates=["started_at", "ended_at"],
+    date_formats=["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f"],
+)
+
+# 2013 to Jan 2021; some years capitalize headers, e.g. "Start Time"
+SCHEMA_2013 = TripSchema(
+    name="2013",
+    dtypes={
+        "tripduration": "int32",
+        "start station id": "category",
+        "start station name": "category",
+        "start station latitude": "float32",
+        "start station longitude": "float32",
+        "end station id": "category",
+        "end station name": "category",
+        "end station latitude": "float32",
+        "end station longitude": "float32",
+        "bikeid": "int32",
+        "usertype": "category",
+        "birth year": "float32",
+        "gender": "int8",
+    },
+    dates=["starttime", "stoptime"],
+    date_formats=[
+        "%Y-%m-%d %H:%M:%S",
+        "%Y-%m-%d %H:%M:%S.%f",
+        "%m/%d/%Y %H:%M:%S",
+        "%m/%d/%Y %H:%M",
+    ],
+    renames={
+        "starttime": "started_at",
+        "stoptime": "ended_at",
+        "start station id": "start_station_id",
+        "start station name": "start_station_name",
+        "start station latitude": "start_lat",
+        "start station longitude": "start_lng",
+        "end station id": "end_station_id",
+        "end station name": "end_station_name",
+        "end station latitude": "end_lat",
+        "end station longitude": "end_lng",
+        "bikeid": "bike_id",
+        "usertype": "member_casual",
+        "birth year": "birth_year",
+    },
+    values={"member_casual": USER_TYPES},
+    defaults={"rideable_type": "classic_bike"},
+)
+
+SCHEMAS = [SCHEMA_2021, SCHEMA_2013]
+
+
+def open_trips(path):
+    """Open a CSV on disk, or a CSV member of a ZIP file given as a
+    zipfile.Path, which is decompressed as it is read"""
+    if isinstance(path, zipfile.Path):
+        return path.open("rb")
+    return open(path, "rb")
+
+
+def read_header(path) -> list:
+    with open_trips(path) as f:
+        return list(pd.read_csv(f, nrows=0).columns)
+
+
+def detect_schema(header) -> TripSchema:
+    """Pick the era of a tripdata file from its header.
+
+    Args:
+        header (list): Column names, e.g. from read_header
+
+    Returns:
+        TripSchema: SCHEMA_2021 or SCHEMA_2013
+    """
+    for schema in SCHEMAS:
+        if schema.bind(header) is not None:
+            return schema
+    raise Exception(f"Unrecognized tripdata columns: {header}")
+
+
+def parse_times(values: pd.Series, formats: list) -> pd.Series:
+    """Parse each datetime with the first declared format that fits it, so a
+    file may mix e.g. whole and fractional seconds. Missing values stay NaT.
+
+    Raises:
+        Exception: A value fits none of the formats
+    """
+    parsed = pd.to_datetime(values, format=formats[0], errors="coerce")
+    for date_format in formats[1:]:
+        todo = parsed.isna() & values.notna()
+        if not todo.any():
+            break
+        parsed[todo] = pd.to_datetime(values[todo], format=date_format, errors="coerce")
+    unparsed = values[parsed.isna() & values.notna()]
+    if len(unparsed):
+        raise Exception(
+            f"{len(unparsed)} values of {values.name} fit no declared format, "
+            f"e.g. {unparsed.iloc[0]!r}"
+        )
+    return parsed
+
+
+def read_trip_csv(path, schema=None, chunksize=None, engine="pandas"):
+    """Read a tripdata CSV with declared dtypes, optionally in chunks.
+    Columns keep the declared names of the file's era; see normalize_trips.
+
+    Args:
+        path ([type]): CSV to read, or a zipfile.Path to read it straight out of a ZIP file
+        schema (TripSchema, optional): Era of the file. Defaults to detecting it from the header.
+        chunksize (int, optional): Rows per chunk; None reads the file in one piece. Defaults to None.
+        engine (str, optional): `pandas`, or `pyarrow` for the multithreaded Arrow parser. Defaults to "pandas".
+
+    Yields:
+        pd.DataFrame: Rides with compact dtypes
+    """
+    header = read_header(path)
+    if schema is None:
+        schema = detect_schema(header)
+        logging.info(f"Detected {schema.name} schema: {path}")
+    names = schema.bind(header)
+    if names is None:
+        raise Exception(f"{path} does not match the {schema.name} schema")
+    to_actual = {column: actual for actual, column in names.items()}
+
+    if engine == "pyarrow":
+        chunks = _read_trip_csv_arrow(path, schema, chunksize, to_actual)
+    else:
+        chunks = _read_trip_csv_pandas(path, schema, chunksize, to_actual)
+    for chunk in chunks:
+        yield chunk.rename(columns=names)
+
+
+def _read_trip_csv_pandas(path, schema, chunksize, to_actual):
+    dtypes = {to_actual[column]: dtype for column, dtype in schema.dtypes.items()}
+    dtypes.update({to_actual[column]: str for column in schema.dates})
+    with open_trips(path) as f:
+        # Parse dates ourselves with explicit formats instead of read_csv's inference
+        chunks = pd.read_csv(f, dtype=dtypes, na_values=NA_VALUES, chunksize=chunksize)
+        if chunksize is None:
+            chunks = [chunks]
+        for chunk in chunks:
+            for column in schema.dates:
+                actual = to_actual[column]
+                chunk[actual] = parse_times(chunk[actual], schema.date_formats)
+            yield chunk
+
+
+def _read_trip_csv_arrow(path, schema, chunksize, to_actual):
+    convert_options = pacsv.ConvertOptions(
+        column_types={
+            to_actual[column]: dtype for column, dtype in schema.arrow_types().items()
+        },
+        timestamp_parsers=schema.date_formats + [pacsv.ISO8601],
+        null_values=NA_VALUES,
+        strings_can_be_null=True,
+    )
+    with open_trips(path) as f:
+        if chunksize is None:
+            table = pacsv.read_csv(f, convert_options=convert_options)
+            yield table.to_pandas()
+            return
+
+        read_options = pacsv.ReadOptions(block_size=chunksize * BYTES_PER_ROW)
+        with pacsv.open_csv(
+            f, read_options=read_options, convert_options=convert_options
+        ) as reader:
+            for batch in reader:
+                yield batch.to_pandas()
+
+
+def normalize_trips(df: pd.DataFrame, schema: TripSchema) -> pd.DataFrame:
+    """Convert rides from any era into the canonical layout, CANONICAL_DTYPES.
+
+    Args:
+        df (pd.DataFrame): Rides from read_trip_csv
+        schema (TripSchema): Era the rides were read with
+
+    Returns:
+        pd.DataFrame: Rides with exactly the canonical columns
+    """
+    df = df.rename(columns=schema.renames)
+    for column, mapping in schema.values.items():
+        df[column] = df[column].map(mapping)
+    for column, value in schema.defaults.items():
+        df[column] = np.full(len(df), value)
+    if "gender" in df.columns:
+        # Only the gender column holds these codes
+        df["gender"] = df["gender"].map(GENDERS)
+    for column, dtype in CANONICAL_DTYPES.items():
+        if column not in df.columns:
+            df[column] = pd.Series(index=df.index, dtype=dtype)
+        elif df[column].dtype != dtype:
+            df[column] = df[column].astype(dtype)
+    return df.loc[:, list(CANONICAL_DTYPES)]
+
+
+def concat_trips(frames) -> pd.DataFrame:
+    """pd.concat that keeps categorical columns categorical when
+    the frames have different categories, e.g. one per month"""
+    frames = list(frames)
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            categories = union_categoricals([f[column] for f in frames]).categories
+            for f in frames:
+                f[column] = f[column].cat.set_categories(categories)
+    return pd.concat(frames)
@@ -0,0 +1,481 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .stations import StationTable
+from .trips import (
+    TRIP_BOUNDS,
+    TRIP_QUANTILES,
+    trip_distances,
+    trip_durations,
+    within_bounds,
+)
+
+# 2 ** 10 registers per station: about 3% standard error, 1 KiB per station and month
+HLL_PRECISION = 10
+# Durations are kept to within 2% of their value
+DURATION_ACCURACY = 0.02
+# Durations below a second share the first bucket
+MIN_DURATION = 1.0
+# Distances below 10 meters, e.g. round trips back to the same dock, share the first bucket
+MIN_DISTANCE = 10.0
+
+
+class HyperLogLog:
+    """HyperLogLog registers for many keys at once, e.g. one sketch per
+    station, filled from arrays with no per-value Python code.
+    Sketches merge by taking the larger register."""
+
+    def __init__(self, registers: np.ndarray, precision=HLL_PRECISION):
+        """
+        Args:
+            registers (np.ndarray): uint8 [keys][2 ** precision]
+            precision (int, optional): Bits of the hash that pick a register. Defaults to HLL_PRECISION.
+        """
+        self.registers = registers
+        self.precision = precision
+
+    @classmethod
+    def from_values(cls, keys, values, n_keys, precision=HLL_PRECISION):
+        """Sketch the distinct values of each key.
+
+        Args:
+            keys (np.ndarray): Key of each value, 0..n_keys-1; negative keys are skipped
+            values (pd.Series): Values to count; missing values are skipped
+            n_keys (int): Number of keys
+            precision (int, optional): See __init__. Defaults to HLL_PRECISION.
+
+        Returns:
+            HyperLogLog: The sketches
+        """
+        m = 1 << precision
+        keep = (np.asarray(keys) >= 0) & pd.notna(values).to_numpy()
+        hashes = pd.util.hash_array(pd.Series(values)[keep].astype(str).to_numpy())
+        register = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - precision)) - 1)
+        # Position of the first 1 bit in the remaining 64 - precision bits
+        rank = (64 - precision - _bit_length(rest) + 1).astype(np.uint8)
+
+        registers = np.zeros(n_keys * m, dtype=np.uint8)
+        np.maximum.at(registers, np.asarray(keys)[keep] * m + register, rank)
+        return cls(registers.reshape(n_keys, m), precision)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        return HyperLogLog(np.maximum(self.registers, other.registers), self.precision)
+
+    def reindex(self, positions: np.ndarray, n_keys) -> "HyperLogLog":
+        """Move each key's registers to positions[key]; keys at -1 are dropped"""
+        registers = np.zeros((n_keys, self.registers.shape[1]), dtype=np.uint8)
+        kept = positions >= 0
+        registers[positions[kept]] = self.registers[kept]
+        return HyperLogLog(registers, self.precision)
+
+    def estimate(self) -> np.ndarray:
+        """Approximate distinct count of each key"""
+        m = self.registers.shape[1]
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.exp2(-self.registers.astype(np.float64)).sum(axis=1)
+        # Linear counting is more accurate while many registers are still empty
+        zeros = (self.registers == 0).sum(axis=1)
+        linear = m * np.log(m / np.maximum(zeros, 1))
+        return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+class DurationSketch:
+    """DDSketch-style quantile sketches for many keys at once, e.g. one per
+    station and hour. Each value is counted in a logarithmic bucket, so any
+    quantile at or above MINIMUM is returned within DURATION_ACCURACY of the
+    true value. The buckets of all keys form one sparse matrix, and sketches
+    merge by adding it."""
+
+    # Values below it share the first bucket, in the unit of the values
+    MINIMUM = MIN_DURATION
+
+    def __init__(self, buckets: sparse.csr_matrix, accuracy=DURATION_ACCURACY):
+        """
+        Args:
+            buckets (sparse.csr_matrix): int32 counts [keys][bucket]
+            accuracy (float, optional): Relative accuracy. Defaults to DURATION_ACCURACY.
+        """
+        self.buckets = buckets
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+
+    @classmethod
+    def from_values(cls, keys, values, n_keys, accuracy=DURATION_ACCURACY):
+        """Sketch the values of each key.
+
+        Args:
+            keys (np.ndarray): Key of each value, 0..n_keys-1; negative keys are skipped
+            values (np.ndarray): Values, e.g. seconds; negative and missing values are skipped
+            n_keys (int): Number of keys
+            accuracy (float, optional): Relative accuracy. Defaults to DURATION_ACCURACY.
+
+        Returns:
+            DurationSketch: The sketches, of the class it is called on
+        """
+        gamma = (1 + accuracy) / (1 - accuracy)
+        values = np.asarray(values, dtype=np.float64)
+        keep = (np.asarray(keys) >= 0) & (values >= 0)
+        values = np.maximum(values[keep], cls.MINIMUM)
+        bucket = np.ceil(np.log(values / cls.MINIMUM) / np.log(gamma)).astype(np.int64)
+        return cls.from_counts(np.asarray(keys)[keep], bucket, None, n_keys, accuracy)
+
+    @classmethod
+    def from_counts(cls, keys, buckets, counts, n_keys, accuracy=DURATION_ACCURACY):
+        """Sketch values already counted by bucket, e.g. by a GROUP BY over
+        the same buckets as from_values.
+
+        Args:
+            keys (np.ndarray): Key of each row, 0..n_keys-1
+            buckets (np.ndarray): Bucket of each row
+            counts (np.ndarray): Values in each row's bucket, or None for one per row
+            n_keys (int): Number of keys
+            accuracy (float, optional): Relative accuracy. Defaults to DURATION_ACCURACY.
+
+        Returns:
+            DurationSketch: The sketches
+        """
+        buckets = np.asarray(buckets, dtype=np.int64)
+        if counts is None:
+            counts = np.ones(len(buckets), dtype=np.int32)
+        matrix = sparse.csr_matrix(
+            (np.asarray(counts, dtype=np.int32), (np.asarray(keys), buckets)),
+            shape=(n_keys, int(buckets.max()) + 1 if len(buckets) else 1),
+        )
+        matrix.sum_duplicates()
+        return cls(matrix, accuracy)
+
+    def merge(self, other: "DurationSketch") -> "DurationSketch":
+        width = max(self.buckets.shape[1], other.buckets.shape[1])
+        a, b = (_widen(s.buckets, width) for s in (self, other))
+        return type(self)(a + b, self.accuracy)
+
+    def reindex(self, positions: np.ndarray, n_keys) -> "DurationSketch":
+        """Move each key's buckets to positions[key]; keys at -1 are dropped"""
+        coo = self.buckets.tocoo()
+        rows = positions[coo.row]
+        kept = rows >= 0
+        buckets = sparse.csr_matrix(
+            (coo.data[kept], (rows[kept], coo.col[kept])),
+            shape=(n_keys, self.buckets.shape[1]),
+        )
+        return type(self)(buckets, self.accuracy)
+
+    def quantiles(self, q) -> np.ndarray:
+        """Approximate quantiles of every key.
+
+        Args:
+            q (float or list): Quantiles in [0, 1]
+
+        Returns:
+            np.ndarray: [keys][quantiles], NaN for keys without values
+        """
+        q = np.atleast_1d(q)
+        buckets = self.buckets.tocsr()
+        if not buckets.nnz:
+            return np.full((buckets.shape[0], len(q)), np.nan)
+        if not buckets.has_sorted_indices:
+            buckets = buckets.sorted_indices()
+        # Running count over the stored buckets of all keys, row after row,
+        # so the matrix is never made dense
+        cumulative = np.cumsum(buckets.data, dtype=np.int64)
+        before = np.concatenate([[0], cumulative])[buckets.indptr]
+        totals = np.diff(before)[:, None]
+        # Rank of each quantile, then the first bucket that passes it
+        ranks = q[None, :] * np.maximum(totals - 1, 0)
+        first = np.searchsorted(cumulative, before[:-1, None] + ranks, side="right")
+        # Keys without values point past their row; they are NaN below
+        bucket = buckets.indices[np.minimum(first, buckets.nnz - 1)]
+        # The middle of the bucket, within accuracy of anything in it
+        values = self.MINIMUM * 2 * self.gamma**bucket / (self.gamma + 1)
+        return np.where(totals > 0, values, np.nan)
+
+
+class DistanceSketch(DurationSketch):
+    """DurationSketch of distances in meters"""
+
+    MINIMUM = MIN_DISTANCE
+
+
+class StationSketches:
+    """Distinct bikes per start station, and trip duration quantiles per
+    start station and hour, kept per month. Sketches of any range of months
+    merge into answers without reading the rides again.
+
+    Ride counts are exact in the CountCube, so only bikes are sketched, and
+    only in eras of tripdata that have bike ids; other months keep None."""
+
+    def __init__(self, names, months=None):
+        """
+        Args:
+            names (pd.Index): Short name of each station code
+            months (dict, optional): pd.Period to (bikes, durations). Defaults to {}.
+        """
+        self.names = pd.Index(names)
+        self.months = months or {}
+
+    @classmethod
+    def from_rides(cls, df: pd.DataFrame, stations: StationTable):
+        """Sketch rides, one set of sketches per month the rides started in.
+
+        Args:
+            df (pd.DataFrame): Prepared rides with station codes from Main.join_short_names
+            stations (StationTable): Station codes to short names
+
+        Returns:
+            StationSketches: The sketches
+        """
+        n = len(stations)
+        codes = df["start_station_code"].to_numpy().astype(np.int64)
+        seconds = trip_durations(df)
+        month = df["start_time"].to_numpy("datetime64[ns]").astype("datetime64[M]")
+        hours = df["start_hour"].to_numpy().astype(np.int64)
+
+        # Eras of tripdata without bike ids leave the column empty, if at all
+        has_bikes = "bike_id" in df.columns and df["bike_id"].notna().any()
+        sketches = cls(stations.short_names)
+        for period in np.unique(month[~np.isnat(month)]):
+            keys = np.where(month == period, codes, -1)
+            sketches.months[pd.Period(period, freq="M")] = (
+                HyperLogLog.from_values(keys, df["bike_id"], n) if has_bikes else None,
+                DurationSketch.from_values(
+                    np.where(keys >= 0, keys * 24 + hours, -1), seconds, n * 24
+                ),
+            )
+        return sketches
+
+    def merge(self, other: "StationSketches") -> "StationSketches":
+        """Combine sketches of different rides, e.g. of chunks or months"""
+        if not self.names.equals(other.names):
+            raise Exception("Can only merge sketches of the same stations")
+        months = dict(self.months)
+        for period, sketches in other.months.items():
+            if period in months:
+                sketches = _merge(months[period], sketches)
+            months[period] = sketches
+        return StationSketches(self.names, months)
+
+    def reindex(self, stations: StationTable) -> "StationSketches":
+        """The same sketches numbered by another StationTable, e.g. a newer
+        feed's; stations it lacks are dropped and new stations are empty"""
+        if self.names.equals(stations.short_names):
+            return self
+        positions = stations.short_names.get_indexer(self.names)
+        hourly = _hourly_positions(positions)
+        n = len(stations)
+        return StationSketches(
+            stations.short_names,
+            {
+                period: (
+                    bikes.reindex(positions, n) if bikes is not None else None,
+                    durations.reindex(hourly, n * 24),
+                )
+                for period, (bikes, durations) in self.months.items()
+            },
+        )
+
+    def window(self, months=None) -> tuple:
+        """Merged (bikes, durations) sketches of a range of months; bikes
+        is None if any of the months has no bike ids.
+
+        Args:
+            months (list, optional): Months, e.g. ["2022-06", "2022-07"]. Defaults to every month.
+        """
+        periods = sorted(self.months)
+        if months is not None:
+            wanted = set(pd.PeriodIndex(months, freq="M"))
+            periods = [period for period in periods if period in wanted]
+        if not periods:
+            raise Exception("No sketches for those months")
+        merged = self.months[periods[0]]
+        for period in periods[1:]:
+            merged = _merge(merged, self.months[period])
+        return merged
+
+    def distinct(self, months=None) -> pd.DataFrame:
+        """Approximate distinct bikes of each station.
+
+        Returns:
+            pd.DataFrame: distinct_bikes by short_name, NaN if a month has no bike ids
+        """
+        bikes, _ = self.window(months)
+        estimate = bikes.estimate() if bikes is not None else np.nan
+        return pd.DataFrame(
+            {"distinct_bikes": estimate},
+            index=pd.Index(self.names, name="short_name"),
+        )
+
+    def duration_quantiles(self, q=(0.5, 0.9), months=None) -> pd.DataFrame:
+        """Approximate trip duration quantiles in seconds, by station and hour.
+
+        Returns:
+            pd.DataFrame: short_name, start_hour, and a column per quantile, e.g. p50
+                for stations and hours with rides
+        """
+        _, durations = self.window(months)
+        values = durations.quantiles(q)
+        df = pd.DataFrame(
+            {
+                "short_name": np.repeat(np.asarray(self.names, dtype=object), 24),
+                "start_hour": np.tile(np.arange(24), len(self.names)),
+            }
+        )
+        for i, quantile in enumerate(np.atleast_1d(q)):
+            df[f"p{round(quantile * 100)}"] = values[:, i]
+        return df[~np.isnan(values[:, 0])].reset_index(drop=True)
+
+
+class TripStats:
+    """Trip duration and distance statistics by start station and hour, kept
+    as a count, a sum and a quantile sketch per measure, so they merge across
+    chunks and months like the other summaries. Means are exact, and
+    quantiles are within DURATION_ACCURACY of the true value (durations under
+    MIN_DURATION and distances under MIN_DISTANCE share the first bucket)."""
+
+    MEASURES = ("duration", "distance")
+    # The sketch of each measure, by the unit of its values
+    SKETCHES = {"duration": DurationSketch, "distance": DistanceSketch}
+
+    def __init__(self, names, trips: np.ndarray, sums: dict, sketches: dict):
+        """
+        Args:
+            names (pd.Index): Short name of each station code
+            trips (np.ndarray): int64 rides within bounds [stations * 24]
+            sums (dict): Measure name to float64 totals [stations * 24]
+            sketches (dict): Measure name to its SKETCHES sketch of stations * 24 keys
+        """
+        self.names = pd.Index(names)
+        self.trips = trips
+        self.sums = sums
+        self.sketches = sketches
+
+    @classmethod
+    def from_rides(cls, df: pd.DataFrame, stations: StationTable, bounds=TRIP_BOUNDS):
+        """Sum and sketch the durations and distances of rides within bounds.
+
+        Args:
+            df (pd.DataFrame): Prepared rides with station codes from Main.join_short_names
+            stations (StationTable): Station codes to short names
+            bounds (dict, optional): See within_bounds. Defaults to TRIP_BOUNDS.
+
+        Returns:
+            TripStats: The statistics
+        """
+        measures = {"duration": trip_durations(df), "distance": trip_distances(df)}
+        codes = df["start_station_code"].to_numpy().astype(np.int64)
+        hours = df["start_hour"].to_numpy().astype(np.int64)
+        keep = within_bounds(measures, bounds) & (codes >= 0)
+
+        n_keys = len(stations) * 24
+        keys = codes[keep] * 24 + hours[keep]
+        return cls(
+            stations.short_names,
+            np.bincount(keys, minlength=n_keys),
+            {
+                name: np.bincount(keys, weights=values[keep], minlength=n_keys)
+                for name, values in measures.items()
+            },
+            {
+                name: cls.SKETCHES[name].from_values(keys, values[keep], n_keys)
+                for name, values in measures.items()
+            },
+        )
+
+    def merge(self, other: "TripStats") -> "TripStats":
+        """Combine the statistics of different rides, e.g. of chunks or months"""
+        if not self.names.equals(other.names):
+            raise Exception("Can only merge trip statistics of the same stations")
+        return TripStats(
+            self.names,
+            self.trips + other.trips,
+            {name: self.sums[name] + other.sums[name] for name in self.MEASURES},
+            {
+                name: self.sketches[name].merge(other.sketches[name])
+                for name in self.MEASURES
+            },
+        )
+
+    def reindex(self, stations: StationTable) -> "TripStats":
+        """The same statistics numbered by another StationTable, e.g. a newer
+        feed's; stations it lacks are dropped and new stations are empty"""
+        if self.names.equals(stations.short_names):
+            return self
+        positions = _hourly_positions(stations.short_names.get_indexer(self.names))
+        kept = positions >= 0
+        n_keys = len(stations) * 24
+
+        def move(values):
+            moved = np.zeros(n_keys, dtype=values.dtype)
+            moved[positions[kept]] = values[kept]
+            return moved
+
+        return TripStats(
+            stations.short_names,
+            move(self.trips),
+            {name: move(sums) for name, sums in self.sums.items()},
+            {
+                name: sketch.reindex(positions, n_keys)
+                for name, sketch in self.sketches.items()
+            },
+        )
+
+    def to_frame(self, q=TRIP_QUANTILES) -> pd.DataFrame:
+        """The statistics as a table.
+
+        Args:
+            q (tuple, optional): Quantiles to report. Defaults to TRIP_QUANTILES.
+
+        Returns:
+            pd.DataFrame: short_name, start_hour, trips, and e.g. mean_duration,
+                p50_duration, p90_duration, mean_distance, ... for stations and
+                hours with rides within bounds
+        """
+        present = np.flatnonzero(self.trips)
+        df_stats = pd.DataFrame(
+            {
+                "short_name": np.asarray(self.names, dtype=object)[present // 24],
+                "start_hour": present % 24,
+                "trips": self.trips[present],
+            }
+        )
+        for name in self.MEASURES:
+            df_stats[f"mean_{name}"] = (
+                self.sums[name][present] / self.trips[present]
+            ).astype(np.float32)
+            quantiles = self.sketches[name].quantiles(q)
+            for i, quantile in enumerate(q):
+                df_stats[f"p{round(quantile * 100)}_{name}"] = quantiles[
+                    present, i
+                ].astype(np.float32)
+        # Stations by name, like CountCube.by_hour
+        return df_stats.sort_values(["short_name", "start_hour"], ignore_index=True)
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """int.bit_length of each uint64, by binary search over shifts"""
+    values = values.copy()
+    length = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = values >= np.uint64(1 << shift)
+        length[big] += shift
+        values[big] >>= np.uint64(shift)
+    return length + (values > 0)
+
+
+def _hourly_positions(positions: np.ndarray) -> np.ndarray:
+    """Station positions to positions of the station * 24 + hour keys, -1 kept"""
+    hourly = positions[:, None] * 24 + np.arange(24)
+    return np.where(positions[:, None] >= 0, hourly, -1).ravel()
+
+
+def _merge(a: tuple, b: tuple) -> tuple:
+    """Merge two months' (bikes, durations); bikes known in only one stay unknown"""
+    bikes = a[0].merge(b[0]) if a[0] is not None and b[0] is not None else None
+    return bikes, a[1].merge(b[1])
+
+
+def _widen(matrix: sparse.csr_matrix, width) -> sparse.csr_matrix:
+    matrix = matrix.copy()
+    matrix.resize(matrix.shape[0], width)
+    return matrix
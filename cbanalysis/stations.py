@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+
+class StationTable:
+    """Station dimension table, one row per short_name, numbered 0..n-1.
+    Rides are encoded to these integer codes once; short names and NTA's are
+    then looked up by indexing arrays with the codes instead of merging frames."""
+
+    def __init__(self, df_station_geo: pd.DataFrame):
+        """
+        Args:
+            df_station_geo (pd.DataFrame): Stations with NTA's joined, from Prepper.sjoin_ntas_stations
+        """
+        stations = df_station_geo[df_station_geo["short_name"].notna()]
+        stations = stations.drop_duplicates("short_name")
+        self.short_names = pd.Index(stations["short_name"].astype(str))
+        self.ntacodes = stations["ntacode"].to_numpy(dtype=object)
+
+        # Rides name stations by short_name, or by legacy id before 2021.
+        # A legacy id wins over a short_name that happens to look the same.
+        lookup = dict(zip(self.short_names, range(len(self.short_names))))
+        if "legacy_id" in df_station_geo.columns:
+            legacy = dict(
+                zip(
+                    df_station_geo["legacy_id"].astype(str),
+                    df_station_geo["short_name"].astype(str),
+                )
+            )
+            for legacy_id, short_name in legacy.items():
+                lookup[legacy_id] = lookup.get(short_name, -1)
+        self.keys = pd.Index(list(lookup))
+        self.codes = np.fromiter(lookup.values(), dtype=np.int32, count=len(lookup))
+
+    def __len__(self) -> int:
+        return len(self.short_names)
+
+    def encode(self, ids: pd.Series) -> np.ndarray:
+        """Convert station ids from rides into station codes.
+
+        Args:
+            ids (pd.Series): start_station_id or stop_station_id of rides
+
+        Returns:
+            np.ndarray: int32 codes, -1 for stations not in the table
+        """
+        if isinstance(ids.dtype, pd.CategoricalDtype):
+            # Look up each category once, then take by the category codes
+            per_category = self._lookup(ids.cat.categories.astype(str))
+            ride_codes = ids.cat.codes.to_numpy()
+            if len(per_category) == 0:
+                return np.full(len(ids), -1, dtype=np.int32)
+            return np.where(ride_codes >= 0, per_category[ride_codes], -1).astype(
+                np.int32
+            )
+        return self._lookup(ids.astype(str))
+
+    def _lookup(self, keys) -> np.ndarray:
+        positions = self.keys.get_indexer(keys)
+        if len(self.codes) == 0:
+            return np.full(len(positions), -1, dtype=np.int32)
+        return np.where(positions >= 0, self.codes[positions], -1).astype(np.int32)
+
+    def ride_ids(self) -> dict:
+        """Every station id rides may name (short names and legacy ids) to
+        the short name it is counted under"""
+        known = self.codes >= 0
+        names = np.asarray(self.short_names, dtype=object)[self.codes[known]]
+        return dict(zip(self.keys[known], names))
+
+    def agrees_with(self, ride_ids: dict) -> bool:
+        """True if rides counted with another table's ride_ids land on the
+        same stations here, so their summaries can be reindexed onto this
+        table instead of recounted. Stations only one of the tables has
+        don't count against it: they are new, or gone from the feed."""
+        current = self.ride_ids()
+        return all(current.get(key, name) == name for key, name in ride_ids.items())
+
+    def short_name(self, codes: np.ndarray) -> pd.Categorical:
+        """Short names for station codes, NaN for -1"""
+        return pd.Categorical.from_codes(codes, categories=self.short_names)
+
+    def ntacode(self, codes: np.ndarray) -> np.ndarray:
+        """NTA codes for station codes, NaN for -1"""
+        if len(self.ntacodes) == 0:
+            return np.full(len(codes), np.nan, dtype=object)
+        return np.where(codes >= 0, self.ntacodes[codes], np.nan)
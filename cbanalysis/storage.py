@@ -0,0 +1,223 @@
+from datetime import date
+from pathlib import Path
+import json
+import logging
+import pickle
+import shutil
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .utils import touchdir
+
+# Columns with few distinct values, stored as dictionaries
+CATEGORY_COLUMNS = [
+    "rideable_type",
+    "member_casual",
+    "start_station_id",
+    "start_station_name",
+    "stop_station_id",
+    "stop_station_name",
+    "end_station_id",
+    "end_station_name",
+    "start_short_name",
+    "stop_short_name",
+]
+
+
+def compact_rides(df: pd.DataFrame) -> pd.DataFrame:
+    """Cast prepared rides to compact, Parquet-friendly types: categorical
+    station ids and names, timestamps, and int8 hour/day/weekday.
+
+    Args:
+        df (pd.DataFrame): Rides from Prepper.load_rename_rides
+
+    Returns:
+        pd.DataFrame: The same frame with its columns recast
+    """
+    for orient in ["start", "stop"]:
+        if f"{orient}_time" not in df.columns:
+            continue
+        times = pd.to_datetime(df[f"{orient}_time"])
+        df[f"{orient}_time"] = times
+        for part, attr in [("hour", "hour"), ("day", "day"), ("weekday", "dayofweek")]:
+            column = f"{orient}_{part}"
+            # load_rename_rides already adds these as int8
+            if column not in df.columns or df[column].dtype != "int8":
+                df[column] = getattr(times.dt, attr).astype("int8")
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            values = df[column]
+            # Mixed ids (e.g. 5329.03 and "JC013") become strings; NaN stays missing
+            df[column] = values.where(values.isna(), values.astype(str)).astype(
+                "category"
+            )
+    return df
+
+
+class RideStore:
+    """Prepared rides cached as Parquet, partitioned by the month they were
+    downloaded for: rides/year=2022/month=1/part-00000.parquet"""
+
+    COMPLETE = "_complete"
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        touchdir(self.path)
+
+    def path_for(self, month: date) -> Path:
+        return self.path / f"year={month.year}" / f"month={month.month}"
+
+    def has(self, month: date, key=None) -> bool:
+        """True once every chunk of a month has been written.
+
+        Args:
+            month (date): Month to check
+            key (str, optional): If given, the month must also have been written with this key. Defaults to None.
+        """
+        marker = self.path_for(month) / self.COMPLETE
+        if not marker.exists():
+            return False
+        return key is None or marker.read_text() == key
+
+    def write_month(self, month: date, chunks, key=None) -> Path:
+        """Replace one month's partition with the given chunks of rides.
+
+        Args:
+            month (date): Month the rides were downloaded for
+            chunks (iterable): Prepared ride DataFrames; each becomes one file
+            key (str, optional): Cache key of the inputs, see Main.fetch_month. Defaults to None.
+
+        Returns:
+            Path: Partition directory
+        """
+        output = self.path_for(month)
+        if output.exists():
+            shutil.rmtree(output)
+        output.mkdir(parents=True)
+        logging.info(f"Caching prepared rides to {output}")
+        for i, chunk in enumerate(chunks):
+            compact_rides(chunk).to_parquet(
+                output / f"part-{i:05d}.parquet", index=False
+            )
+        # Only mark the month as done after every chunk is on disk
+        (output / self.COMPLETE).write_text(key or "")
+        return output
+
+    def files(self, months=None) -> list:
+        if months is None:
+            months = self.months()
+        return [f for m in months for f in sorted(self.path_for(m).glob("*.parquet"))]
+
+    def read(self, months=None, columns=None) -> pd.DataFrame:
+        """Read cached rides into one DataFrame.
+
+        Args:
+            months (list, optional): Months to read. Defaults to every cached month.
+            columns (list, optional): Columns to read. Defaults to all columns.
+
+        Returns:
+            pd.DataFrame: Rides
+        """
+        dataset = ds.dataset(self.files(months), format="parquet")
+        return dataset.to_table(columns=columns).to_pandas()
+
+    def iter_batches(self, months=None, columns=None, batch_size=500_000):
+        """Stream cached rides in bounded batches.
+
+        Yields:
+            pd.DataFrame: At most batch_size rides
+        """
+        for f in self.files(months):
+            for batch in pq.ParquetFile(f).iter_batches(
+                batch_size=batch_size, columns=columns
+            ):
+                yield batch.to_pandas()
+
+    def months(self) -> list:
+        """List the months that are fully cached"""
+        return sorted(
+            date(int(p.parent.parent.name[5:]), int(p.parent.name[6:]), 1)
+            for p in self.path.glob(f"year=*/month=*/{self.COMPLETE}")
+        )
+
+
+class PartialStore:
+    """Per-month partial summaries on disk, keyed by month.
+    These are the month's mergeable summaries, e.g. its CountCube (see
+    Main.summarize_rides), pickled like StageCache entries; they add up across
+    months, and hourly profiles and NTA rankings are rolled up from the cube.
+
+    Each month is saved with a key of the settings it was counted with (see
+    Main.partials_key), and a month counted with other settings doesn't count
+    as stored. Next to it are the ride station ids it was counted with (see
+    StationTable.ride_ids), so a newer station feed can reuse the month when
+    its stations agree."""
+
+    # Part of the key; bump when the saved summaries change, to recount every month
+    VERSION = 7
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        touchdir(self.path)
+
+    def path_for(self, month: date) -> Path:
+        return self.path / f"{month.year}{month.month:0>2}.pickle"
+
+    def key_path(self, month: date) -> Path:
+        return self.path_for(month).with_suffix(".key")
+
+    def ids_path(self, month: date) -> Path:
+        return self.path_for(month).with_suffix(".ids")
+
+    def has(self, month: date, key=None) -> bool:
+        """True if the month's summaries are stored.
+
+        Args:
+            month (date): Month to check
+            key (str, optional): If given, the summaries must also have been saved with this key. Defaults to None.
+        """
+        if not self.path_for(month).exists():
+            return False
+        marker = self.key_path(month)
+        return key is None or (marker.exists() and marker.read_text() == key)
+
+    def save(self, month: date, summaries: dict, key=None, ride_ids=None) -> Path:
+        """Save one month's summaries
+
+        Args:
+            month (date): Month the summaries cover
+            summaries (dict): The month's summaries, see Main.count_chunks
+            key (str, optional): Key of the settings they were counted with. Defaults to None.
+            ride_ids (dict, optional): Station ids they were counted with. Defaults to None.
+
+        Returns:
+            Path: Output path
+        """
+        output = self.path_for(month)
+        logging.info(f"Saving partial summaries to {output}")
+        # Drop the old key first, so an interrupted save never looks current
+        self.key_path(month).unlink(missing_ok=True)
+        with open(output, "wb") as f:
+            pickle.dump(summaries, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self.ids_path(month), "w") as f:
+            json.dump(ride_ids or {}, f)
+        self.key_path(month).write_text(key or "")
+        return output
+
+    def load(self, month: date) -> dict:
+        with open(self.path_for(month), "rb") as f:
+            return pickle.load(f)
+
+    def ride_ids(self, month: date) -> dict:
+        """The station ids a month was counted with, see save"""
+        with open(self.ids_path(month)) as f:
+            return json.load(f)
+
+    def months(self, key=None) -> list:
+        """List the months that have stored summaries, saved with key if given"""
+        months = [
+            date(int(p.stem[:4]), int(p.stem[4:]), 1)
+            for p in self.path.glob("*.pickle")
+        ]
+        return sorted(month for month in months if self.has(month, key=key))
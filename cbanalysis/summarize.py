@@ -8,6 +8,8 @@ import json
 import numpy as np
 import logging
 
+from .stations import StationTable
+
 
 logging.basicConfig(level=logging.INFO)
 
@@ -24,50 +26,6 @@ class Summarizer:
         """
         self.paths = paths
 
-    def agg_by_hour(self, df, orient="start", station=None) -> pd.DataFrame:
-        """Given a df, aggregate the count of all rides in each hour for every station.
-
-        Args:
-            df ([type]): Dataframe of all rides; ideally concatted from multiple months
-            orient (str, optional): Consider `start` station or `end` station. Defaults to 'start'.
-            station ([type], optional): Station to filter by. Defaults to None.
-
-        Returns:
-            [type]: DataFrame
-        """
-        # first, resample to every hour, counting all of the trips per hour
-        df1: pd.DataFrame = (
-            df.loc[:, [f"{orient}_time", f"{orient}_short_name"]]
-            .set_index(f"{orient}_time", drop=True)
-            .groupby(f"{orient}_short_name")
-            .resample("1H")
-            .count()
-            .rename(columns={f"{orient}_short_name": "counts"})
-            .reset_index()
-        )
-        # Get time fields for grouping
-        df1[f"{orient}_weekday"] = df1[f"{orient}_time"].dt.weekday
-        df1[f"{orient}_hour"] = df1[f"{orient}_time"].dt.hour
-        # Now we aggregate, and get the count per hour and per weekday
-        # by_weekday_hr = df1.groupby(
-        #     [f"{orient}_short_name", f"{orient}_weekday", f"{orient}_hour"]
-        # ).aggregate(np.sum)
-        # by_weekday_hr.columns = by_weekday_hr.columns.droplevel(0)
-
-        by_hr = (
-            df1.groupby([f"{orient}_short_name", f"{orient}_hour"])
-            .aggregate(np.sum)
-            .reset_index()
-            .rename(columns={f"{orient}_short_name": "short_name"})
-        )
-
-        by_hr = by_hr.loc[:, ["short_name", "start_hour", "counts"]]
-        if station == None:
-            return by_hr
-        else:
-            idx = pd.IndexSlice
-            return by_hr.loc[idx[station, :, :]]
-
     def count_stations_per_nta(self, df_stations: pd.DataFrame) -> pd.DataFrame:
         """Given a df of stations with NTAs identified, count # of stations per NTA.
 
@@ -88,50 +46,55 @@ class Summarizer:
         )
         return stations_per_nta
 
-    def rank_stations_by_nta(
+    def rank_station_totals(
         self,
-        df_rides: pd.DataFrame,
-        df_station_geo: pd.DataFrame,
+        totals: np.ndarray,
+        stations: StationTable,
         df_stations_per_nta: pd.DataFrame,
     ) -> pd.DataFrame:
-        """Given df of rides with NTA's joined,
-         count the number of rides and rank them within each group.
+        """Dense-rank stations within their NTA by ride count, most rides
+        first, from one count per station code. Works on arrays the size of
+        the station table, so ranking any window of rides (e.g. from
+        CountCube.station_totals) takes milliseconds.
 
         Args:
-            df (pd.DataFrame): [description] DataFrame of rides with NTA's joined
-            df_stations_per_nta (pd.DataFrame): [description] DataFrame of NTA's with station counts
+            totals (np.ndarray): Rides per station code
+            stations (StationTable): Station codes to short names and NTA's
+            df_stations_per_nta (pd.DataFrame): DataFrame of NTA's with station counts
 
         Returns:
-            pd.DataFrame: [description]
+            pd.DataFrame: ntacode, station_rank and stations_count by
+                start_short_name, NTA's in descending order, most rides first
         """
-
-        # join the geo data onto rides
-        df_rides = df_rides.astype({"start_short_name": str})
-
-        df_joined = pd.merge(
-            left=df_rides,
-            right=df_station_geo,
-            how="left",
-            left_on="start_short_name",
-            right_on="short_name",
+        # Stations without rides or without an NTA are not ranked
+        ntacodes = pd.Series(stations.ntacodes, dtype=object)
+        codes = np.flatnonzero((np.asarray(totals) > 0) & ntacodes.notna().to_numpy())
+        nta_numbers, ntas = pd.factorize(ntacodes.to_numpy()[codes], sort=True)
+        counts = np.asarray(totals)[codes]
+        short_names = np.asarray(stations.short_names, dtype=object)[codes]
+
+        # NTA descending, then count descending, then name
+        order = np.lexsort((short_names, -counts, -nta_numbers))
+        nta_numbers, counts = nta_numbers[order], counts[order]
+        first_in_nta = np.r_[True, nta_numbers[1:] != nta_numbers[:-1]]
+        new_rank = first_in_nta | np.r_[True, counts[1:] != counts[:-1]]
+        ranks = np.cumsum(new_rank)
+        nta_start = np.maximum.accumulate(
+            np.where(first_in_nta, np.arange(len(ranks)), 0)
         )
+        ranks = ranks - ranks[nta_start] + 1 if len(ranks) else ranks
 
         stations_ranked_by_nta = (
-            df_joined.loc[:, ["uuid", "ntacode", "start_short_name"]]
-            .groupby(["ntacode", "start_short_name"])
-            .count()
-            .sort_values(by=["ntacode", "uuid"], ascending=False)
-            .groupby(["ntacode"])
-            .rank(method="dense", ascending=False, pct=False)
-            .reset_index()
-            .rename({"uuid": "station_rank"}, axis=1)
+            pd.DataFrame(
+                {
+                    "ntacode": np.asarray(ntas, dtype=object)[nta_numbers],
+                    "start_short_name": short_names[order],
+                    "station_rank": ranks.astype("int32"),
+                }
+            )
             .merge(df_stations_per_nta, on="ntacode", how="left")
-            # Cast type to int
-            .astype({"station_rank": "int32"})
             .set_index("start_short_name")
-            .rename(columns={"start_short_name": "short_name"})
         )
-
         return stations_ranked_by_nta
 
     def join_rankings(
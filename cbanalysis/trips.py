@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+# Rides outside these bounds are left out of the trip statistics: redocks
+# under a minute, bikes kept out overnight, and coordinates far outside the city.
+# Durations are in seconds and distances in meters, both bounds inclusive.
+TRIP_BOUNDS = {
+    "duration": (60.0, 4 * 3600.0),
+    "distance": (0.0, 30_000.0),
+}
+TRIP_QUANTILES = (0.5, 0.9)
+# Mean radius, in meters
+EARTH_RADIUS = 6_371_008.8
+
+
+def trip_durations(df: pd.DataFrame) -> np.ndarray:
+    """Seconds from start_time to stop_time of each ride, NaN where either is missing"""
+    start = df["start_time"].to_numpy("datetime64[ns]")
+    stop = df["stop_time"].to_numpy("datetime64[ns]")
+    nanoseconds = (stop - start).astype(np.float64)
+    nanoseconds[np.isnat(start) | np.isnat(stop)] = np.nan
+    return (nanoseconds / 1e9).astype(np.float32)
+
+
+def trip_distances(df: pd.DataFrame) -> np.ndarray:
+    """Great-circle meters from start_lat/lng to end_lat/lng of each ride,
+    by the haversine formula, NaN where a coordinate is missing"""
+    lat1, lng1, lat2, lng2 = (
+        np.radians(df[column].to_numpy(np.float32, na_value=np.nan))
+        for column in ["start_lat", "start_lng", "end_lat", "end_lng"]
+    )
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    )
+    return (2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))).astype(np.float32)
+
+
+def within_bounds(measures: dict, bounds=TRIP_BOUNDS) -> np.ndarray:
+    """Rides whose every measure is known and within its bounds.
+
+    Args:
+        measures (dict): Measure name to one value per ride, e.g. "duration"
+        bounds (dict, optional): Measure name to (low, high). Defaults to TRIP_BOUNDS.
+
+    Returns:
+        np.ndarray: Boolean mask of rides to keep
+    """
+    keep = np.ones(len(next(iter(measures.values()))), dtype=bool)
+    for name, values in measures.items():
+        low, high = bounds.get(name, (-np.inf, np.inf))
+        # NaN fails both comparisons
+        keep &= (values >= low) & (values <= high)
+    return keep
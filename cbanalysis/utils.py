@@ -0,0 +1,166 @@
+import os
+import queue
+import threading
+from datetime import date, timedelta
+import logging
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pandas as pd
+
+
+def touchdir(dir: str):
+    if not os.path.exists(dir):
+        logging.warn(f"Created: {dir}")
+        os.makedirs(dir)
+    else:
+        logging.warn(f"Skipped mkdir: {dir}")
+
+
+class WorkingPaths:
+    """A dictionary of working paths, with the option of creating a TemporaryDirectory."""
+
+    def __init__(self, start_dir, touch=True) -> None:
+        self.start_cwd = None
+        self.tempdir = None
+        self.paths = self.make_folders(start_dir)
+
+        if touch:
+            logging.debug("Touch-ing folders...")
+            self.touch()
+            # Assign AFTER the touch
+            if self.tempdir:
+                self.paths["cwd"] = self.tempdir
+        # Assign dict to class attrs
+        for k, v in self.paths.items():
+            setattr(self, k, v)
+        pass
+
+    def make_folders(self, start_dir=None):
+        """
+        Create folders for project.
+        """
+        logging.debug(f"CWD IS {os.getcwd()}")
+        if start_dir:
+            logging.debug(f"Using existing directory: {start_dir}")
+            self.start_cwd = start_dir
+            os.chdir(self.start_cwd)
+        else:
+            self.tempdir = TemporaryDirectory()
+            logging.debug(f"Using TemporaryDirectory: {start_dir}")
+            self.start_cwd = self.tempdir.name
+            os.chdir(self.tempdir.name)
+
+        logging.debug(f"CWD changed to {os.getcwd()}")
+        paths = {
+            x: Path(x) for x in ["zip", "out", "summary", "partials", "rides", "cache"]
+        }
+        # paths = {
+        #     "zip": Path("./zip"),
+        #     "csv": Path("./csv"),
+        #     "out": Path("./out"),
+        #     "summary": Path("./summary"),
+        # }
+        return paths
+
+    def touch(self):
+        # `touch` all the paths we're using
+        for dir in self.paths.values():
+            logging.debug(f"Created {dir}")
+            touchdir(dir)
+
+
+def prefetch(iterable, size=1):
+    """Iterate in a background thread, keeping up to `size` items ready,
+    so producing the next item overlaps with using the current one.
+
+    Args:
+        iterable (iterable): e.g. a generator of parsed chunks
+        size (int, optional): Items to read ahead. Defaults to 1.
+
+    Yields:
+        The items of iterable, in order
+    """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for item in iterable:
+                put((item, None))
+                if stop.is_set():
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((None, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        # Let the producer exit if we stop early
+        stop.set()
+
+
+def months_in_range(start: str, end: str) -> list:
+    """List the first of every month between two ISO dates, inclusive.
+
+    Args:
+        start (str): e.g. "2021-12-01"
+        end (str): e.g. "2022-05-01"
+
+    Returns:
+        list: datetime.date for each month
+    """
+    start = date.fromisoformat(start)
+    end = date.fromisoformat(end)
+    months = list()
+    current = start
+    while current <= end:
+        months.append(current)
+        if current.month == 12:
+            current = current.replace(year=current.year + 1, month=1)
+        else:
+            current = current.replace(month=current.month + 1)
+    return months
+
+
+def days_in_months(months) -> pd.DatetimeIndex:
+    """Every day of the given months, from the first of the first month
+    to the last of the last month.
+
+    Args:
+        months (list): datetime.date for each month, e.g. from months_in_range
+
+    Returns:
+        pd.DatetimeIndex: Days
+    """
+    if not months:
+        return pd.DatetimeIndex([])
+    last_day = pd.Timestamp(max(months)) + pd.offsets.MonthEnd(0)
+    return pd.date_range(min(months), last_day)
+
+
+def get_months(start_date=date(2020, 8, 1), end_date=date(2020, 12, 1)):
+    delta = end_date - start_date  # returns timedelta
+    months = []
+    for i in range(delta.months + 1):
+        month = start_date + timedelta(months=1)
+        print(month)
+        months.append(month)
+    return months
@@ -1,14 +1,102 @@
 # https://flask-sqlalchemy.palletsprojects.com/en/2.x/quickstart/#a-minimal-application
+import json
 import logging
 import os
+import threading
+import time
+from collections import OrderedDict
 
 from dotenv import load_dotenv
 from flask import Flask, request
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from .payloads import (
+    NTA_FIELDS,
+    RANKING_FIELDS,
+    hourly_payload,
+    nta_payload,
+    ranking_payload,
+)
+from .station_index import FlowIndex, StationIndex
 
 load_dotenv()
 
+# Written by cbanalysis.reports.export_hourly_sql
+HOURLY_TABLE = "summary_hourly"
+EXPORTS_TABLE = "summary_exports"
+# Written by cbanalysis.reports.export_stations_sql
+STATIONS_TABLE = "summary_stations"
+
+
+class ResponseCache:
+    """Pre-serialized responses kept in this worker's memory, the max_entries
+    most recently used of them. Checks at most every check_seconds for a
+    newer export, and drops everything if one landed.
+
+    Keys are checked against the export's known keys before anything is
+    loaded, and keys that load nothing are cached as such, so requests for
+    unknown stations don't each reach the database."""
+
+    def __init__(
+        self, latest_export, known_keys=None, check_seconds=5, max_entries=4096
+    ):
+        """
+        Args:
+            latest_export (callable): Returns the id of the newest export
+            known_keys (callable, optional): Returns every key the newest export
+                has a body for, or None if unknown. Defaults to None.
+            check_seconds (float, optional): Seconds between checks. Defaults to 5.
+            max_entries (int, optional): Bodies to keep. Defaults to 4096.
+        """
+        self.latest_export = latest_export
+        self.known_keys = known_keys
+        self.check_seconds = check_seconds
+        self.max_entries = max_entries
+        self.export_id = None
+        self.checked_at = None
+        self.keys = None
+        self.bodies = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, load):
+        """Return the cached body for key, or load and cache it.
+
+        Args:
+            key (str): e.g. a station's short_name
+            load (callable): Returns the body for key, or None if there is none
+
+        Returns:
+            The body, or None if there is none
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.checked_at is None or now - self.checked_at >= self.check_seconds:
+                first = self.checked_at is None
+                self.checked_at = now
+                export_id = self.latest_export()
+                if first or export_id != self.export_id:
+                    self.export_id = export_id
+                    self.bodies = OrderedDict()
+                    keys = self.known_keys() if self.known_keys else None
+                    self.keys = set(keys) if keys is not None else None
+            if self.keys is not None and key not in self.keys:
+                return None
+            if key in self.bodies:
+                self.bodies.move_to_end(key)
+                return self.bodies[key]
+            export_id = self.export_id
+        body = load(key)
+        with self.lock:
+            # Unless a newer export landed while loading
+            if export_id == self.export_id:
+                self.bodies[key] = body
+                if len(self.bodies) > self.max_entries:
+                    self.bodies.popitem(last=False)
+        return body
+
 
 def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
@@ -28,6 +116,15 @@ def create_app(test_config=None):
 
     # Add CORS origins here
     CORS(app, resources={r"/api/*": {"origins": "*"}})
+
+    # Origin-destination flows from the analysis job's flow index files
+    add_flow_routes(app)
+
+    # Serve from the analysis job's station index file instead of a database
+    index_path = app.config.get("STATION_INDEX", os.getenv("STATION_INDEX"))
+    if index_path:
+        return add_file_routes(app, index_path)
+
     app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("SQLALCHEMY_CONN")
     db = SQLAlchemy(app)
 
@@ -46,27 +143,171 @@ def create_app(test_config=None):
     def index():
         return "Server is live!"
 
+    def latest_export():
+        try:
+            return db.session.execute(
+                text(
+                    f"SELECT export_id FROM {EXPORTS_TABLE} "
+                    "ORDER BY exported_at DESC LIMIT 1"
+                )
+            ).scalar()
+        except SQLAlchemyError:
+            # Exported before there were export ids
+            db.session.rollback()
+            return None
+
+    def load_hourly(short_name):
+        # One index range, as export_hourly_sql keeps a station's rows together
+        rows = SummaryHourly.query.filter(SummaryHourly.short_name == short_name).all()
+        if not rows:
+            return None
+        counts = [0] * 24
+        for row in rows:
+            counts[row.start_hour] = row.counts
+        return json.dumps(hourly_payload(counts))
+
+    def hourly_short_names():
+        try:
+            return (
+                db.session.execute(
+                    text(f"SELECT DISTINCT short_name FROM {HOURLY_TABLE}")
+                )
+                .scalars()
+                .all()
+            )
+        except SQLAlchemyError:
+            # Nothing exported yet
+            db.session.rollback()
+            return None
+
+    responses = ResponseCache(
+        latest_export,
+        known_keys=hourly_short_names,
+        check_seconds=app.config.get("RESPONSE_CACHE_SECONDS", 5),
+        max_entries=app.config.get("RESPONSE_CACHE_ENTRIES", 4096),
+    )
+
     @app.route("/api/hourly")
     def hourly():
         short_name = request.args.get("short_name")
         if short_name is None:
             return "No short_name specified", 204
-        result_proxy = SummaryHourly.query.filter(
-            SummaryHourly.short_name == short_name
+        body = responses.get(short_name, load_hourly)
+        if body is None:
+            return {"data": None}, 404
+        return app.response_class(body, mimetype="application/json")
+
+    @app.route("/api/ranking")
+    def ranking():
+        short_name = request.args.get("short_name")
+        if short_name is None:
+            return "No short_name specified", 204
+        row = db.session.execute(
+            text(
+                f"SELECT {', '.join(RANKING_FIELDS)} FROM {STATIONS_TABLE} "
+                "WHERE short_name = :short_name"
+            ),
+            {"short_name": short_name},
+        ).first()
+        if row is None or row.station_rank is None:
+            return {"data": None}, 404
+        return ranking_payload(row._mapping)
+
+    @app.route("/api/nta")
+    def nta():
+        ntacode = request.args.get("ntacode")
+        if ntacode is None:
+            return "No ntacode specified", 204
+        rows = db.session.execute(
+            text(
+                f"SELECT {', '.join(NTA_FIELDS)} FROM {STATIONS_TABLE} "
+                "WHERE ntacode = :ntacode "
+                "ORDER BY station_rank IS NULL, station_rank, short_name"
+            ),
+            {"ntacode": ntacode},
         ).all()
-        results_list = []
-        for row in result_proxy:
-            # row_as_dict = {
-            #     column: str(getattr(row, column)) for column in row.__table__.c.keys()
-            # }
-            row_as_dict = {"start_hour": row.start_hour, "counts": row.counts}
-            results_list.append(row_as_dict)
-        return {"data": results_list}
+        if not rows:
+            return {"data": None}, 404
+        return nta_payload(row._mapping for row in rows)
 
     # End of app factory pattern
     return app
 
 
+def add_file_routes(app, index_path):
+    """Answer the API from a memory-mapped StationIndex, with no database"""
+    stations = StationIndex(index_path)
+
+    @app.route("/")
+    def index():
+        return "Server is live!"
+
+    @app.route("/api/hourly")
+    def hourly():
+        short_name = request.args.get("short_name")
+        if short_name is None:
+            return "No short_name specified", 204
+        stations.refresh()
+        counts = stations.hourly_counts(short_name)
+        if counts is None:
+            return {"data": None}, 404
+        return hourly_payload(counts)
+
+    @app.route("/api/ranking")
+    def ranking():
+        short_name = request.args.get("short_name")
+        if short_name is None:
+            return "No short_name specified", 204
+        stations.refresh()
+        result = stations.ranking(short_name)
+        if result is None:
+            return {"data": None}, 404
+        return ranking_payload(result)
+
+    @app.route("/api/nta")
+    def nta():
+        ntacode = request.args.get("ntacode")
+        if ntacode is None:
+            return "No ntacode specified", 204
+        stations.refresh()
+        result = stations.nta_stations(ntacode)
+        if not result:
+            return {"data": None}, 404
+        return nta_payload(result)
+
+    return app
+
+
+def add_flow_routes(app):
+    """Answer top destinations from memory-mapped FlowIndex files, if the
+    STATION_FLOWS and/or NTA_FLOWS files are configured"""
+    flows = {}
+    for param, key in [("short_name", "STATION_FLOWS"), ("ntacode", "NTA_FLOWS")]:
+        path = app.config.get(key, os.getenv(key))
+        if path:
+            flows[param] = FlowIndex(path)
+    if not flows:
+        return app
+
+    @app.route("/api/destinations")
+    def destinations():
+        param = next((p for p in flows if request.args.get(p) is not None), None)
+        if param is None:
+            return f"No {' or '.join(flows)} specified", 204
+        k = min(request.args.get("k", 10, type=int), 100)
+        hour = request.args.get("hour", type=int)
+        index = flows[param]
+        index.refresh()
+        if hour is not None and not 0 <= hour < index.hours:
+            return {"data": None}, 400
+        result = index.top_destinations(request.args[param], k=k, hour=hour)
+        if result is None:
+            return {"data": None}, 404
+        return {"data": result}
+
+    return app
+
+
 if __name__ == "__main__":
     logging.info("Starting server...")
     app = create_app()
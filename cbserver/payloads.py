@@ -0,0 +1,53 @@
+"""Bodies of the API responses, built the same way whether a route reads
+the database or a memory-mapped index file, so both modes answer alike."""
+
+# A station in /api/ranking, as the columns of summary_stations
+RANKING_FIELDS = (
+    "short_name",
+    "name",
+    "ntacode",
+    "ntaname",
+    "boroname",
+    "station_rank",
+    "stations_count",
+    "lng",
+    "lat",
+)
+# A station in /api/nta
+NTA_FIELDS = ("short_name", "name", "station_rank", "lng", "lat")
+
+
+def hourly_payload(counts) -> dict:
+    """/api/hourly: a station's ride counts by hour of day.
+
+    Args:
+        counts (list): Rides starting in hours 0-23
+    """
+    return {
+        "data": [
+            {"start_hour": hour, "counts": int(count)}
+            for hour, count in enumerate(counts)
+        ]
+    }
+
+
+def ranking_payload(station) -> dict:
+    """/api/ranking: a station's rank within its NTA, with the NTA and location.
+
+    Args:
+        station (Mapping): RANKING_FIELDS, e.g. a summary_stations row
+    """
+    return {"data": {field: station[field] for field in RANKING_FIELDS}}
+
+
+def nta_payload(stations) -> dict:
+    """/api/nta: the stations of an NTA.
+
+    Args:
+        stations (list): Mappings with NTA_FIELDS, ranked ones first by rank, then by short name
+    """
+    return {
+        "data": [
+            {field: station[field] for field in NTA_FIELDS} for station in stations
+        ]
+    }
@@ -0,0 +1,239 @@
+import heapq
+import math
+import mmap
+import os
+import struct
+import threading
+from typing import NamedTuple
+
+# Written by cbanalysis.reports.export_station_index; keep the two in step
+INDEX_MAGIC = b"CBIX"
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct("<4sHHIIIIIIIIII")
+
+# Written by cbanalysis.reports.export_flow_index; keep the two in step
+FLOW_MAGIC = b"CBFL"
+FLOW_VERSION = 1
+FLOW_HEADER = struct.Struct("<4sHHIIIIII")
+
+
+class MappedIndex:
+    """Read-only view of a file written by the analysis job. The file is
+    memory-mapped, so gunicorn workers share its pages through the OS cache,
+    and values are read straight out of the mapping. When the analysis job
+    swaps in a new file, the next lookup maps the new one.
+
+    Everything read from one file is kept in a single immutable snapshot
+    (see load), replaced in one assignment, so a lookup that runs while
+    another thread refreshes sees either the old file or the new one."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stat = None
+        self.snapshot = None
+        self.open()
+
+    def open(self):
+        with open(self.path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.snapshot = self.load(memoryview(data))
+        self.stat = (stat.st_ino, stat.st_mtime_ns)
+
+    def load(self, view):
+        """Read a mapped file into a snapshot, e.g. a NamedTuple"""
+        raise NotImplementedError
+
+    def _strings(self, view, offset, count) -> list:
+        ends = view[offset : offset + 4 * (count + 1)].cast("I")
+        start = offset + 4 * (count + 1)
+        return [
+            bytes(view[start + ends[i] : start + ends[i + 1]]).decode()
+            for i in range(count)
+        ]
+
+    def refresh(self):
+        """Map the file again if it has been replaced since it was opened"""
+        stat = os.stat(self.path)
+        if (stat.st_ino, stat.st_mtime_ns) != self.stat:
+            with self.lock:
+                # Another thread may have mapped it while this one waited
+                stat = os.stat(self.path)
+                if (stat.st_ino, stat.st_mtime_ns) != self.stat:
+                    self.open()
+
+
+class StationSnapshot(NamedTuple):
+    names: list
+    # Short name to position
+    stations: dict
+    labels: list
+    ntas: list
+    nta_names: list
+    boros: list
+    # NTA code to the positions of its stations, ranked ones first
+    nta_members: dict
+    hours: int
+    hourly: memoryview
+    # [stations][4]: NTA, station_rank, stations_count, row of hourly
+    slots: memoryview
+    # [stations][2]: lng, lat
+    coordinates: memoryview
+
+
+class StationIndex(MappedIndex):
+    """Hourly counts, rankings and locations by station, from a station index
+    file; a station reads as the same fields as a summary_stations row"""
+
+    def load(self, view) -> StationSnapshot:
+        magic, version, hours, n_stations, n_ntas, *offsets = INDEX_HEADER.unpack_from(
+            view
+        )
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise Exception(f"{self.path} is not a version {INDEX_VERSION} index")
+        (
+            names_offset,
+            labels_offset,
+            ntas_offset,
+            nta_names_offset,
+            boros_offset,
+            hourly_offset,
+            slots_offset,
+            coordinates_offset,
+        ) = offsets
+        names = self._strings(view, names_offset, n_stations)
+        ntas = self._strings(view, ntas_offset, n_ntas)
+        slots = view[slots_offset : slots_offset + 16 * n_stations].cast("i")
+        n_hourly = sum(1 for row in slots[3::4] if row >= 0)
+        hourly = view[hourly_offset : hourly_offset + 4 * n_hourly * hours]
+        coordinates = view[coordinates_offset : coordinates_offset + 16 * n_stations]
+
+        # One pass over the stations, so an NTA lookup only touches its own;
+        # ordered like the database's: ranked first by rank, then by short name
+        members = {}
+        for i, (nta, rank) in enumerate(zip(slots[0::4], slots[1::4])):
+            if nta >= 0:
+                members.setdefault(ntas[nta], []).append((rank == 0, rank, names[i], i))
+        nta_members = {
+            ntacode: tuple(ranked[-1] for ranked in sorted(stations))
+            for ntacode, stations in members.items()
+        }
+        return StationSnapshot(
+            names=names,
+            stations={name: i for i, name in enumerate(names)},
+            labels=self._strings(view, labels_offset, n_stations),
+            ntas=ntas,
+            nta_names=self._strings(view, nta_names_offset, n_ntas),
+            boros=self._strings(view, boros_offset, n_ntas),
+            nta_members=nta_members,
+            hours=hours,
+            hourly=hourly.cast("I"),
+            slots=slots,
+            coordinates=coordinates.cast("d"),
+        )
+
+    def hourly_counts(self, short_name) -> list:
+        """Counts for hours 0-23, or None for a station without counts"""
+        index = self.snapshot
+        i = index.stations.get(short_name)
+        if i is None or index.slots[4 * i + 3] < 0:
+            return None
+        row = index.slots[4 * i + 3]
+        return index.hourly[row * index.hours : (row + 1) * index.hours].tolist()
+
+    def station(self, short_name, index=None) -> dict:
+        """The station's summary_stations fields, or None for an unknown station"""
+        index = index or self.snapshot
+        i = index.stations.get(short_name)
+        if i is None:
+            return None
+        nta, rank, stations_count, _ = index.slots[4 * i : 4 * i + 4].tolist()
+        lng, lat = (
+            None if math.isnan(value) else value
+            for value in index.coordinates[2 * i : 2 * i + 2].tolist()
+        )
+        return {
+            "short_name": short_name,
+            "name": index.labels[i] or None,
+            "ntacode": index.ntas[nta] if nta >= 0 else None,
+            "ntaname": index.nta_names[nta] or None if nta >= 0 else None,
+            "boroname": index.boros[nta] or None if nta >= 0 else None,
+            "station_rank": rank or None,
+            "stations_count": stations_count if rank else None,
+            "lng": lng,
+            "lat": lat,
+        }
+
+    def ranking(self, short_name) -> dict:
+        """The station's fields, or None for an unknown or unranked station"""
+        station = self.station(short_name)
+        if station is None or station["station_rank"] is None:
+            return None
+        return station
+
+    def nta_stations(self, ntacode) -> list:
+        """Every station in an NTA, ranked ones first by rank, then by short
+        name; empty for an unknown NTA"""
+        index = self.snapshot
+        return [
+            self.station(index.names[i], index)
+            for i in index.nta_members.get(ntacode, ())
+        ]
+
+
+class FlowSnapshot(NamedTuple):
+    names: list
+    # Name to position
+    codes: dict
+    hours: int
+    indptr: memoryview
+    indices: memoryview
+    counts: memoryview
+
+
+class FlowIndex(MappedIndex):
+    """Origin-destination trip counts from a flow index file, kept as the
+    rows of a sparse matrix: a lookup reads only the origin's nonzero cells"""
+
+    def load(self, view) -> FlowSnapshot:
+        magic, version, hours, n, nnz, *offsets = FLOW_HEADER.unpack_from(view)
+        if magic != FLOW_MAGIC or version != FLOW_VERSION:
+            raise Exception(f"{self.path} is not a version {FLOW_VERSION} flow index")
+        names_offset, indptr_offset, indices_offset, data_offset = offsets
+        names = self._strings(view, names_offset, n)
+        indptr = view[indptr_offset : indptr_offset + 4 * (hours * n + 1)]
+        return FlowSnapshot(
+            names=names,
+            codes={name: i for i, name in enumerate(names)},
+            hours=hours,
+            indptr=indptr.cast("I"),
+            indices=view[indices_offset : indices_offset + 4 * nnz].cast("I"),
+            counts=view[data_offset : data_offset + 4 * nnz].cast("I"),
+        )
+
+    @property
+    def hours(self) -> int:
+        return self.snapshot.hours
+
+    def top_destinations(self, name, k=10, hour=None) -> list:
+        """The k destinations with the most trips from name, in one hour of
+        the day or all of them; None for an unknown origin"""
+        index = self.snapshot
+        origin = index.codes.get(name)
+        if origin is None:
+            return None
+        hours = range(index.hours) if hour is None else [hour]
+        trips = {}
+        for h in hours:
+            row = h * len(index.names) + origin
+            start, stop = index.indptr[row], index.indptr[row + 1]
+            for destination, count in zip(
+                index.indices[start:stop].tolist(), index.counts[start:stop].tolist()
+            ):
+                trips[destination] = trips.get(destination, 0) + count
+        top = heapq.nsmallest(k, trips.items(), key=lambda item: (-item[1], item[0]))
+        return [
+            {"destination": index.names[destination], "trips": count}
+            for destination, count in top
+        ]
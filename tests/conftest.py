@@ -0,0 +1,138 @@
+import os
+import zipfile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+# A handful of stations in the post-2021 format, where station ids are short_names
+SHORT_NAMES = ["5329.03", "6926.01", "5430.08", "JC013"]
+NTACODES = ["MN17", "MN15", "MN24", "MN15"]
+LEGACY_IDS = ["72", "79", "82", "3184"]
+
+
+def make_rides(n=500, month="2022-01", seed=0) -> pd.DataFrame:
+    """Random rides with the same columns as a post-2021 tripdata CSV"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(f"{month}-01") + pd.to_timedelta(
+        rng.integers(0, 27 * 24 * 3600, n), unit="s"
+    )
+    stop = start + pd.to_timedelta(rng.integers(60, 3600, n), unit="s")
+    start_idx = rng.integers(0, len(SHORT_NAMES), n)
+    stop_idx = rng.integers(0, len(SHORT_NAMES), n)
+    ids = np.array(SHORT_NAMES)
+    return pd.DataFrame(
+        {
+            "ride_id": [f"{month}-{i:08X}" for i in range(n)],
+            "rideable_type": rng.choice(["classic_bike", "electric_bike"], n),
+            "started_at": start.strftime("%Y-%m-%d %H:%M:%S"),
+            "ended_at": stop.strftime("%Y-%m-%d %H:%M:%S"),
+            "start_station_name": ids[start_idx],
+            "start_station_id": ids[start_idx],
+            "end_station_name": ids[stop_idx],
+            "end_station_id": ids[stop_idx],
+            "start_lat": 40.7 + rng.random(n) / 10,
+            "start_lng": -74.0 + rng.random(n) / 10,
+            "end_lat": 40.7 + rng.random(n) / 10,
+            "end_lng": -74.0 + rng.random(n) / 10,
+            "member_casual": rng.choice(["member", "casual"], n),
+        }
+    )
+
+
+def make_legacy_rides(n=500, month="2019-06", seed=0) -> pd.DataFrame:
+    """The same kind of rides in the 2013-2021 layout, with legacy station ids"""
+    rides = make_rides(n=n, month=month, seed=seed)
+    legacy_ids = dict(zip(SHORT_NAMES, LEGACY_IDS))
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "tripduration": 600,
+            "starttime": rides["started_at"],
+            "stoptime": rides["ended_at"],
+            "start station id": rides["start_station_id"].map(legacy_ids),
+            "start station name": rides["start_station_name"],
+            "start station latitude": rides["start_lat"],
+            "start station longitude": rides["start_lng"],
+            "end station id": rides["end_station_id"].map(legacy_ids),
+            "end station name": rides["end_station_name"],
+            "end station latitude": rides["end_lat"],
+            "end station longitude": rides["end_lng"],
+            "bikeid": rng.integers(14529, 40000, n),
+            "usertype": rides["member_casual"].map(
+                {"member": "Subscriber", "casual": "Customer"}
+            ),
+            "birth year": np.where(rng.random(n) < 0.1, "\\N", "1990"),
+            "gender": rng.integers(0, 3, n),
+        }
+    )
+
+
+@pytest.fixture(autouse=True)
+def restore_cwd(monkeypatch):
+    """WorkingPaths chdirs into its (maybe temporary) directory; undo that after each test"""
+    monkeypatch.chdir(os.getcwd())
+
+
+@pytest.fixture
+def rides_zip(tmp_path):
+    """Two months of rides zipped up under zip/, like downloaded tripdata"""
+    path = tmp_path / "zip"
+    path.mkdir(exist_ok=True)
+    for i, month in enumerate(["2022-01", "2022-02"]):
+        name = f"{month.replace('-', '')}-citibike-tripdata.csv"
+        with zipfile.ZipFile(path / f"{name}.zip", "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(name, make_rides(month=month, seed=i).to_csv(index=False))
+    return path
+
+
+@pytest.fixture
+def station_geo() -> gpd.GeoDataFrame:
+    """Stations with NTA's joined, as returned by Prepper.sjoin_ntas_stations"""
+    return gpd.GeoDataFrame(
+        {
+            "station_id": [f"id-{s}" for s in SHORT_NAMES],
+            "short_name": SHORT_NAMES,
+            "legacy_id": LEGACY_IDS,
+            "name": SHORT_NAMES,
+            "boroname": "Manhattan",
+            "ntaname": NTACODES,
+            "ntacode": NTACODES,
+        },
+        geometry=gpd.points_from_xy([-73.99, -73.98, -73.97, -74.03], [40.76] * 4),
+    )
+
+
+@pytest.fixture
+def nta_polygons() -> gpd.GeoDataFrame:
+    """Three square NTA's side by side, as returned by Prepper.load_ntas"""
+    return gpd.GeoDataFrame(
+        {
+            "ntacode": ["MN17", "MN15", "MN24"],
+            "ntaname": ["Midtown", "Clinton", "SoHo"],
+            "boroname": "Manhattan",
+            "shape_area": "1",
+        },
+        geometry=[
+            shapely.box(x, 40.7, x + 0.01, 40.71) for x in (-74.0, -73.99, -73.98)
+        ],
+        crs=4326,
+    )
+
+
+@pytest.fixture
+def station_points() -> gpd.GeoDataFrame:
+    """Stations as returned by Prepper.fetch_station_info; the last is outside every NTA"""
+    lon = [-73.995, -73.985, -73.975, -73.5]
+    return gpd.GeoDataFrame(
+        {
+            "name": SHORT_NAMES,
+            "legacy_id": LEGACY_IDS,
+            "station_id": [f"id-{s}" for s in SHORT_NAMES],
+            "short_name": SHORT_NAMES,
+        },
+        geometry=gpd.points_from_xy(lon, [40.705] * 4),
+        crs=4326,
+    )
@@ -0,0 +1,72 @@
+import time
+
+import pandas as pd
+
+from cbanalysis.cache import StageCache
+from cbanalysis.main import Main
+
+
+def test_cached_reruns_only_on_changed_inputs(tmp_path):
+    cache = StageCache(tmp_path / "cache")
+    source = tmp_path / "input.csv"
+    source.write_text("a\n1\n")
+    calls = []
+
+    def stage():
+        calls.append(1)
+        return pd.read_csv(source)
+
+    for _ in range(2):
+        cache.cached("read", stage, inputs=[source], params={"n": 1})
+    assert len(calls) == 1
+    cache.cached("read", stage, inputs=[source], params={"n": 2})
+    assert len(calls) == 2
+
+    source.write_text("a\n1\n2\n")
+    assert len(cache.cached("read", stage, inputs=[source], params={"n": 1})) == 2
+    assert len(calls) == 3
+    # The same frame contents give the same key
+    df = pd.DataFrame({"a": [1, 2]})
+    assert cache.key("s", [df]) == cache.key("s", [df.copy()])
+    assert cache.key("s", [df]) != cache.key("s", [df + 1])
+
+
+def test_ttl_and_eviction(tmp_path):
+    cache = StageCache(tmp_path / "cache", max_bytes=3000)
+    cache.cached("remote", lambda: 1)
+    key = cache.key("remote")
+    assert cache.get("remote", key, ttl=60) == 1
+    time.sleep(0.01)
+    assert cache.cached("remote", lambda: 2, ttl=0.001) == 2
+
+    for i in range(5):
+        cache.cached("blob", lambda: bytes(1000), params={"i": i})
+        time.sleep(0.01)
+    entries = list((tmp_path / "cache").glob("*.pickle"))
+    assert sum(p.stat().st_size for p in entries) <= 3000
+    # The newest entry is kept
+    assert cache.path_for("blob", cache.key("blob", params={"i": 4})) in entries
+
+
+def test_fetch_stations_uses_cache(tmp_path, nta_polygons, station_points, monkeypatch):
+    job = Main(start_dir=tmp_path)
+    calls = []
+
+    def fake(name, value):
+        def stage(*args):
+            calls.append(name)
+            return value
+
+        monkeypatch.setattr(job.dp, name, stage)
+
+    fake("load_ntas", nta_polygons)
+    fake("fetch_station_info", station_points)
+    for _ in range(2):
+        fetched = job.fetch_stations()
+    assert calls == ["load_ntas", "fetch_station_info"]
+    assert list(fetched["stations"]["ntacode"].fillna("-")) == [
+        "MN17",
+        "MN15",
+        "MN24",
+        "-",
+    ]
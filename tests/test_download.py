@@ -0,0 +1,147 @@
+import hashlib
+import io
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from cbanalysis.download import Downloader
+from cbanalysis.main import Main
+from tests.conftest import make_rides
+
+
+def make_zip(month) -> bytes:
+    """A tripdata ZIP the way the bucket serves it"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        name = f"{month.replace('-', '')}-citibike-tripdata.csv"
+        zf.writestr(name, make_rides(n=2000, month=month).to_csv(index=False))
+    return buffer.getvalue()
+
+
+class TripdataHandler(BaseHTTPRequestHandler):
+    """Stand-in for the tripdata bucket that honors Range requests and sends MD5 ETags"""
+
+    files = {}
+    etags = {}
+    ranges = []
+
+    def do_GET(self):
+        name = self.path.lstrip("/")
+        if name not in self.files:
+            self.send_error(404)
+            return
+        body = self.files[name]
+        start = 0
+        if "Range" in self.headers:
+            start = int(self.headers["Range"][len("bytes=") : -1])
+            self.ranges.append((name, start))
+            if start >= len(body):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}"
+            )
+        else:
+            self.send_response(200)
+        etag = self.etags.get(name, hashlib.md5(body).hexdigest())
+        self.send_header("ETag", f'"{etag}"')
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def do_HEAD(self):
+        name = self.path.lstrip("/")
+        if name not in self.files:
+            self.send_error(404)
+            return
+        body = self.files[name]
+        self.send_response(200)
+        etag = self.etags.get(name, hashlib.md5(body).hexdigest())
+        self.send_header("ETag", f'"{etag}"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def bucket():
+    TripdataHandler.files = {
+        f"2022{m:0>2}-citibike-tripdata.csv.zip": make_zip(f"2022-{m:0>2}")
+        for m in [1, 2, 3]
+    }
+    TripdataHandler.etags = {}
+    TripdataHandler.ranges = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TripdataHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+
+
+def test_download_all(bucket, tmp_path):
+    downloader = Downloader(bucket, tmp_path, workers=3, block_size=4096)
+    names = list(TripdataHandler.files)
+    paths = downloader.download_all(names)
+    assert [p.read_bytes() for p in paths] == list(TripdataHandler.files.values())
+    assert TripdataHandler.ranges == []
+
+
+def test_resume_partial_and_truncated(bucket, tmp_path):
+    first, second = list(TripdataHandler.files)[:2]
+    (tmp_path / f"{first}.part").write_bytes(TripdataHandler.files[first][:1000])
+    # Older runs could leave a truncated file under the final name
+    (tmp_path / second).write_bytes(TripdataHandler.files[second][:500])
+
+    downloader = Downloader(bucket, tmp_path)
+    assert downloader.download(first).read_bytes() == TripdataHandler.files[first]
+    assert downloader.download(second).read_bytes() == TripdataHandler.files[second]
+    assert TripdataHandler.ranges == [(first, 1000), (second, 500)]
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_whole_part_is_checked(bucket, tmp_path):
+    first, second = list(TripdataHandler.files)[:2]
+    (tmp_path / f"{first}.part").write_bytes(TripdataHandler.files[first])
+    # Past the end of the file, so the server answers 416
+    (tmp_path / f"{second}.part").write_bytes(TripdataHandler.files[second] + b"x")
+
+    downloader = Downloader(bucket, tmp_path)
+    assert downloader.download(first).read_bytes() == TripdataHandler.files[first]
+    with pytest.raises(Exception, match="expected"):
+        downloader.download(second)
+    assert not (tmp_path / f"{second}.part").exists()
+
+
+def test_existing_file_rechecked(bucket, tmp_path):
+    name = list(TripdataHandler.files)[0]
+    downloader = Downloader(bucket, tmp_path)
+    downloader.download(name)
+    assert (tmp_path / f"{name}.meta").exists()
+    downloader.download(name)
+    assert TripdataHandler.ranges == []
+
+    # Replaced in the bucket: a new ETag, so it is downloaded again
+    TripdataHandler.files[name] = make_zip("2022-04")
+    assert downloader.download(name).read_bytes() == TripdataHandler.files[name]
+
+
+def test_checksum_mismatch(bucket, tmp_path):
+    name = list(TripdataHandler.files)[0]
+    TripdataHandler.etags[name] = "0" * 32
+    with pytest.raises(Exception, match="checksum"):
+        Downloader(bucket, tmp_path).download(name)
+    assert not list(tmp_path.iterdir())
+
+
+def test_fetch_months_from_bucket(bucket, tmp_path):
+    job = Main(start_dir=tmp_path, download_workers=3)
+    job.dp.URL_TRIPDATA = bucket
+    months = job.fetch_months("2022-01-01", "2022-03-01")
+    assert job.rides.months() == months
+    assert len(job.rides.read(months, columns=["ride_id"])) == 6000
@@ -0,0 +1,70 @@
+import pandas as pd
+
+from cbanalysis.flows import FlowMatrix
+from cbanalysis.main import Main
+from cbanalysis.reports import (
+    export_flow_index,
+    export_station_index,
+    read_flow_index,
+)
+from cbanalysis.stations import StationTable
+
+from cbserver import create_app
+
+
+def test_flows_match_groupby(tmp_path, rides_zip, station_geo):
+    job = Main(start_dir=tmp_path)
+    rides = job.dp.load_rename_rides(input_merged_rides=job.dp.concat_csvs())
+    stations = StationTable(station_geo)
+    rides = job.join_short_names(stations, rides)
+    flows = FlowMatrix.from_rides(rides, stations, by_hour=True)
+
+    pairs = rides.groupby(
+        ["start_short_name", "stop_short_name", "start_hour"], observed=True
+    ).size()
+    assert flows.matrix.sum() == pairs.sum()
+    origin, destination, hour = pairs.index[0]
+    cell = flows.matrix[
+        hour * len(stations) + stations.short_names.get_loc(origin),
+        stations.short_names.get_loc(destination),
+    ]
+    assert cell == pairs.iloc[0]
+
+    # Chunks add up to all rides
+    half = len(rides) // 2
+    merged = FlowMatrix.from_rides(rides.iloc[:half], stations, by_hour=True).merge(
+        FlowMatrix.from_rides(rides.iloc[half:], stations, by_hour=True)
+    )
+    assert (merged.matrix != flows.matrix).nnz == 0
+
+    ntas = flows.to_ntas()
+    by_nta = pd.crosstab(
+        pd.Series(stations.ntacode(rides["start_station_code"].to_numpy())),
+        pd.Series(stations.ntacode(rides["stop_station_code"].to_numpy())),
+    )
+    assert ntas.row(ntas.names.get_loc("MN15")).sum() == by_nta.loc["MN15"].sum()
+
+
+def test_top_destinations_from_index(tmp_path, rides_zip, station_geo):
+    job = Main(start_dir=tmp_path)
+    rides = job.dp.load_rename_rides(input_merged_rides=job.dp.concat_csvs())
+    summary = job.summarize(station_geo, rides)
+    flows = summary["flows"]
+    path = export_flow_index(flows, tmp_path / "flows.idx")
+    loaded = read_flow_index(path)
+    assert (loaded.matrix != flows.matrix).nnz == 0
+
+    index = export_station_index(
+        summary["hourly"], station_geo, summary["ranking"], tmp_path / "stations.idx"
+    )
+    client = create_app(
+        {"STATION_FLOWS": str(path), "STATION_INDEX": str(index)}
+    ).test_client()
+    expected = flows.top_destinations("6926.01", k=2)
+    data = client.get("/api/destinations?short_name=6926.01&k=2").get_json()["data"]
+    assert [(row["destination"], row["trips"]) for row in data] == expected
+    data = client.get("/api/destinations?short_name=6926.01&hour=8").get_json()["data"]
+    assert [(row["destination"], row["trips"]) for row in data] == (
+        flows.top_destinations("6926.01", hour=8)
+    )
+    assert client.get("/api/destinations?short_name=nope").status_code == 404
@@ -0,0 +1,50 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from cbanalysis.data_prep import Prepper
+from cbanalysis.ntas import NtaAssigner
+
+
+def test_assign_stations_like_sjoin(nta_polygons, station_points):
+    expected = gpd.sjoin(station_points, nta_polygons, how="left")
+    assigned = NtaAssigner(nta_polygons).assign_stations(station_points)
+    assert list(assigned.columns) == [
+        "station_id",
+        "short_name",
+        "legacy_id",
+        "name",
+        "boroname",
+        "ntaname",
+        "ntacode",
+        "geometry",
+    ]
+    pd.testing.assert_series_equal(
+        assigned["ntacode"], expected["ntacode"].reset_index(drop=True)
+    )
+
+
+def test_only_new_stations_are_looked_up(tmp_path, nta_polygons, station_points):
+    assigner = NtaAssigner.from_parquet(
+        NtaAssigner(nta_polygons).to_parquet(tmp_path / "ntas.parquet")
+    )
+    path = tmp_path / "station_ntas.parquet"
+    first = assigner.assign_stations(station_points.iloc[:2], path=path)
+
+    looked_up = []
+    lookup = assigner.lookup
+    assigner.lookup = lambda lng, lat: looked_up.append(len(lng)) or lookup(lng, lat)
+    second = assigner.assign_stations(station_points, path=path)
+    assert looked_up == [2]
+    pd.testing.assert_frame_equal(second.iloc[:2], first)
+    assert second["ntacode"].iloc[2] == "MN24"
+
+
+def test_lookup_points(nta_polygons):
+    lat = [40.705, 40.705, np.nan, 40.705]
+    lng = [-73.985, -73.5, -73.985, -73.995]
+    assigner = NtaAssigner(nta_polygons)
+    rows = assigner.lookup(lng, lat)
+    assert list(rows[1:3]) == [-1, -1]
+    ntas = assigner.take(rows)["ntacode"]
+    assert list(ntas.fillna("-")) == ["MN15", "-", "-", "MN17"]
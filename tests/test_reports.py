@@ -0,0 +1,67 @@
+import json
+
+import msgpack
+import numpy as np
+import pandas as pd
+
+from cbanalysis.reports import (
+    export_columnar_report,
+    export_report,
+    iter_records,
+    read_columnar_report,
+    station_groups,
+)
+
+
+def test_export_report_matches_dict_export(tmp_path):
+    df = pd.DataFrame(
+        {
+            "short_name": pd.Categorical(["6926.01", "5329.03", "6926.01"]),
+            "start_hour": [1, 0, 0],
+            "counts": [3, 1, 2],
+            "mean_rides": [1.5, 0.5, float("nan")],
+        }
+    )
+    expected = {
+        short_name: data.to_dict(orient="records")
+        for short_name, data in df.groupby("short_name")
+    }
+    export_report(*station_groups(df), tmp_path / "hourly.json", tmp_path / "hourly.mp")
+    assert (tmp_path / "hourly.json").read_text() == json.dumps(expected)
+    assert (tmp_path / "hourly.mp").read_bytes() == msgpack.packb(expected)
+
+    records = df.to_dict(orient="records")
+    export_report(
+        iter_records(df), len(df), tmp_path / "r.json", tmp_path / "r.mp", mapping=False
+    )
+    assert (tmp_path / "r.json").read_text() == json.dumps(records)
+    assert (tmp_path / "r.mp").read_bytes() == msgpack.packb(records)
+
+
+def test_columnar_report_round_trip(tmp_path):
+    df = pd.DataFrame(
+        {
+            "short_name": ["6926.01"] * 24 + ["5329.03"] * 24,
+            "start_hour": list(range(24)) * 2,
+            "counts": range(48),
+            "mean_rides": np.arange(48) / 4,
+        }
+    )
+    weekday = df.loc[df["start_hour"] == 8].assign(start_weekday=[0, 6])
+    paths = export_columnar_report(
+        df, tmp_path / "hourly.cbr", df_weekday_hourly=weekday, compression=["gzip"]
+    )
+    assert [p.name for p in paths] == ["hourly.cbr", "hourly.cbr.gz"]
+    for path in paths:
+        report = read_columnar_report(path)
+        assert report["stations"] == ["5329.03", "6926.01"]
+        assert report["counts"].dtype == np.dtype("<u4")
+        assert report["counts"][0].tolist() == list(range(24, 48))
+        assert report["mean_rides"][1, 2] == 0.5
+        assert report["weekday_counts"].shape == (2, 7, 24)
+        assert report["weekday_counts"][0, 6, 8] == 32
+
+    # Far smaller than the same data as records
+    export_report(*station_groups(df), tmp_path / "h.json", tmp_path / "h.msgpack")
+    path = export_columnar_report(df, tmp_path / "h.cbr")[0]
+    assert path.stat().st_size < (tmp_path / "h.msgpack").stat().st_size / 4
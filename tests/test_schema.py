@@ -0,0 +1,109 @@
+import pandas as pd
+import pytest
+
+from cbanalysis.main import Main
+from cbanalysis.schema import (
+    SCHEMA_2013,
+    SCHEMA_2021,
+    detect_schema,
+    parse_times,
+    read_trip_csv,
+)
+from tests.conftest import make_legacy_rides, make_rides
+
+
+@pytest.fixture
+def trips_path(tmp_path):
+    rides = make_rides(n=1000)
+    # Some months write fractional seconds
+    rides.loc[::3, "started_at"] = rides.loc[::3, "started_at"] + ".392"
+    path = tmp_path / "202201-citibike-tripdata.csv"
+    rides.to_csv(path, index=False)
+    return path
+
+
+@pytest.mark.parametrize("engine", ["pandas", "pyarrow"])
+def test_read_trip_csv_dtypes(trips_path, engine):
+    (df,) = read_trip_csv(trips_path, SCHEMA_2021, engine=engine)
+    assert df.shape == (1000, 13)
+    assert df["start_station_id"].dtype == "category"
+    assert df["start_lat"].dtype == "float32"
+    assert df["started_at"].dtype == "datetime64[ns]"
+    assert df["started_at"].iloc[0].microsecond == 392000
+
+
+def test_parse_times_per_value():
+    values = pd.Series(["2022-01-01 08:00:00", "2022-01-01 08:00:00.5", None])
+    parsed = parse_times(values, SCHEMA_2021.date_formats)
+    assert parsed.iloc[1] == pd.Timestamp("2022-01-01 08:00:00.5")
+    assert pd.isna(parsed.iloc[2])
+    # Nothing is inferred: a value in an undeclared format is an error
+    with pytest.raises(Exception, match="fit no declared format"):
+        parse_times(pd.Series(["01/01/2022 08:00"]), SCHEMA_2021.date_formats)
+
+
+def test_engines_agree_in_chunks(trips_path):
+    by_engine = {
+        engine: pd.concat(
+            read_trip_csv(trips_path, SCHEMA_2021, chunksize=100, engine=engine),
+            ignore_index=True,
+        )
+        for engine in ["pandas", "pyarrow"]
+    }
+    pd.testing.assert_frame_equal(
+        by_engine["pandas"],
+        by_engine["pyarrow"],
+        check_dtype=False,
+        check_categorical=False,
+    )
+
+
+def test_detect_schema():
+    legacy = list(make_legacy_rides(n=1).columns)
+    assert detect_schema(list(make_rides(n=1).columns)) is SCHEMA_2021
+    assert detect_schema(legacy) is SCHEMA_2013
+    # 2016-2017 files capitalize the headers
+    assert detect_schema([c.title() for c in legacy]) is SCHEMA_2013
+    with pytest.raises(Exception):
+        detect_schema(["tripduration", "starttime"])
+
+
+def test_legacy_rides_normalize_like_new_rides(tmp_path, station_geo):
+    """The same rides in either layout summarize the same way"""
+    job = Main(start_dir=tmp_path)
+    legacy_path = tmp_path / "201906-citibike-tripdata.csv"
+    new_path = tmp_path / "201906-new-layout.csv"
+    make_legacy_rides(month="2019-06").to_csv(legacy_path, index=False)
+    make_rides(month="2019-06").to_csv(new_path, index=False)
+
+    legacy = job.dp.concat_csvs(glob_string=str(legacy_path))
+    new = job.dp.concat_csvs(glob_string=str(new_path))
+    assert list(legacy.columns) == list(new.columns)
+    assert legacy["started_at"].equals(new["started_at"])
+    assert legacy["member_casual"].astype(str).equals(new["member_casual"].astype(str))
+    assert set(legacy["gender"]) == {"unknown", "male", "female"}
+    # Newer files have no gender, which is missing rather than "unknown"
+    assert new["gender"].isna().all()
+    assert set(legacy["rideable_type"]) == {"classic_bike"}
+    assert legacy["birth_year"].isna().any()
+
+    summaries = [
+        job.summarize(station_geo, job.dp.load_rename_rides(input_merged_rides=df))
+        for df in [legacy, new]
+    ]
+    pd.testing.assert_frame_equal(summaries[0]["hourly"], summaries[1]["hourly"])
+    pd.testing.assert_frame_equal(summaries[0]["ranking"], summaries[1]["ranking"])
+
+
+def test_prep_keeps_zero_hours(tmp_path):
+    """Date parts are int8 and the gender mapping leaves other columns alone"""
+    job = Main(start_dir=tmp_path)
+    path = tmp_path / "201906-citibike-tripdata.csv"
+    make_legacy_rides(month="2019-06").to_csv(path, index=False)
+    rides = job.dp.load_rename_rides(input_merged_rides=job.dp.concat_csvs(str(path)))
+
+    assert rides["start_hour"].dtype == "int8"
+    assert (rides["start_hour"] == rides["start_time"].dt.hour).all()
+    assert (rides["stop_weekday"] == rides["stop_time"].dt.dayofweek).all()
+    assert rides["gender"].dtype == "category"
+    assert set(rides["gender"].cat.categories) == {"unknown", "male", "female"}
@@ -0,0 +1,208 @@
+import geopandas as gpd
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+from cbanalysis import reports
+from cbanalysis.reports import (
+    export_hourly_sql,
+    export_station_index,
+    export_stations_sql,
+)
+
+from cbserver import ResponseCache, create_app
+
+
+def hourly(scale=1) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "short_name": ["6926.01"] * 24 + ["5329.03"] * 24,
+            "start_hour": list(range(24)) * 2,
+            "counts": [h * scale for h in range(48)],
+            "mean_rides": 0.5,
+        }
+    )
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    conn = f"sqlite:///{tmp_path / 'summary.db'}"
+    monkeypatch.setenv("SQLALCHEMY_CONN", conn)
+    return conn
+
+
+def test_export_indexes_short_name(database):
+    assert export_hourly_sql(hourly(), conn=database) == 48
+    engine = sa.create_engine(database)
+    indexes = sa.inspect(engine).get_indexes("summary_hourly")
+    assert ["short_name"] in [ix["column_names"] for ix in indexes]
+    # Written station by station
+    with engine.connect() as connection:
+        rows = connection.execute(sa.text("SELECT short_name FROM summary_hourly"))
+        short_names = [row.short_name for row in rows]
+    assert short_names[23:25] == ["5329.03", "6926.01"]
+
+    # Exporting again swaps in new tables, leaving no staging tables behind
+    export_hourly_sql(hourly(scale=2), conn=database)
+    tables = sa.inspect(engine).get_table_names()
+    assert not [t for t in tables if t.endswith("_staging")]
+    with engine.connect() as connection:
+        total = connection.execute(sa.text("SELECT sum(counts) FROM summary_hourly"))
+        assert total.scalar() == 2 * sum(range(48))
+
+
+def test_failed_export_keeps_live_tables(database, monkeypatch):
+    export_hourly_sql(hourly(), conn=database)
+
+    def fail(connection):
+        raise Exception("export interrupted")
+
+    # Fails after the swap, inside the same transaction
+    monkeypatch.setattr(reports, "record_export", fail)
+    with pytest.raises(Exception, match="interrupted"):
+        export_hourly_sql(hourly(scale=2), conn=database)
+    engine = sa.create_engine(database)
+    tables = sa.inspect(engine).get_table_names()
+    assert not [t for t in tables if t.endswith("_staging")]
+    with engine.connect() as connection:
+        total = connection.execute(sa.text("SELECT sum(counts) FROM summary_hourly"))
+        assert total.scalar() == sum(range(48))
+
+
+def test_hourly_serves_cached_responses(database):
+    export_hourly_sql(hourly(), conn=database)
+    app = create_app({"RESPONSE_CACHE_SECONDS": 0})
+    client = app.test_client()
+
+    data = client.get("/api/hourly?short_name=6926.01").get_json()["data"]
+    assert data[:2] == [{"start_hour": 0, "counts": 0}, {"start_hour": 1, "counts": 1}]
+    assert client.get("/api/hourly").status_code == 204
+
+    # A new export replaces what the worker has cached
+    export_hourly_sql(hourly(scale=2), conn=database)
+    data = client.get("/api/hourly?short_name=6926.01").get_json()["data"]
+    assert data[1] == {"start_hour": 1, "counts": 2}
+    assert client.get("/api/hourly?short_name=0000.00").status_code == 404
+
+
+def test_response_cache_is_bounded():
+    loads = []
+
+    def load(key):
+        loads.append(key)
+        return None if key == "empty" else f"body of {key}"
+
+    cache = ResponseCache(
+        lambda: "export", known_keys=lambda: ["a", "b", "c", "empty"], max_entries=2
+    )
+    assert [cache.get(key, load) for key in ["a", "b", "a", "c"]] == [
+        "body of a",
+        "body of b",
+        "body of a",
+        "body of c",
+    ]
+    # b was the least recently used
+    assert list(cache.bodies) == ["a", "c"]
+    # Unknown keys never load, and keys without a body load once
+    assert cache.get("unknown", load) is None
+    assert cache.get("empty", load) is None
+    assert cache.get("empty", load) is None
+    assert loads == ["a", "b", "c", "empty"]
+
+
+def station_geo() -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame(
+        {
+            "station_id": ["a", "b", "c", "d"],
+            "short_name": ["6926.01", "6822.09", "5329.03", "4000.01"],
+            "name": ["W 52 St", "1 Ave", "W 47 St", "Pier 1"],
+            "ntacode": ["MN15", "MN15", "MN15", None],
+            "ntaname": ["Clinton", "Clinton", "Clinton", None],
+            "boroname": ["Manhattan", "Manhattan", "Manhattan", None],
+        },
+        geometry=gpd.points_from_xy([-73.99, -73.98, -73.97, -74.0], [40.76] * 4),
+    )
+
+
+def rankings() -> pd.DataFrame:
+    return pd.DataFrame(
+        {"ntacode": "MN15", "station_rank": [2, 1], "stations_count": 3},
+        index=pd.Index(["6926.01", "6822.09"], name="start_short_name"),
+    )
+
+
+def test_station_and_nta_lookups(database):
+    assert export_stations_sql(station_geo(), rankings(), conn=database) == 4
+    engine = sa.create_engine(database)
+    indexes = sa.inspect(engine).get_indexes("summary_stations")
+    assert {"short_name", "ntacode"} == {ix["column_names"][0] for ix in indexes}
+
+    client = create_app().test_client()
+    data = client.get("/api/ranking?short_name=6926.01").get_json()["data"]
+    assert data["ntaname"] == "Clinton"
+    assert (data["station_rank"], data["stations_count"]) == (2, 3)
+    assert data["lng"] == pytest.approx(-73.99)
+    assert client.get("/api/ranking?short_name=5329.03").status_code == 404
+
+    data = client.get("/api/nta?ntacode=MN15").get_json()["data"]
+    assert [row["short_name"] for row in data] == ["6822.09", "6926.01", "5329.03"]
+    assert client.get("/api/nta?ntacode=BK09").status_code == 404
+
+
+def test_file_backed_mode(tmp_path):
+    path = export_station_index(
+        hourly(), station_geo(), rankings(), tmp_path / "stations.idx"
+    )
+    client = create_app({"STATION_INDEX": str(path)}).test_client()
+
+    data = client.get("/api/hourly?short_name=6926.01").get_json()["data"]
+    assert len(data) == 24
+    assert data[1] == {"start_hour": 1, "counts": 1}
+    assert client.get("/api/ranking?short_name=6926.01").get_json()["data"] == {
+        "short_name": "6926.01",
+        "name": "W 52 St",
+        "ntacode": "MN15",
+        "ntaname": "Clinton",
+        "boroname": "Manhattan",
+        "station_rank": 2,
+        "stations_count": 3,
+        "lng": -73.99,
+        "lat": 40.76,
+    }
+    assert client.get("/api/ranking?short_name=5329.03").status_code == 404
+    data = client.get("/api/nta?ntacode=MN15").get_json()["data"]
+    assert [row["short_name"] for row in data] == ["6822.09", "6926.01", "5329.03"]
+    assert data[2] == {
+        "short_name": "5329.03",
+        "name": "W 47 St",
+        "station_rank": None,
+        "lng": -73.97,
+        "lat": 40.76,
+    }
+
+    # A new export is picked up without restarting
+    export_station_index(hourly(scale=2), station_geo(), rankings(), path)
+    data = client.get("/api/hourly?short_name=6926.01").get_json()["data"]
+    assert data[1] == {"start_hour": 1, "counts": 2}
+
+
+def test_routes_match_across_modes(database, tmp_path):
+    """The database and the index file answer every station route alike"""
+    export_hourly_sql(hourly(), conn=database)
+    export_stations_sql(station_geo(), rankings(), conn=database)
+    path = export_station_index(
+        hourly(), station_geo(), rankings(), tmp_path / "stations.idx"
+    )
+    from_db = create_app().test_client()
+    from_file = create_app({"STATION_INDEX": str(path)}).test_client()
+
+    urls = [
+        f"/api/{route}?short_name={short_name}"
+        for route in ["hourly", "ranking"]
+        for short_name in ["6926.01", "5329.03", "4000.01", "0000.00"]
+    ]
+    urls += [f"/api/nta?ntacode={ntacode}" for ntacode in ["MN15", "BK09"]]
+    for url in urls:
+        db_response, file_response = from_db.get(url), from_file.get(url)
+        assert db_response.status_code == file_response.status_code
+        assert db_response.get_json() == file_response.get_json()
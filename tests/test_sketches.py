@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from cbanalysis.main import Main
+from cbanalysis.reports import export_sketches, read_sketches
+from cbanalysis.sketches import StationSketches
+from cbanalysis.stations import StationTable
+
+
+def test_sketches_approximate_exact_summaries(tmp_path, rides_zip, station_geo):
+    job = Main(start_dir=tmp_path)
+    rides = job.dp.load_rename_rides(input_merged_rides=job.dp.concat_csvs())
+    stations = StationTable(station_geo)
+    rides = job.join_short_names(stations, rides)
+    sketches = StationSketches.from_rides(rides, stations)
+    assert [str(month) for month in sketches.months] == ["2022-01", "2022-02"]
+
+    # Chunks merge into the same sketches as all rides, and survive a round trip
+    half = len(rides) // 2
+    merged = StationSketches.from_rides(rides.iloc[:half], stations).merge(
+        StationSketches.from_rides(rides.iloc[half:], stations)
+    )
+    loaded = read_sketches(export_sketches(merged, tmp_path / "sketches.msgpack"))
+    pd.testing.assert_frame_equal(loaded.distinct(), sketches.distinct())
+
+    # Post-2021 rides have no bike ids, so there is nothing to sketch
+    assert loaded.distinct()["distinct_bikes"].isna().all()
+    january = rides[rides["start_time"].dt.month == 1]
+    bikes = january.assign(bike_id=january["ride_id"].str[:6])
+    exact = bikes.groupby("start_short_name", observed=True)["bike_id"].nunique()
+    distinct = StationSketches.from_rides(bikes, stations).distinct()
+    estimate = distinct.loc[exact.index, "distinct_bikes"]
+    # About 3% standard error with 2 ** 10 registers
+    assert np.allclose(estimate, exact, rtol=0.1)
+
+    quantiles = loaded.duration_quantiles(q=[0.5], months=["2022-01"])
+    seconds = (january["stop_time"] - january["start_time"]).dt.total_seconds()
+    exact = seconds.groupby(
+        [january["start_short_name"].astype(str), january["start_hour"]]
+    ).quantile(0.5, interpolation="lower")
+    both = quantiles.set_index(["short_name", "start_hour"])["p50"]
+    assert np.allclose(both.loc[exact.index], exact, rtol=0.03)
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from cbanalysis.stations import StationTable
+
+
+def test_encode_short_names_and_legacy_ids(station_geo):
+    stations = StationTable(station_geo)
+    ids = pd.Series(["6926.01", "79", "unknown", None, "JC013"])
+    for values in (ids, ids.astype("category")):
+        codes = stations.encode(values)
+        assert codes.dtype == np.int32
+        assert list(
+            pd.Series(stations.short_name(codes), dtype=object).fillna("-")
+        ) == [
+            "6926.01",
+            "6926.01",
+            "-",
+            "-",
+            "JC013",
+        ]
+    assert list(stations.ntacode(codes[[0, 4]])) == ["MN15", "MN15"]
@@ -0,0 +1,321 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cbanalysis.cube import WEEKEND, CountCube
+from cbanalysis.duckdb_backend import DuckDBSummarizer
+from cbanalysis.main import Main
+from cbanalysis.stations import StationTable
+from cbanalysis.summarize import Summarizer
+from cbanalysis.utils import days_in_months, months_in_range
+
+
+@pytest.fixture
+def main_job(tmp_path):
+    return Main(start_dir=tmp_path)
+
+
+def test_streaming_matches_in_memory(main_job, rides_zip, station_geo):
+    """Chunked summaries agree with summaries of the fully concatenated rides"""
+    days = days_in_months(months_in_range("2022-01-01", "2022-02-01"))
+    rides = main_job.dp.load_rename_rides(input_merged_rides=main_job.dp.concat_csvs())
+    in_memory = main_job.summarize(station_geo, rides, days=days)
+    chunks = main_job.dp.iter_prepped_rides(chunksize=97)
+    streamed = main_job.summarize_chunks(station_geo, chunks, days=days)
+
+    pd.testing.assert_frame_equal(
+        in_memory["hourly"], streamed["hourly"], check_dtype=False, check_like=True
+    )
+    pd.testing.assert_frame_equal(
+        in_memory["ranking"].sort_index(),
+        streamed["ranking"].sort_index(),
+        check_like=True,
+    )
+
+
+def test_incremental_reuses_partials(main_job, rides_zip, station_geo, monkeypatch):
+    """Months already in the partials store are not read again"""
+    monkeypatch.setattr(main_job.dp, "download_ride_zips", lambda months: [])
+    days = days_in_months(months_in_range("2022-01-01", "2022-02-01"))
+    streamed = main_job.summarize_chunks(
+        station_geo, main_job.dp.iter_prepped_rides(chunksize=97), days=days
+    )
+    first = main_job.summarize_incremental(station_geo, "2022-01-01", "2022-02-01")
+    assert len(main_job.partials.months()) == 2
+    # Only the summaries are stored; hourly and ranking are rolled up from the cube
+    assert not list(main_job.partials.path.glob("*.parquet"))
+
+    for archive in rides_zip.glob("*.zip"):
+        archive.unlink()
+    second = main_job.summarize_incremental(station_geo, "2022-01-01", "2022-02-01")
+    for result in (first, second):
+        pd.testing.assert_frame_equal(result["hourly"], streamed["hourly"])
+        pd.testing.assert_frame_equal(result["ranking"], streamed["ranking"])
+        assert (result["cube"].counts == streamed["cube"].counts).all()
+        assert (result["flows"].matrix != streamed["flows"].matrix).nnz == 0
+        pd.testing.assert_frame_equal(
+            result["sketches"].duration_quantiles(),
+            streamed["sketches"].duration_quantiles(),
+        )
+        pd.testing.assert_frame_equal(
+            result["trips"].to_frame(), streamed["trips"].to_frame()
+        )
+
+    # A new NTA assignment only changes the roll-ups, not the stored months
+    moved = station_geo.assign(ntacode=station_geo["ntacode"].iloc[::-1].to_numpy())
+    third = main_job.summarize_incremental(moved, "2022-01-01", "2022-02-01")
+    expected = main_job.summarize_chunks(
+        moved, main_job.rides.iter_batches(main_job.rides.months()), days=days
+    )
+    pd.testing.assert_frame_equal(third["ranking"], expected["ranking"])
+
+    # A ride id that now names another station has its months recounted
+    swapped = station_geo.assign(
+        legacy_id=station_geo["legacy_id"].iloc[::-1].to_numpy()
+    )
+    months = months_in_range("2022-01-01", "2022-02-01")
+    assert main_job.stored_months(months, StationTable(swapped)) == []
+
+
+def test_incremental_keeps_months_for_new_stations(
+    main_job, rides_zip, station_geo, monkeypatch
+):
+    """A station added to the feed between runs doesn't recount stored months"""
+    monkeypatch.setattr(main_job.dp, "download_ride_zips", lambda months: [])
+    main_job.summarize_incremental(station_geo, "2022-01-01", "2022-01-01")
+    counted = []
+    count_chunks = main_job.count_chunks
+
+    def counting(df_station_geo, chunks, merged=None):
+        chunks = list(chunks)
+        counted.append(min(chunk["start_time"].min() for chunk in chunks))
+        return count_chunks(df_station_geo, chunks, merged=merged)
+
+    monkeypatch.setattr(main_job, "count_chunks", counting)
+    # The new station sorts first, so every other station moves up a code
+    grown = pd.concat(
+        [
+            station_geo.iloc[:1].assign(
+                station_id="id-0001.01", short_name="0001.01", legacy_id="1"
+            ),
+            station_geo,
+        ],
+        ignore_index=True,
+    )
+    result = main_job.summarize_incremental(grown, "2022-01-01", "2022-02-01")
+    assert [month.month for month in counted] == [2]
+
+    days = days_in_months(months_in_range("2022-01-01", "2022-02-01"))
+    expected = main_job.summarize_chunks(
+        grown, main_job.rides.iter_batches(main_job.rides.months()), days=days
+    )
+    pd.testing.assert_frame_equal(result["hourly"], expected["hourly"])
+    pd.testing.assert_frame_equal(result["ranking"], expected["ranking"])
+    assert (result["cube"].counts == expected["cube"].counts).all()
+    assert (result["flows"].matrix != expected["flows"].matrix).nnz == 0
+    pd.testing.assert_frame_equal(
+        result["sketches"].duration_quantiles(),
+        expected["sketches"].duration_quantiles(),
+    )
+    pd.testing.assert_frame_equal(
+        result["trips"].to_frame(), expected["trips"].to_frame()
+    )
+
+
+def test_ride_cache_skips_csvs(main_job, rides_zip, monkeypatch):
+    """Cached months are read back from Parquet without the CSVs"""
+    monkeypatch.setattr(main_job.dp, "download_ride_zips", lambda months: [])
+    months = main_job.fetch_months("2022-01-01", "2022-02-01")
+    first = main_job.rides.read(months)
+
+    for archive in rides_zip.glob("*.zip"):
+        archive.unlink()
+    months = main_job.fetch_months("2022-01-01", "2022-02-01", chunksize=97)
+    assert main_job.rides.months() == months
+    pd.testing.assert_frame_equal(main_job.rides.read(months), first)
+
+    subset = main_job.rides.read(months[1:], columns=["start_time", "start_hour"])
+    assert list(subset.columns) == ["start_time", "start_hour"]
+    assert subset["start_hour"].dtype == "int8"
+    assert (subset["start_time"].dt.month == 2).all()
+
+
+def test_run_caches_summaries_by_settings(
+    main_job, rides_zip, station_geo, monkeypatch
+):
+    """A rerun reuses the summaries until a setting that changes them does"""
+    monkeypatch.setattr(main_job.dp, "download_ride_zips", lambda months: [])
+    monkeypatch.setattr(main_job, "fetch_stations", lambda: {"stations": station_geo})
+    monkeypatch.setattr(main_job, "export", lambda *args, **kwargs: None)
+    calls = []
+    summarize_months = main_job.summarize_months
+
+    def counted(*args):
+        calls.append(args)
+        return summarize_months(*args)
+
+    monkeypatch.setattr(main_job, "summarize_months", counted)
+    for _ in range(2):
+        main_job.run("2022-01-01", "2022-02-01")
+    assert len(calls) == 1
+
+    main_job.trip_bounds = {"duration": (600.0, 3000.0), "distance": (0.0, 10_000.0)}
+    main_job.run("2022-01-01", "2022-02-01")
+    assert len(calls) == 2
+    main_job.run("2022-01-01", "2022-02-01", chunksize=97)
+    assert len(calls) == 3
+    main_job.engine = main_job.dp.engine = "pyarrow"
+    main_job.run("2022-01-01", "2022-02-01", chunksize=97)
+    assert len(calls) == 4
+
+
+def grouped_by_hour(rides, orient, days, by_weekday=False) -> pd.DataFrame:
+    """The hourly (or weekday and hourly) profile of every station with
+    rides, by a plain groupby, in the layout of CountCube.by_hour"""
+    names = rides[f"{orient}_short_name"].astype(object)
+    times = rides[f"{orient}_time"].dt
+    parts = [times.weekday, times.hour] if by_weekday else [times.hour]
+    counts = rides.groupby([names, *parts]).size()
+    levels = [sorted(names.dropna().unique()), range(7), range(24)]
+    full = pd.MultiIndex.from_product(levels if by_weekday else levels[::2])
+    counts = counts.reindex(full, fill_value=0)
+    df = pd.DataFrame({"short_name": full.get_level_values(0)})
+    if by_weekday:
+        df[f"{orient}_weekday"] = full.get_level_values(1)
+        per_day = np.bincount(days.weekday, minlength=7)[df[f"{orient}_weekday"]]
+    else:
+        per_day = len(days)
+    df[f"{orient}_hour"] = full.get_level_values(-1)
+    df["counts"] = counts.to_numpy()
+    df["mean_rides"] = df["counts"] / per_day
+    return df
+
+
+def test_duckdb_matches_pandas(main_job, rides_zip, station_geo, monkeypatch):
+    """DuckDB over the ride cache gives the same summaries as pandas"""
+    monkeypatch.setattr(main_job.dp, "download_ride_zips", lambda months: [])
+    months = main_job.fetch_months("2022-01-01", "2022-02-01")
+    days = days_in_months(months)
+    expected = main_job.summarize(station_geo, main_job.rides.read(months), days=days)
+    duck = DuckDBSummarizer(main_job.paths, threads=2).summarize(
+        main_job.rides.files(months), station_geo, days=days
+    )
+    pd.testing.assert_frame_equal(duck["hourly"], expected["hourly"])
+    # The mergeable summaries are GROUP BY queries too, without a pass in pandas
+    main_job.backend = "duckdb"
+    monkeypatch.setattr(main_job.rides, "iter_batches", None)
+    duck = main_job.summarize_months(station_geo, months)
+    assert (duck["cube"].counts == expected["cube"].counts).all()
+    assert (duck["cube"].months == expected["cube"].months).all()
+    assert (duck["flows"].matrix != expected["flows"].matrix).nnz == 0
+    pd.testing.assert_frame_equal(
+        duck["sketches"].duration_quantiles(), expected["sketches"].duration_quantiles()
+    )
+    pd.testing.assert_frame_equal(
+        duck["sketches"].distinct(), expected["sketches"].distinct()
+    )
+    pd.testing.assert_frame_equal(
+        duck["trips"].to_frame(), expected["trips"].to_frame(), rtol=1e-4
+    )
+    pd.testing.assert_frame_equal(duck["ranking"], expected["ranking"])
+
+    # A short name listed twice keeps its first station, as in StationTable
+    twice = pd.concat([station_geo, station_geo.iloc[:1].assign(ntacode="XX99")])
+    expected = main_job.summarize(twice, main_job.rides.read(months), days=days)
+    duck = DuckDBSummarizer(main_job.paths, threads=2).summarize(
+        main_job.rides.files(months), twice, days=days
+    )
+    pd.testing.assert_frame_equal(duck["ranking"], expected["ranking"])
+
+
+def test_parallel_matches_serial(tmp_path, rides_zip, station_geo):
+    """Months counted in worker processes give the serial summaries"""
+    job = Main(start_dir=tmp_path, workers=2)
+    parallel = job.summarize_parallel(
+        station_geo, "2022-01-01", "2022-02-01", incremental=True
+    )
+    assert len(job.partials.months()) == 2
+
+    months = months_in_range("2022-01-01", "2022-02-01")
+    serial = job.summarize(
+        station_geo, job.rides.read(months), days=days_in_months(months)
+    )
+    pd.testing.assert_frame_equal(parallel["hourly"], serial["hourly"])
+    assert (parallel["cube"].counts == serial["cube"].counts).all()
+    assert (parallel["flows"].matrix != serial["flows"].matrix).nnz == 0
+    pd.testing.assert_frame_equal(
+        parallel["sketches"].distinct(), serial["sketches"].distinct()
+    )
+    pd.testing.assert_frame_equal(
+        parallel["trips"].to_frame(), serial["trips"].to_frame()
+    )
+    pd.testing.assert_frame_equal(parallel["ranking"], serial["ranking"])
+
+
+def test_cube_rollups_match_direct_summaries(main_job, rides_zip, station_geo):
+    """Views of the cube agree with summarizing the matching rides directly"""
+    days = days_in_months(months_in_range("2022-01-01", "2022-02-01"))
+    rides = main_job.dp.load_rename_rides(input_merged_rides=main_job.dp.concat_csvs())
+    stations = StationTable(station_geo)
+    rides = main_job.join_short_names(stations, rides)
+    cube = CountCube.from_rides(rides, stations, days=days)
+
+    for orient in ["start", "stop"]:
+        pd.testing.assert_frame_equal(
+            cube.by_hour(orient),
+            grouped_by_hour(rides, orient, days),
+            check_dtype=False,
+        )
+    pd.testing.assert_frame_equal(
+        cube.by_weekday_hour("start"),
+        grouped_by_hour(rides, "start", days, by_weekday=True),
+        check_dtype=False,
+    )
+    february = rides[rides["start_time"].dt.month == 2]
+    pd.testing.assert_frame_equal(
+        cube.by_hour("start", months=["2022-02"]),
+        grouped_by_hour(february, "start", days[days.month == 2]),
+        check_dtype=False,
+    )
+    weekend = rides[rides["start_weekday"] >= 5]
+    pd.testing.assert_frame_equal(
+        cube.by_hour("start", weekdays=WEEKEND),
+        grouped_by_hour(weekend, "start", days[days.weekday >= 5]),
+        check_dtype=False,
+    )
+
+    # Cubes of chunks add up to the cube of all rides
+    half = len(rides) // 2
+    merged = CountCube.from_rides(rides.iloc[half:], stations).merge(
+        CountCube.from_rides(rides.iloc[:half], stations)
+    )
+    assert (merged.months == cube.months).all()
+    assert (merged.counts == cube.counts).all()
+    # Chunks of known months are added in place; others grow the month axis
+    for months in (["2022-01", "2022-02"], ["2022-01"]):
+        added = CountCube.empty(stations.short_names, months)
+        preallocated = added.counts
+        for part in (rides.iloc[:half], rides.iloc[half:]):
+            added.add(CountCube.from_rides(part, stations))
+        assert (added.counts is preallocated) == (len(months) == 2)
+        assert (added.months == cube.months).all()
+        assert (added.counts == cube.counts).all()
+    assert cube.by_month("start")["counts"].sum() == len(rides)
+
+
+def test_rank_station_totals(tmp_path):
+    """Dense ranks within each NTA, most rides first; unridden stations are left out"""
+    stations = StationTable(
+        pd.DataFrame(
+            {
+                "short_name": ["a", "b", "c", "d", "e"],
+                "ntacode": ["MN15", "MN15", "MN15", "BK09", None],
+            }
+        )
+    )
+    per_nta = pd.DataFrame({"ntacode": ["BK09", "MN15"], "stations_count": [1, 3]})
+    ranking = Summarizer(paths=tmp_path).rank_station_totals(
+        [5, 9, 5, 0, 7], stations, per_nta
+    )
+    assert ranking["station_rank"].to_dict() == {"b": 1, "a": 2, "c": 2}
+    assert (ranking["stations_count"] == 3).all()
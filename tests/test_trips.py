@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from cbanalysis.main import Main
+from cbanalysis.sketches import MIN_DISTANCE, MIN_DURATION, TripStats
+from cbanalysis.stations import StationTable
+from cbanalysis.trips import trip_distances
+
+
+def test_trip_stats_match_groupby(tmp_path, rides_zip, station_geo):
+    job = Main(start_dir=tmp_path)
+    rides = job.dp.load_rename_rides(input_merged_rides=job.dp.concat_csvs())
+    stations = StationTable(station_geo)
+    rides = job.join_short_names(stations, rides)
+    bounds = {"duration": (600.0, 3000.0), "distance": (0.0, 10_000.0)}
+
+    seconds = (rides["stop_time"] - rides["start_time"]).dt.total_seconds()
+    meters = trip_distances(rides)
+    kept = seconds.between(*bounds["duration"]) & (meters <= 10_000)
+    df = pd.DataFrame(
+        {
+            "short_name": rides["start_short_name"].astype(str),
+            "start_hour": rides["start_hour"],
+            "duration": seconds,
+            "distance": meters,
+        }
+    )[kept]
+    grouped = df.groupby(["short_name", "start_hour"])
+
+    # Statistics of two chunks merged: exact counts and means, quantiles within 2%
+    half = len(rides) // 2
+    merged = TripStats.from_rides(rides.iloc[:half], stations, bounds=bounds).merge(
+        TripStats.from_rides(rides.iloc[half:], stations, bounds=bounds)
+    )
+    stats = merged.to_frame().set_index(["short_name", "start_hour"])
+    assert stats.index.equals(grouped.size().index)
+    assert (stats["trips"] == grouped.size()).all()
+    for name, minimum in [("duration", MIN_DURATION), ("distance", MIN_DISTANCE)]:
+        assert np.allclose(stats[f"mean_{name}"], grouped[name].mean(), rtol=1e-4)
+        for q in [0.5, 0.9]:
+            exact = grouped[name].quantile(q, interpolation="lower")
+            # Values under the sketch's minimum share the first bucket
+            assert np.allclose(
+                stats[f"p{round(q * 100)}_{name}"], exact, rtol=0.03, atol=minimum
+            )
+
+
+def test_trip_distances():
+    # About 111 km per degree of latitude; missing coordinates give NaN
+    rides = pd.DataFrame(
+        {
+            "start_lat": [40.0, 40.7, np.nan],
+            "start_lng": [-74.0, -74.0, -74.0],
+            "end_lat": [41.0, 40.7, 40.7],
+            "end_lng": [-74.0, -74.0, -74.0],
+        },
+        dtype="float32",
+    )
+    meters = trip_distances(rides)
+    assert meters.dtype == np.float32
+    assert abs(meters[0] - 111_195) < 50
+    assert meters[1] == 0
+    assert np.isnan(meters[2])
@@ -0,0 +1,33 @@
+from datetime import date
+
+import pytest
+
+from cbanalysis.utils import months_in_range, prefetch
+
+
+def test_months_in_range():
+    assert months_in_range("2021-11-01", "2022-02-01") == [
+        date(2021, 11, 1),
+        date(2021, 12, 1),
+        date(2022, 1, 1),
+        date(2022, 2, 1),
+    ]
+
+
+def test_prefetch_keeps_order_and_errors():
+    assert list(prefetch(range(100), size=3)) == list(range(100))
+
+    def failing():
+        yield 1
+        raise ValueError("bad chunk")
+
+    items = prefetch(failing())
+    assert next(items) == 1
+    with pytest.raises(ValueError, match="bad chunk"):
+        next(items)
+
+
+def test_prefetch_stops_early():
+    items = prefetch(iter(range(1_000_000)), size=2)
+    assert [next(items) for _ in range(3)] == [0, 1, 2]
+    items.close()